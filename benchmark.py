@@ -0,0 +1,340 @@
+### This script benchmarks the tower processing code on a synthetic day of
+### secondly observations.
+### Every pipeline stage (parse, QC, resampling, meteogram render, page
+### summary, ...) runs in its own fresh process so its wall time and peak
+### memory (RSS) are measured on their own, and stages that take too much of
+### their cron slot are flagged.
+###
+### Run all stages with "python benchmark.py", or some with "python benchmark.py qc render"
+### "--save FILE" writes the results as JSON and "--baseline FILE" flags regressions against them
+### The QC engine and the decimated meteogram are checked against the original
+### code by selftest_reference.py
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Number of observations to use in standard deviation check (1 s interval)
+nobs = 300
+
+# Number of standard deviations for the QC threshold
+nsigma = 0.75
+
+# Random seed for the synthetic data
+seed = 42
+
+# Resolution for the meteogram render stage (as make_rapid_plot.py)
+render_dpi = 600
+
+# Runs per stage (the fastest time and the largest memory are kept)
+repeat = 3
+
+# Cron slot (s) of the job each stage belongs to, and the fraction of it a stage may use
+cron_slots = {'parse': 600, 'qc': 600, 'qc_incremental': 600, 'resample': 900, 'render': 900, 'php': 900, 'php_warm': 900}
+slot_fraction = 0.5
+
+# Slowdown or memory growth against a baseline that counts as a regression
+tolerance = 0.25
+
+#####  END OPTIONS  #####
+
+# Import required modules
+from datetime import datetime, timedelta
+from contextlib import redirect_stdout
+from io import StringIO
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+from qc_engine import get_times, qc_file, qc_incremental
+
+### Helper functions
+
+# Function to create a synthetic day of secondly tower data
+# date, day to generate (UTC)
+# seed, random seed
+# Returns a data frame laid out like the rapid data files
+def synthetic_day(date=datetime(2025, 6, 1), seed=seed):
+
+    rng = np.random.default_rng(seed)
+    secs = np.arange(86400)
+    hour = secs/3600.0
+
+    # Smooth diurnal cycles plus noise
+    temp = 20.0+6.0*np.sin((hour-9.0)/24.0*2.0*np.pi)+rng.normal(0, 0.1, secs.size)
+    rh = np.clip(60.0-20.0*np.sin((hour-9.0)/24.0*2.0*np.pi)+rng.normal(0, 0.5, secs.size), 0, 100)
+    pres = 1005.0+2.0*np.sin(hour/24.0*2.0*np.pi)+rng.normal(0, 0.05, secs.size)
+    wspd = np.abs(3.0+rng.normal(0, 1.0, secs.size))
+    wdir = (200.0+rng.normal(0, 30.0, secs.size)) % 360.0
+    swdown = np.clip(900.0*np.sin((hour-6.0)/12.0*np.pi), 0, None)+rng.normal(0, 5.0, secs.size)
+
+    # Rain falls in steps during the afternoon
+    day_rain = np.zeros(secs.size)
+    for t0 in (14*3600, 14*3600+1200, 15*3600):
+        day_rain[t0:] += 0.25
+    rain_rate = np.zeros(secs.size)
+    rain_rate[14*3600:15*3600+600] = 3.0
+
+    # Spikes and missing values
+    for var in (temp, rh, pres, wspd):
+        idx = rng.choice(secs.size, 50, replace=False)
+        var[idx] += rng.choice([-1, 1], idx.size)*rng.uniform(5, 50, idx.size)
+        var[rng.choice(secs.size, 20, replace=False)] = -999
+
+    # Drop a few seconds and one longer outage
+    keep = rng.random(secs.size) > 0.02
+    keep[40000:41800] = False
+
+    stamps = [(date+timedelta(seconds=int(s))).strftime('%Y-%m-%d_%H:%M:%S') for s in secs[keep]]
+    return pd.DataFrame({
+        'Server Date (UTC)': stamps, 'Temp (C)': temp[keep], 'RH (%)': rh[keep], 'Pres (mb)': pres[keep],
+        'Rain Rate (mm/hr)': rain_rate[keep], 'Daily Total Rain (mm)': day_rain[keep], 'Wspd (m/s)': wspd[keep],
+        'Wdir (deg)': wdir[keep], 'SWdown (W/m2)': swdown[keep]
+    }).round(2)
+
+### Pipeline stages
+### Each function does the untimed set up and returns the work to time
+### tdir, directory holding the synthetic day (data_dir layout)
+### date, local date of the synthetic day
+
+# Function to get the synthetic rapid file
+def rapid_path(tdir, date):
+
+    return f'{tdir}/{date.year}/rapid_ValpoMetTower_{date.strftime("%Y%m%d")}.csv'
+
+# Writing a day as the feed does (one buffered writer, CSV and binary)
+def stage_write(tdir, date):
+
+    from tower_writer import DailyWriter
+    data_df = pd.read_csv(rapid_path(tdir, date))
+    stamps = pd.to_datetime(data_df['Server Date (UTC)'], format='%Y-%m-%d_%H:%M:%S').dt.to_pydatetime()
+    values = data_df.iloc[:, 1:9].values.tolist()
+    odir = tempfile.mkdtemp(dir=tdir)
+
+    def run():
+        writer = DailyWriter(odir, binary=True, flush_interval=10.0, flush_rows=60)
+        for stamp, row in zip(stamps, values):
+            writer.write(stamp-timedelta(hours=5), stamp, row)
+        writer.close()
+
+    return run
+
+# Reading the CSV and parsing the times
+def stage_parse(tdir, date):
+
+    return lambda: get_times(pd.read_csv(rapid_path(tdir, date)))
+
+# Full day QC (qc_rapid_data.py with incremental = False)
+def stage_qc(tdir, date):
+
+    return lambda: qc_file(rapid_path(tdir, date), f'{tdir}/qc_full.csv', nobs, nsigma)
+
+# Incremental QC of the last 10 minutes (qc_rapid_data.py on its 10 minute cron)
+def stage_qc_incremental(tdir, date):
+
+    with open(rapid_path(tdir, date), 'r') as fn:
+        lines = fn.read().split('\n')
+    partial = f'{tdir}/qc_partial.csv'
+    with open(partial, 'w') as fn:
+        fn.write('\n'.join(lines[:-600]))
+    qc_incremental(partial, f'{tdir}/qc_inc.csv', f'{tdir}/qc_inc.ckpt', nobs, nsigma)
+    with open(partial, 'a') as fn:
+        fn.write('\n'+'\n'.join(lines[-600:]))
+
+    return lambda: qc_incremental(partial, f'{tdir}/qc_inc.csv', f'{tdir}/qc_inc.ckpt', nobs, nsigma)
+
+# Interpolation and window averaging (make_rapid_plot.prepare_day, from the file)
+def stage_resample(tdir, date):
+
+    import make_rapid_plot
+    make_rapid_plot.data_dir = tdir
+    make_rapid_plot.read_window = lambda start, end: None # Always the file, never a running feed's ring buffer
+
+    return lambda: make_rapid_plot.prepare_day(date)
+
+# Meteogram update and render (make_rapid_plot.py)
+def stage_render(tdir, date):
+
+    import make_rapid_plot
+    from meteogram import Meteogram
+    make_rapid_plot.data_dir = tdir
+    make_rapid_plot.read_window = lambda start, end: None
+    itimes, wtimes, traces = make_rapid_plot.prepare_day(date)
+    meteo = Meteogram(dpi=render_dpi)
+
+    def run():
+        meteo.update(date, itimes, wtimes, traces)
+        meteo.render()
+
+    return run
+
+# Daily summary for make_php.py with no cache (first run of the day)
+def stage_php(tdir, date):
+
+    from daily_summary import update_summary
+    path = rapid_path(tdir, date)
+    if os.path.exists(path[:-4]+'.summary.json'):
+        os.remove(path[:-4]+'.summary.json')
+
+    return lambda: update_summary(path)
+
+# Daily summary for make_php.py with a cache and 15 minutes of new rows
+def stage_php_warm(tdir, date):
+
+    from daily_summary import update_summary
+    with open(rapid_path(tdir, date), 'r') as fn:
+        lines = fn.read().split('\n')
+    path = f'{tdir}/php_warm.csv'
+    with open(path, 'w') as fn:
+        fn.write('\n'.join(lines[:-900]))
+    update_summary(path)
+    with open(path, 'a') as fn:
+        fn.write('\n'+'\n'.join(lines[-900:]))
+
+    return lambda: update_summary(path)
+
+# Rolling the day up to every level (tower_rollup.py)
+def stage_rollup(tdir, date):
+
+    import tower_rollup
+    data = tower_rollup.load_day_records(tdir, date)
+
+    return lambda: [tower_rollup.aggregate(data, level) for level in tower_rollup.LEVELS]
+
+# Stages in pipeline order
+STAGES = {'write': stage_write, 'parse': stage_parse, 'qc': stage_qc, 'qc_incremental': stage_qc_incremental,
+          'resample': stage_resample, 'render': stage_render, 'php': stage_php, 'php_warm': stage_php_warm,
+          'rollup': stage_rollup}
+
+# Function to read the resident memory of this process
+# peak, True for the peak (since the last reset_peak_rss) rather than the current value
+# Returns MB
+def rss_mb(peak=False):
+
+    # Linux reports both in /proc, elsewhere only the lifetime peak is available
+    try:
+        with open('/proc/self/status', 'r') as fn:
+            for line in fn:
+                if line.startswith('VmHWM:' if peak else 'VmRSS:'):
+                    return int(line.split()[1])/1024.0
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+# Function to reset the peak resident memory so it covers one stage only (Linux)
+def reset_peak_rss():
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as fn:
+            fn.write('5')
+    except OSError:
+        pass
+
+# Function to run one stage in a fresh process
+# name, stage name
+# tdir, date, the synthetic day
+# queue, where the result goes
+def run_stage(name, tdir, date, queue):
+
+    try:
+        with redirect_stdout(StringIO()):
+            work = STAGES[name](tdir, date)
+            before = rss_mb()
+            reset_peak_rss()
+            t0 = time.perf_counter()
+            work()
+            seconds = time.perf_counter()-t0
+        peak = rss_mb(peak=True)
+        queue.put({'seconds': seconds, 'peak_mb': peak, 'growth_mb': max(0.0, peak-before)})
+    except Exception as err:
+        queue.put({'error': repr(err)})
+
+# Function to time the stages
+# names, stages to run
+# Returns a dictionary of results per stage
+def run_suite(names):
+
+    # One synthetic day, laid out like the data directory
+    date = datetime(2025, 6, 1)
+    tdir = tempfile.mkdtemp()
+    os.makedirs(f'{tdir}/{date.year}')
+    synthetic_day(date+timedelta(hours=5)).to_csv(rapid_path(tdir, date), index=False)
+
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    try:
+        for name in names:
+            runs = []
+            for i in range(repeat):
+                queue = ctx.Queue()
+                proc = ctx.Process(target=run_stage, args=(name, tdir, date, queue))
+                proc.start()
+                runs.append(queue.get())
+                proc.join()
+            errors = [run['error'] for run in runs if 'error' in run]
+            if errors:
+                results[name] = {'error': errors[0]}
+                print(f'{name:15s} FAILED {errors[0]}', flush=True)
+                continue
+
+            results[name] = {'seconds': min(run['seconds'] for run in runs), 'peak_mb': max(run['peak_mb'] for run in runs),
+                             'growth_mb': max(run['growth_mb'] for run in runs)}
+            res = results[name]
+            note = ''
+            if (name in cron_slots) and (res['seconds'] > slot_fraction*cron_slots[name]):
+                note = f'  WARNING uses {100*res["seconds"]/cron_slots[name]:.0f}% of its {cron_slots[name]:.0f} s cron slot'
+            print(f'{name:15s} {res["seconds"]:9.3f} s  peak {res["peak_mb"]:7.1f} MB  (+{res["growth_mb"]:.1f} MB in stage){note}', flush=True)
+    finally:
+        shutil.rmtree(tdir, ignore_errors=True)
+
+    return results
+
+# Function to compare results with a saved baseline
+# results, baseline, dictionaries of results per stage
+# Returns the number of regressions
+def compare_baseline(results, baseline):
+
+    nbad = 0
+    for name, res in results.items():
+        old = baseline.get(name)
+        if (old is None) or ('error' in res) or ('error' in old):
+            continue
+        for key, unit in (('seconds', 's'), ('peak_mb', 'MB')):
+            if (res[key] > (1.0+tolerance)*old[key]):
+                print(f'REGRESSION {name}: {key} {old[key]:.3f} -> {res[key]:.3f} {unit}')
+                nbad += 1
+
+    return nbad
+
+if __name__ == '__main__':
+
+    args = sys.argv[1:]
+    save = baseline = None
+    if ('--save' in args):
+        save = args.pop(args.index('--save')+1)
+        args.remove('--save')
+    if ('--baseline' in args):
+        baseline = args.pop(args.index('--baseline')+1)
+        args.remove('--baseline')
+
+    results = run_suite(args if args else list(STAGES.keys()))
+
+    if save:
+        with open(save, 'w') as fn:
+            json.dump(results, fn, indent=1)
+    nbad = 0
+    if baseline:
+        with open(baseline, 'r') as fn:
+            nbad = compare_baseline(results, json.load(fn))
+
+    sys.exit(1 if nbad else 0)
@@ -0,0 +1,150 @@
+### Streaming daily summary of the rapid met tower data.
+### Keeps the running daily extremes and the latest observation for a rapid
+### file in a small JSON file next to it (rapid_ValpoMetTower_YYYYMMDD.summary.json).
+### Each update reads only the bytes added since the last one, and a day
+### marked closed is never read again.
+### summary_from_records builds the same summary from tower_binary records
+### (e.g. a tower_ring.py snapshot) without touching the disk.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+from datetime import datetime, timezone
+import json
+import math
+import os
+import numpy as np
+import tower_archive
+from tower_binary import DTYPE
+from tower_writer import HEADER, STAMP
+
+# Running extremes: summary key, data column, max or min
+EXTREMES = (('temp_max', 'Temp (C)', max), ('temp_min', 'Temp (C)', min),
+            ('wspd_max', 'Wspd (m/s)', max), ('rain_max', 'Daily Total Rain (mm)', max))
+
+# Missing value marker used by the tower
+MISSING = -999.0
+
+# Data column for each binary record field
+COLUMNS = dict(zip(DTYPE.names[1:], HEADER.split(',')[1:]))
+FIELDS = {column: field for field, column in COLUMNS.items()}
+
+### Helper functions
+
+# Function to parse one data row
+# header, list of column names
+# line, the row text
+# Returns a dictionary of the row or None if the row is blank or incomplete
+def parse_row(header, line):
+
+    fields = line.strip().split(',')
+    if (len(header) < 2) or (len(fields) != len(header)):
+        return None
+    row = {header[0]: fields[0]}
+    try:
+        for key, value in zip(header[1:], fields[1:]):
+            row[key] = float(value)
+    except ValueError:
+        return None
+
+    return row
+
+# Function to fold one row into the summary
+# summary, the summary dictionary
+# row, the parsed row
+# Extremes are idempotent, so folding a row in twice is harmless
+def add_row(summary, row):
+
+    for key, column, func in EXTREMES:
+        value = row.get(column)
+        if (value is None) or math.isnan(value) or (value == MISSING):
+            continue
+        summary[key] = value if summary[key] is None else func(summary[key], value)
+    summary['last'] = row
+
+# Function to update the summary of a rapid file
+# path, rapid data file
+# closed, True once the day is over (reads to the end and never again)
+# Returns the summary dictionary
+def update_summary(path, closed=False):
+
+    spath = path[:-4]+'.summary.json'
+
+    # Load the cached summary
+    summary = None
+    if os.path.exists(spath):
+        with open(spath, 'r') as fn:
+            summary = json.load(fn)
+        if (not summary['closed']) and os.path.exists(path) and (summary['offset'] > os.path.getsize(path)):
+            summary = None
+        elif (summary['header'] is not None) and (len(summary['header']) < 2): # Cached from a partial header line
+            summary = None
+    if summary is None:
+        summary = {'offset': 0, 'header': None, 'last': None, 'closed': False}
+        for key, _, _ in EXTREMES:
+            summary[key] = None
+    if summary['closed']:
+        return summary
+
+    # Read the new bytes, keeping an unterminated final row for next time
+    with tower_archive.open_day(path, 'rb') as fn: # Closed days may be compressed
+        fn.seek(summary['offset'])
+        chunk = fn.read()
+
+    # The writer ends the header line only when the first row arrives, so wait for a whole line
+    if summary['header'] is None:
+        nl = chunk.find(b'\n')
+        if (nl < 0) and not closed:
+            return summary
+        size = len(chunk) if (nl < 0) else nl+1
+        summary['header'] = chunk[:size].decode('utf-8').strip().split(',')
+        summary['offset'] += size
+        chunk = chunk[size:]
+    header = summary['header']
+
+    cut = len(chunk) if closed else chunk.rfind(b'\n')+1
+    lines = chunk[:cut].decode('utf-8').split('\n')
+    tail = chunk[cut:].decode('utf-8', errors='ignore')
+    summary['offset'] += cut
+
+    # Update the running extremes
+    for line in lines:
+        row = parse_row(header, line) if header else None
+        if row is not None:
+            add_row(summary, row)
+
+    # The unterminated final row is normally complete, so use it as the latest observation
+    row = parse_row(header, tail) if (header and tail) else None
+    if row is not None:
+        add_row(summary, row)
+
+    summary['closed'] = closed
+    tmp = spath+'.tmp'
+    with open(tmp, 'w') as fn:
+        json.dump(summary, fn)
+    os.replace(tmp, spath)
+
+    return summary
+
+# Function to summarize an array of binary records
+# data, tower_binary structured array in time order
+# Returns a summary dictionary with the same keys as update_summary
+def summary_from_records(data):
+
+    summary = {'offset': None, 'header': HEADER.split(','), 'last': None, 'closed': False}
+    for key, column, func in EXTREMES:
+        values = data[FIELDS[column]]
+        values = values[np.isfinite(values) & (values != MISSING)]
+        if (values.size > 0):
+            summary[key] = float(values.max() if (func is max) else values.min())
+        else:
+            summary[key] = None
+
+    if (data.size > 0):
+        row = data[-1]
+        summary['last'] = {summary['header'][0]: datetime.fromtimestamp(int(row['time']), timezone.utc).strftime(STAMP)}
+        for field, column in COLUMNS.items():
+            summary['last'][column] = float(row[field])
+
+    return summary
@@ -0,0 +1,99 @@
+### Pixel-aware decimation of plot traces.
+### A day of secondly data is far more points than there are pixels across
+### a panel. These functions split a trace into one bucket per pixel and keep
+### only the points that change what is drawn:
+###   minmax - the smallest and largest value of each bucket, in time order,
+###            so gust peaks and spikes survive (2 points per pixel)
+###   last   - the last value of each bucket, for step functions like rain
+###   stride - every k-th point (cheapest, may drop peaks)
+###   none   - no decimation (all points)
+### Buckets with no valid data stay NaN so gaps still break the line.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+import numpy as np
+
+# Decimation methods for the meteogram traces (anything missing uses minmax)
+METHODS = {'rain': 'last'}
+
+### Helper functions
+
+# Function to split a trace into equal buckets
+# x, y, the trace
+# nbuckets, number of buckets
+# Returns x and y reshaped to (nbuckets, k), padded at the end with NaN
+def _buckets(x, y, nbuckets):
+
+    k = int(np.ceil(x.size/nbuckets))
+    nbuckets = int(np.ceil(x.size/k))
+    pad = nbuckets*k-x.size
+    x = np.concatenate((np.asarray(x, dtype='float'), np.full(pad, np.nan)))
+    y = np.concatenate((np.asarray(y, dtype='float'), np.full(pad, np.nan)))
+
+    return x.reshape(nbuckets, k), y.reshape(nbuckets, k)
+
+# Function for min/max decimation
+# x, y, the trace
+# nbuckets, number of buckets (e.g. the pixel width)
+def minmax(x, y, nbuckets):
+
+    xb, yb = _buckets(x, y, nbuckets)
+    valid = np.isfinite(yb)
+    empty = ~valid.any(axis=1)
+
+    # Positions of the extremes in each bucket (ignoring NaNs)
+    imin = np.argmin(np.where(valid, yb, np.inf), axis=1)
+    imax = np.argmax(np.where(valid, yb, -np.inf), axis=1)
+    first = np.minimum(imin, imax)
+    second = np.maximum(imin, imax)
+
+    rows = np.arange(xb.shape[0])
+    xout = np.column_stack((xb[rows, first], xb[rows, second])).ravel()
+    yout = np.column_stack((yb[rows, first], yb[rows, second])).ravel()
+
+    # Empty buckets keep their first time but no value
+    yout[np.repeat(empty, 2)] = np.nan
+
+    return xout, yout
+
+# Function to keep the last valid value of each bucket
+# x, y, the trace
+# nbuckets, number of buckets
+def last(x, y, nbuckets):
+
+    xb, yb = _buckets(x, y, nbuckets)
+    valid = np.isfinite(yb)
+
+    # Index of the last valid point (0 for empty buckets, which become NaN)
+    k = yb.shape[1]
+    ilast = k-1-np.argmax(valid[:, ::-1], axis=1)
+    rows = np.arange(xb.shape[0])
+    xout = xb[rows, ilast]
+    yout = yb[rows, ilast]
+    yout[~valid.any(axis=1)] = np.nan
+
+    return xout, yout
+
+# Function to keep every k-th point
+# x, y, the trace
+# nbuckets, number of points to keep (about)
+def stride(x, y, nbuckets):
+
+    step = max(1, int(np.ceil(x.size/nbuckets)))
+
+    return x[::step], y[::step]
+
+# Function to decimate a trace
+# x, y, the trace
+# npix, pixel width of the panel
+# method, 'minmax', 'last' or 'stride'
+def decimate(x, y, npix, method='minmax'):
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if (x.size <= 2*npix):
+        return x, y
+
+    return {'minmax': minmax, 'last': last, 'stride': stride}[method](x, y, npix)
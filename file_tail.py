@@ -0,0 +1,29 @@
+### Helpers for reading the end of a data file without reading all of it.
+### Standard library only, so light scripts (e.g. watchdog.py) stay fast.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+import os
+
+# Function to read the last line of a file by seeking back from the end
+# path, file to read
+# blocksize, number of bytes to read per step
+def read_last_line(path, blocksize=1024):
+
+    with open(path, 'rb') as fn:
+        fn.seek(0, os.SEEK_END)
+        pos = fn.tell()
+        tail = b''
+        while (pos > 0):
+            step = min(blocksize, pos)
+            pos -= step
+            fn.seek(pos)
+            tail = fn.read(step)+tail
+
+            # Stop once a complete line is in hand
+            if (b'\n' in tail.rstrip(b'\r\n')):
+                break
+
+    return tail.rstrip(b'\r\n').split(b'\n')[-1].decode('utf-8').strip()
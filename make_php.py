@@ -17,38 +17,56 @@ data_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower'
 
 # Import modules
 from datetime import datetime, timedelta
-import numpy as np
-import pandas
 from zoneinfo import ZoneInfo
+from daily_summary import summary_from_records, update_summary
+from time_axis import tower_day_bounds
+from tower_ring import read_window
 
 # Grab the current date (local time)
 timezone = ZoneInfo('America/Chicago')
 date1 = datetime.now(timezone)
 date2 = date1-timedelta(days=1)
 
-# Read the data
-data1 = pandas.read_csv(f'{data_dir}/{date1.year}/rapid_ValpoMetTower_{date1.strftime("%Y%m%d")}.csv')
+# Summarize today from the feed's shared memory ring buffer if it is running,
+# otherwise update the daily summaries (yesterday is closed, so it is only read once)
+records = read_window(*tower_day_bounds(date1))
+if (records is not None) and (records.size > 0):
+    data1 = summary_from_records(records)
+else:
+    data1 = update_summary(f'{data_dir}/{date1.year}/rapid_ValpoMetTower_{date1.strftime("%Y%m%d")}.csv')
+data2 = update_summary(f'{data_dir}/{date2.year}/rapid_ValpoMetTower_{date2.strftime("%Y%m%d")}.csv', closed=True)
 
-data2 = pandas.read_csv(f'{data_dir}/{date2.year}/rapid_ValpoMetTower_{date2.strftime("%Y%m%d")}.csv')
+# Function to convert a value for the page
+# value, value in the data's units (None, NaN or -999 when missing, e.g. a day with no rows yet)
+# scale, offset, unit conversion
+# spec, format of the converted value
+# Returns the formatted value, or '--' when missing
+def show(value, scale=1.0, offset=0.0, spec='.1f'):
+
+    if (value is None) or (value != value) or (value == -999.0):
+        return '--'
+
+    return format(value*scale+offset, spec)
 
 # Find the extremes
-Tmax1 = np.nanmax(data1['Temp (C)'])*1.8+32.0
-Tmin1 = np.nanmin(data1['Temp (C)'])*1.8+32.0
-Wind1 = np.nanmax(data1['Wspd (m/s)'])*2.237
-rain1 = np.nanmax(data1['Daily Total Rain (mm)'])*0.03937
+Tmax1 = show(data1['temp_max'], 1.8, 32.0)
+Tmin1 = show(data1['temp_min'], 1.8, 32.0)
+Wind1 = show(data1['wspd_max'], 2.237)
+rain1 = show(data1['rain_max'], 0.03937, spec='.2f')
 
-Tmax2 = np.nanmax(data2['Temp (C)'])*1.8+32.0
-Tmin2 = np.nanmin(data2['Temp (C)'])*1.8+32.0
-Wind2 = np.nanmax(data2['Wspd (m/s)'])*2.237
-rain2 = np.nanmax(data2['Daily Total Rain (mm)'])*0.03937
+Tmax2 = show(data2['temp_max'], 1.8, 32.0)
+Tmin2 = show(data2['temp_min'], 1.8, 32.0)
+Wind2 = show(data2['wspd_max'], 2.237)
+rain2 = show(data2['rain_max'], 0.03937, spec='.2f')
 
 # Get the latest data
-T0 = data1['Temp (C)'].values[-1]*1.8+32.0
-Wspd0 = data1['Wspd (m/s)'].values[-1]*2.237
-Wdir0 = data1['Wdir (deg)'].values[-1]
-sw0 = data1['SWdown (W/m2)'].values[-1]
-RH0 = data1['RH (%)'].values[-1]
-P0 = data1['Pres (mb)'].values[-1]
+last = data1['last'] or {}
+T0 = show(last.get('Temp (C)'), 1.8, 32.0)
+Wspd0 = show(last.get('Wspd (m/s)'), 2.237)
+Wdir0 = show(last.get('Wdir (deg)'), spec='.0f')
+sw0 = show(last.get('SWdown (W/m2)'))
+RH0 = show(last.get('RH (%)'), spec='.0f')
+P0 = show(last.get('Pres (mb)'))
 
 # Open the template and the new file
 fn_in = open(template, 'r')
@@ -60,15 +78,15 @@ for line in fn_in:
 
     if ("High Temperature" in line):
         if first:
-            newline = f"          <p>High Temperature: {Tmax1:.1f} °F<br>Low Temperature: {Tmin1:.1f} °F<br>Wind Gust: {Wind1:.1f} mph<br>Rainfall: {rain1:.2f} inches</p>\n"
+            newline = f"          <p>High Temperature: {Tmax1} °F<br>Low Temperature: {Tmin1} °F<br>Wind Gust: {Wind1} mph<br>Rainfall: {rain1} inches</p>\n"
             fn_out.write(newline)
             first = False
         else:
-            newline = f"          <p>High Temperature: {Tmax2:.1f} °F<br>Low Temperature: {Tmin2:.1f} °F<br>Wind Gust: {Wind2:.1f} mph<br>Rainfall: {rain2:.2f} inches</p>\n"
+            newline = f"          <p>High Temperature: {Tmax2} °F<br>Low Temperature: {Tmin2} °F<br>Wind Gust: {Wind2} mph<br>Rainfall: {rain2} inches</p>\n"
             fn_out.write(newline)
 
     elif ("Insolation" in line):
-        newline = f"          <p>Temperature: {T0:.1f} °F<br>Rel. Humidity: {RH0:.0f}%<br>Wind Speed: {Wspd0:.1f} mph<br>Wind Direction: {Wdir0:.0f}°<br>Pressure: {P0:.1f} mb<br>Insolation: {sw0:.1f} W m<sup>-2</sup><br><br>Last Updated<br>{date1.strftime('%b %d, %Y  %H:%M local')}</p>\n"
+        newline = f"          <p>Temperature: {T0} °F<br>Rel. Humidity: {RH0}%<br>Wind Speed: {Wspd0} mph<br>Wind Direction: {Wdir0}°<br>Pressure: {P0} mb<br>Insolation: {sw0} W m<sup>-2</sup><br><br>Last Updated<br>{date1.strftime('%b %d, %Y  %H:%M local')}</p>\n"
         fn_out.write(newline)
 
     else:
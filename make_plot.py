@@ -14,9 +14,15 @@ sdir = '/archive/campus_mesonet_data/images'
 # Tower longitude
 lat0 = 41.46
 
+# Tower timezone
+tz = 'America/Chicago'
+
 # Number of points to use in window averaging (each point is 1 minute)
 npts = 5
 
+# Longest gap in the data (s) drawn as a line, longer outages are left blank
+max_gap = 600.0
+
 # Font options for the plots
 fs = 18
 fw = 'bold'
@@ -25,81 +31,48 @@ fw = 'bold'
 
 
 ### Import required modules
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 from zoneinfo import ZoneInfo
 import matplotlib.pyplot as pp
 import numpy as np
-import pandas
-import pytz
-
-### Helper functions
-
-# Function to do the window averaging
-# var, variable to average
-def window_ave(var):
-
-    window = np.ones(npts)/npts
-    wvar = np.convolve(var, window, mode='valid')
-
-    return wvar
-
-# Function to determine the idealized solar insolation curve
-# day, day of year
-# wtimes, the plotting times
-def solar_curve(day, wtimes):
-
-    # Compute the declination angle of the Earth
-    dec_angle = 23.45 * np.sin(np.radians(360 * (284 + day) / 365))
-
-    # Calculate the solar angles
-    hour_angles = (wtimes/3600.0-12.0)*15.0
-    solar_angles = np.arcsin(
-        np.sin(np.radians(lat0))*np.sin(np.radians(dec_angle))+
-        np.cos(np.radians(lat0))*np.cos(np.radians(dec_angle))*np.cos(np.radians(hour_angles))
-    )
-    solar_curve = 1361.0*np.sin(solar_angles)
-    solar_curve[solar_angles<=0] = 0.0
-
-    return solar_curve
+from meteogram import solar_curve
+from resample import resample
+import tower_archive
+import smooth
+from time_axis import parse_stamps, seconds_of_day, tower_to_utc
 
 # Grab the current date (local time)
-#timezone = ZoneInfo('America/Central')
-timezone = pytz.timezone('US/Central')
-date = datetime.now(timezone)
+date = datetime.now(ZoneInfo(tz))
 
 # Read the data
-data = pandas.read_csv(f'{data_dir}/{date.year}/ValpoMetTower_{date.strftime("%Y%m%d")}.csv')
+data = tower_archive.read_csv(f'{data_dir}/{date.year}/ValpoMetTower_{date.strftime("%Y%m%d")}.csv')
 
-# Check if day light savings time
-# Logic set this way beause the tower is naturally in DST
-if (date > datetime(date.year, 3, 9, tzinfo=timezone)) and (date < datetime(date.year, 11, 2, tzinfo=timezone)):
-    dst_value = 0
-else:
-    dst_value = -1
-
-# Convert dates into times
-dates = [datetime.strptime(date, "%Y-%m-%d_%H:%M:%S") for date in data["Date (YYYY-MM-DD_HH:MM:SS local)"].values]
-times = np.array([(date-dates[0]).total_seconds() for date in dates], dtype='float')+(dates[0].hour*3600.0+dates[0].minute*60.0+dates[0].second)+dst_value*3600.0
+# Convert dates into local seconds since midnight
+# The tower clock stays on daylight time all year, so shift it to UTC first
+epoch = tower_to_utc(parse_stamps(data["Date (YYYY-MM-DD_HH:MM:SS local)"].values))
+times = seconds_of_day(epoch, date, tz)
 
 # Extract the data from the dataframe and interpolate it to one minutely intervals
-itemp = np.interp(np.arange(0, 86400.0+60.0, 60), times, data['Temp (C)'], left=np.nan, right=np.nan)
-irh = np.interp(np.arange(0, 86400.0+60.0, 60), times, data['RH (%)'], left=np.nan, right=np.nan)
-ipres = np.interp(np.arange(0, 86400.0+60.0, 60), times, data['Pres (mb)'], left=np.nan, right=np.nan)
-irain = np.interp(np.arange(0, 86400.0+60.0, 60), times, data['Rain (mm)'], left=np.nan, right=np.nan)*0.03937 # mm -> inches
-iwspd = np.interp(np.arange(0, 86400.0+60.0, 60), times, data['Wspd (m/s)'], left=np.nan, right=np.nan)
-iwdir = np.interp(np.arange(0, 86400.0+60.0, 60), times, data['Wdir (deg)'], left=np.nan, right=np.nan)
-isw = np.interp(np.arange(0, 86400.0+60.0, 60), times, data['SWdown (W/m2)'], left=np.nan, right=np.nan)
 itimes = np.arange(0, 86400.0+60.0, 60)
-
-
-# Do the window averaging for the other variables
-wtemp = window_ave(itemp)
-wrh = window_ave(irh)
-wpres = window_ave(ipres)
-wwspd = window_ave(iwspd)
-wwdir = window_ave(iwdir)
-wsw = window_ave(isw)
-wtimes = window_ave(itimes)
+idata = resample(times, data, ['Temp (C)', 'RH (%)', 'Pres (mb)', 'Rain (mm)', 'Wspd (m/s)', 'Wdir (deg)', 'SWdown (W/m2)'],
+                 itimes, max_gap)
+itemp = idata['Temp (C)']
+irh = idata['RH (%)']
+ipres = idata['Pres (mb)']
+irain = idata['Rain (mm)']*0.03937 # mm -> inches
+iwspd = idata['Wspd (m/s)']
+iwdir = idata['Wdir (deg)']
+isw = idata['SWdown (W/m2)']
+
+
+# Do the window averaging for the other variables (on the same times, wind direction as a vector average)
+wtemp = smooth.mean(itemp, npts)
+wrh = smooth.mean(irh, npts)
+wpres = smooth.mean(ipres, npts)
+wwspd = smooth.mean(iwspd, npts)
+wwdir = smooth.direction(iwdir, npts, iwspd)
+wsw = smooth.mean(isw, npts)
+wtimes = itimes
 
 ### Make the meteogram
 fig, axes = pp.subplots(nrows=4, figsize=(12,14), dpi=600, constrained_layout=True)
@@ -155,7 +128,7 @@ axrain.set_ylim(0, max(1,np.max(irain)+1))
 
 # Solar radiation
 axes[3].plot(wtimes, wsw, color='darkgoldenrod', label='Insolation')
-ideal_sun = solar_curve((dates[0]-datetime(year=dates[0].year, month=1, day=1)).total_seconds()/86400.0+1, itimes)
+ideal_sun = solar_curve(date.timetuple().tm_yday, itimes, lat0)
 axes[3].fill_between(itimes, ideal_sun, color='gold', alpha=0.20)
 axes[3].fill_between(itimes, 0, 1, where=ideal_sun<5, color='gray', alpha=0.20, transform=axes[3].get_xaxis_transform())
 
@@ -164,8 +137,8 @@ axes[3].set_ylabel('Solar Insolation (W m$^{-2}$)', fontsize=fs, fontweight=fw)
 axes[3].set_xlabel('Time (local)', fontsize=fs, fontweight=fw)
 
 # Atmospheric transmission
-iwsw = np.interp(itimes, wtimes, wsw)
-tau = iwsw/ideal_sun
+with np.errstate(invalid='ignore', divide='ignore'):
+    tau = wsw/ideal_sun
 tau[ideal_sun <= 50] = np.nan
 axsun = axes[3].twinx()
 axsun.plot(itimes, tau, color='black', linestyle='--')
@@ -1,4 +1,6 @@
 ### This script creates a meteogram using the Valpo Met Tower data
+### Run once (e.g. from cron) or with "--service" to keep running and
+### update the same figure every update_interval seconds.
 ### Christopher Phillips
 ### Valparaiso Univ.
 ### Sept. 13 2024
@@ -14,194 +16,130 @@ sdir = '/archive/campus_mesonet_data/images'
 # Tower longitude
 lat0 = 41.46
 
-# Tower timezone (hours from UTC)
-tz = -6
+# Tower timezone
+tz = 'America/Chicago'
 
 # Number of points to use in window averaging (each point is 1 second)
 npts = 120
 
+# Longest gap in the data (s) drawn as a line, longer outages are left blank
+max_gap = 300.0
+
 # Font options for the plots
 fs = 18
 fw = 'bold'
 
+# Resolution of the saved figure
+dpi = 600
+
+# Seconds between updates when running as a service
+update_interval = 900.0
+
 #####  END OPTIONS  #####
 
 
 ### Import required modules
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 from zoneinfo import ZoneInfo
-import matplotlib.pyplot as pp
+import sys
+import time
 import numpy as np
-import pandas
-import pytz
+from meteogram import Meteogram, solar_curve
+from daily_summary import COLUMNS
+from resample import resample
+import tower_archive
+import smooth
+from time_axis import parse_stamps, seconds_of_day, tower_day_bounds
+from tower_ring import read_window
 
 ### Helper functions
 
-# Function to do the window averaging
-# var, variable to average
-def window_ave(var):
-
-    window = np.ones(npts)/npts
-    wvar = np.convolve(var, window, mode='valid')
-
-    return wvar
-
-# Function to determine the idealized solar insolation curve
-# day, day of year
-# wtimes, the plotting times
-def solar_curve(day, wtimes):
-
-    # Compute the declination angle of the Earth
-    dec_angle = 23.45 * np.sin(np.radians(360 * (284 + day) / 365))
-
-    # Calculate the solar angles
-    hour_angles = (wtimes/3600.0-12.0)*15.0
-    solar_angles = np.arcsin(
-        np.sin(np.radians(lat0))*np.sin(np.radians(dec_angle))+
-        np.cos(np.radians(lat0))*np.cos(np.radians(dec_angle))*np.cos(np.radians(hour_angles))
-    )
-    solar_curve = 1361.0*np.sin(solar_angles)
-    solar_curve[solar_angles<=0] = 0.0
-
-    return solar_curve
-
-# Grab the current date (local time)
-timezone = pytz.timezone('US/Central')
-date = datetime.now(timezone)
-
-# Read the data
-data = pandas.read_csv(f'{data_dir}/{date.year}/rapid_ValpoMetTower_{date.strftime("%Y%m%d")}.csv')
-
-# Check if day light savings time
-# Logic set this way beause the tower is naturally in DST
-if (date > datetime(date.year, 3, 9, tzinfo=timezone)) and (date < datetime(date.year, 11, 2, tzinfo=timezone)):
-    dst_value = 1
-else:
-    dst_value = 0
-
-# Convert dates into times
-dates = [datetime.strptime(date, "%Y-%m-%d_%H:%M:%S") for date in data["Server Date (UTC)"].values]
-times = np.array([(date-dates[0]).total_seconds() for date in dates], dtype='float')+(dates[0].hour*3600.0+dates[0].minute*60.0+dates[0].second)+dst_value*3600.0+tz*3600.0
-#dates = [datetime.strptime(date, "%Y-%m-%d_%H:%M:%S") for date in data["Tower Date (local)"].values]
-#times = np.array([(date-dates[0]).total_seconds() for date in dates], dtype='float')+(dates[0].hour*3600.0+dates[0].minute*60.0+dates[0].second)+dst_value*3600.0
-
-# Extract the data from the dataframe and interpolate it to one secondly intervals
-itemp = np.interp(np.arange(0, 86400.0+1.0, 1), times, data['Temp (C)'], left=np.nan, right=np.nan)
-irh = np.interp(np.arange(0, 86400.0+1.0, 1), times, data['RH (%)'], left=np.nan, right=np.nan)
-ipres = np.interp(np.arange(0, 86400.0+1.0, 1), times, data['Pres (mb)'], left=np.nan, right=np.nan)
-irain = np.interp(np.arange(0, 86400.0+1.0, 1), times, data['Daily Total Rain (mm)'], left=np.nan, right=np.nan)*0.03937 # mm -> inches
-iwspd = np.interp(np.arange(0, 86400.0+1.0, 1), times, data['Wspd (m/s)'], left=np.nan, right=np.nan)
-iwdir = np.interp(np.arange(0, 86400.0+1.0, 1), times, data['Wdir (deg)'], left=np.nan, right=np.nan)
-isw = np.interp(np.arange(0, 86400.0+1.0, 1), times, data['SWdown (W/m2)'], left=np.nan, right=np.nan)
-itimes = np.arange(0, 86400.0+1.0, 1)
-
-# Compute the dewpoint
-e = 611.2*np.exp(17.67*itemp/(itemp+243.5))*irh/100.0
-Td = -243.5*np.log(e/611.2)/(np.log(e/611.2)-17.67)
-TdF = (Td*1.8)+32.0
-
-# Do the window averaging for the other variables
-wtemp = window_ave(itemp)
-wdewp = window_ave(TdF)
-wrh = window_ave(irh)
-wpres = window_ave(ipres)
-wwspd = window_ave(iwspd)
-wwdir = window_ave(iwdir)
-wsw = window_ave(isw)
-wtimes = window_ave(itimes)
-
-### Make the meteogram
-fig, axes = pp.subplots(nrows=4, figsize=(12,14), dpi=600, constrained_layout=True)
-
-# Temperature
-wtempF = (wtemp*1.8)+32.0
-axes[0].plot(wtimes, wtempF, color='firebrick', label='T')
-axes[0].plot(wtimes, wdewp, color='forestgreen', label='Td')
-axes[0].plot([0,0],[-100,-100], color='steelblue', label='RH') # Ghost line for RH
-
-try:
-    axes[0].set_ylim(np.floor(np.nanmin(wdewp)*0.95), np.ceil(np.nanmax(wtempF)*1.05))
-except:
-    pass
-axes[0].legend(shadow=True, fontsize=14)
-axes[0].set_ylabel('Temperature (°F)', fontsize=fs, fontweight=fw)
-
-axes[0].set_title(f'Current Campus Observations - {date.strftime("%b %d, %Y")}\nTwo-minute Average', fontsize=fs, fontweight=fw)
-
-# Relative humidity
-axrh = axes[0].twinx()
-axrh.plot(wtimes, wrh, color='steelblue')
-axrh.set_ylim(0, 105)
-axrh.set_yticks([0, 20, 40, 60, 80, 100])
-axrh.set_ylabel('Relative humidity (%)', fontsize=fs, fontweight=fw)
-
-# Wind Speed
-axes[1].plot(wtimes, wwspd*2.237, color='black', label='Speed')
-axes[1].plot([0,0],[-10,-10], color='goldenrod', linestyle=':', label='Direction') # Ghost line for legend
-
-axes[1].set_ylim(0, np.ceil(np.nanmax(wwspd*2.237)*1.05))
-axes[1].set_ylabel('Wind Speed (mph)',  fontsize=fs, fontweight=fw)
-axes[1].legend(shadow=True, fontsize=14)
-
-# Wind Direction
-axdir = axes[1].twinx()
-axdir.plot(wtimes, wwdir, color='goldenrod', linestyle=':')
-
-axdir.set_ylim(0, 360)
-axdir.set_ylabel('Wind Direction (°)',  fontsize=fs, fontweight=fw)
-axdir.set_yticks(np.arange(0,405,45))
-axdir.set_yticklabels(['N','NE','E','SE','S','SW','W','NW','N'])
-
-# Pressure
-axes[2].plot(wtimes, wpres, color='black', label="Pressure", zorder=10)
-axes[2].set_ylabel('Pressure (mb)', fontsize=fs, fontweight=fw)
-axes[2].set_ylim(np.floor(np.nanmin(wpres))-5, np.ceil(np.nanmax(wpres)+5))
-axes[2].plot([0,0],[-10,-10], color='steelblue', label='Rainfall') # Ghost line for legend
-axes[2].legend(shadow=True, fontsize=14)
-
-# Rainfall
-axrain = axes[2].twinx()
-axrain.plot(itimes[np.isfinite(irain)], irain[np.isfinite(irain)], color='steelblue')
-axrain.fill_between(itimes[np.isfinite(irain)], irain[np.isfinite(irain)], color='steelblue')
-
-axrain.set_ylabel('Rainfall (inches)', fontsize=fs, fontweight=fw)
-axrain.set_ylim(0, max(1,np.max(irain)+1))
-
-# Solar radiation
-axes[3].plot(wtimes, wsw, color='darkgoldenrod', label='Insolation')
-ideal_sun = solar_curve((dates[0]-datetime(year=dates[0].year, month=1, day=1)).total_seconds()/86400.0+1, itimes)
-axes[3].fill_between(itimes, ideal_sun, color='gold', alpha=0.20)
-axes[3].fill_between(itimes, 0, 1, where=ideal_sun<5, color='gray', alpha=0.20, transform=axes[3].get_xaxis_transform())
-
-axes[3].set_ylim(0, np.ceil(np.nanmax(ideal_sun)*1.05))
-axes[3].set_ylabel('Solar Insolation (W m$^{-2}$)', fontsize=fs, fontweight=fw)
-axes[3].set_xlabel('Time (Local)', fontsize=fs, fontweight=fw)
-
-# Atmospheric transmission
-iwsw = np.interp(itimes, wtimes, wsw)
-tau = iwsw/ideal_sun
-tau[ideal_sun <= 50] = np.nan
-axsun = axes[3].twinx()
-axsun.plot(itimes, tau, color='black', linestyle='--')
-axsun.set_ylim(0.0, 1.0)
-
-axsun.set_ylabel('Transmissivity', fontsize=fs, fontweight=fw)
-axes[3].plot([0,0], [-100,-100], color='black', linestyle='--', label="T")
-axes[3].legend(shadow=True, fontsize=14)
-
-# Add a grid to everything and handle tick labels
-for ax in axes:
-    ax.grid()
-    ax.set_xlim(0,86400)
-    ax.set_xticks(np.arange(0, 93600, 7200))
-    ax.set_xticklabels(np.arange(0, 26, 2, dtype=int)%24, fontsize=12)
-    ax.tick_params(axis='y', labelsize=14)
-axrain.tick_params(axis='y', labelsize=14)
-axdir.tick_params(axis='y', labelsize=14)
-axrh.tick_params(axis='y', labelsize=14)
-axsun.tick_params(axis='y', labelsize=14)
-
-# Save the figure
-pp.savefig(f'{sdir}/ValpoMetTower_{date.strftime("%Y%m%d")}.png')
-pp.savefig(f'{sdir}/ValpoMetTower_current_obs.png')
-pp.close()
+# Function to read a day of data
+# date, the day to read (local)
+# Returns the observation times (epoch seconds UTC) and a dictionary of data columns
+def read_day(date):
+
+    # The feed's shared memory ring buffer holds the same records as the daily file
+    records = read_window(*tower_day_bounds(date))
+    if (records is not None) and (records.size > 0):
+        return records['time'], {column: records[field].astype('float') for field, column in COLUMNS.items()}
+
+    data = tower_archive.read_csv(f'{data_dir}/{date.year}/rapid_ValpoMetTower_{date.strftime("%Y%m%d")}.csv')
+
+    return parse_stamps(data["Server Date (UTC)"].values), data
+
+# Function to read and prepare a day of data for plotting
+# date, the day to plot (local)
+# Returns the one-secondly times, the window averaged times (the same times) and the traces
+def prepare_day(date):
+
+    # Read the data
+    epoch, data = read_day(date)
+
+    # Convert dates into local seconds since midnight
+    times = seconds_of_day(epoch, date, tz)
+
+    # Extract the data from the dataframe and interpolate it to one secondly intervals
+    itimes = np.arange(0, 86400.0+1.0, 1)
+    idata = resample(times, data, ['Temp (C)', 'RH (%)', 'Pres (mb)', 'Daily Total Rain (mm)', 'Wspd (m/s)', 'Wdir (deg)', 'SWdown (W/m2)'],
+                     itimes, max_gap)
+    itemp = idata['Temp (C)']
+    irh = idata['RH (%)']
+    ipres = idata['Pres (mb)']
+    irain = idata['Daily Total Rain (mm)']*0.03937 # mm -> inches
+    iwspd = idata['Wspd (m/s)']
+    iwdir = idata['Wdir (deg)']
+    isw = idata['SWdown (W/m2)']
+
+    # Compute the dewpoint
+    with np.errstate(invalid='ignore', divide='ignore'):
+        e = 611.2*np.exp(17.67*itemp/(itemp+243.5))*irh/100.0
+        Td = -243.5*np.log(e/611.2)/(np.log(e/611.2)-17.67)
+    TdF = (Td*1.8)+32.0
+
+    # Do the window averaging for the other variables (on the same times, wind direction as a vector average)
+    wtimes = itimes
+    wsw = smooth.mean(isw, npts)
+
+    # Atmospheric transmission
+    ideal_sun = solar_curve(date.timetuple().tm_yday, itimes, lat0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tau = wsw/ideal_sun
+    tau[ideal_sun <= 50] = np.nan
+
+    traces = {'tempF': smooth.mean(itemp, npts)*1.8+32.0, 'dewpF': smooth.mean(TdF, npts), 'rh': smooth.mean(irh, npts),
+              'wspd': smooth.mean(iwspd, npts)*2.237, 'wdir': smooth.direction(iwdir, npts, iwspd), 'pres': smooth.mean(ipres, npts), 'sw': wsw,
+              'rain': irain, 'ideal_sun': ideal_sun, 'tau': tau}
+
+    return itimes, wtimes, traces
+
+# Function to update the meteogram and write both images from one rendering
+# meteo, the Meteogram to update
+def update_plot(meteo):
+
+    date = datetime.now(ZoneInfo(tz))
+    itimes, wtimes, traces = prepare_day(date)
+    meteo.update(date, itimes, wtimes, traces)
+    meteo.save([f'{sdir}/ValpoMetTower_{date.strftime("%Y%m%d")}.png', f'{sdir}/ValpoMetTower_current_obs.png'])
+
+if __name__ == '__main__':
+
+    ### Make the meteogram
+    meteo = Meteogram(subtitle='Two-minute Average', dpi=dpi, fs=fs, fw=fw)
+
+    if ('--service' not in sys.argv):
+        update_plot(meteo)
+        sys.exit(0)
+
+    # Keep the figure and update it on a fixed schedule
+    next_update = time.monotonic()
+    while True:
+        t0 = time.monotonic()
+        try:
+            update_plot(meteo)
+            print(f'[{datetime.now(ZoneInfo(tz)).strftime("%Y-%m-%d %H:%M:%S")}] Updated in {time.monotonic()-t0:.1f} s', flush=True)
+        except Exception as err:
+            print('WARNING', err, flush=True)
+
+        next_update += update_interval
+        time.sleep(max(0.0, next_update-time.monotonic()))
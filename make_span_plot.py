@@ -0,0 +1,133 @@
+### This script creates weekly, monthly and yearly meteograms of the Valpo Met Tower data
+### Data come from tower_query.py, which reads the coarsest rollup level
+### (tower_rollup.py) that still resolves the span, so a month needs a few
+### thousand points instead of millions of secondly rows.
+###
+### "python make_span_plot.py" makes every span in the options, ending today
+### "python make_span_plot.py DAYS" makes the last DAYS days
+### "python make_span_plot.py YYYY-MM-DD YYYY-MM-DD" makes the days from the first date up to the second
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Directory to save the plots
+sdir = '/archive/campus_mesonet_data/images'
+
+# Tower latitude
+lat0 = 41.46
+
+# Tower timezone
+tz = 'America/Chicago'
+
+# Spans made by default (name, days)
+spans = {'week': 7, 'month': 30, 'year': 365}
+
+# Fewest points across a plot (selects the rollup level)
+npoints = 1000
+
+# Font options for the plots
+fs = 18
+fw = 'bold'
+
+# Resolution of the saved figure
+dpi = 300
+
+#####  END OPTIONS  #####
+
+### Import required modules
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import sys
+import time
+import numpy as np
+from meteogram import Meteogram, solar_curve
+from time_axis import seconds_of_day, to_local
+from tower_query import auto_resolution, on_grid, query
+from tower_rollup import LEVELS
+
+# Subtitle for each resolution
+SUBTITLES = {'raw': 'One-second Data', '1min': 'One-minute Average', '10min': 'Ten-minute Average',
+             '1h': 'Hourly Average', '1day': 'Daily Average'}
+
+### Helper functions
+
+# Function to get the epoch seconds of local midnight
+# day, the local date
+def midnight(day):
+
+    return int(datetime(day.year, day.month, day.day, tzinfo=ZoneInfo(tz)).timestamp())
+
+# Function to read and prepare a span of data for plotting
+# first, last, the first and last local dates to plot
+# Returns the plotting times (s since local midnight of the first day), the traces and the resolution used
+def prepare_span(first, last):
+
+    start = midnight(first)
+    end = midnight(last+timedelta(days=1))
+    resolution = auto_resolution(start, end, npoints)
+    step = 1 if (resolution == 'raw') else LEVELS[resolution]
+
+    # Read the variables on a regular grid so missing data leave gaps
+    result = query(start, end, ['temp', 'rh', 'pres', 'day_rain', 'wspd', 'wdir', 'swdown'], resolution)
+    grid, data = on_grid(result, start, end, step)
+    times = seconds_of_day(grid, first, tz)
+
+    # Compute the dewpoint
+    temp = data['temp']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        e = 611.2*np.exp(17.67*temp/(temp+243.5))*data['rh']/100.0
+        Td = -243.5*np.log(e/611.2)/(np.log(e/611.2)-17.67)
+
+    # Clear sky insolation and atmospheric transmission from the local day and time of each point
+    local = to_local(grid, tz).astype('datetime64[s]')
+    days = local.astype('datetime64[D]')
+    doy = (days-days.astype('datetime64[Y]')).astype('int')+1
+    ideal_sun = solar_curve(doy, (local-days).astype('float'), lat0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tau = data['swdown']/ideal_sun
+    tau[ideal_sun <= 50] = np.nan
+
+    traces = {'tempF': temp*1.8+32.0, 'dewpF': Td*1.8+32.0, 'rh': data['rh'], 'wspd': data['wspd']*2.237,
+              'wdir': data['wdir'], 'pres': data['pres'], 'sw': data['swdown'], 'rain': data['day_rain']*0.03937,
+              'ideal_sun': ideal_sun, 'tau': tau}
+
+    return times, traces, resolution
+
+# Function to plot a span and save it
+# meteo, the Meteogram to update
+# first, last, the first and last local dates to plot
+# path, file to write
+def plot_span(meteo, first, last, path):
+
+    t0 = time.time()
+    times, traces, resolution = prepare_span(first, last)
+
+    # One tick per day for short spans, about ten ticks otherwise
+    ndays = (last-first).days+1
+    step = max(1, int(round(ndays/10)))
+    ticks = np.arange(0, ndays+1, step)
+    meteo.set_time_axis(ndays*86400, ticks*86400, [(first+timedelta(days=int(k))).strftime('%b %d') for k in ticks])
+
+    meteo.subtitle = SUBTITLES[resolution]
+    meteo.update(first, times, times, traces, label=f'{first.strftime("%b %d, %Y")} to {last.strftime("%b %d, %Y")}')
+    meteo.save([path])
+    print(f'{path}: {ndays} days of {resolution} data in {time.time()-t0:.1f} s', flush=True)
+
+if __name__ == '__main__':
+
+    meteo = Meteogram(dpi=dpi, fs=fs, fw=fw)
+    meteo.axes[3].set_xlabel('Date (Local)', fontsize=fs, fontweight=fw)
+    today = datetime.now(ZoneInfo(tz)).date()
+
+    if (len(sys.argv) == 3):
+        first = datetime.strptime(sys.argv[1], '%Y-%m-%d').date()
+        last = datetime.strptime(sys.argv[2], '%Y-%m-%d').date()-timedelta(days=1)
+        plot_span(meteo, first, last, f'{sdir}/ValpoMetTower_{first.strftime("%Y%m%d")}_{last.strftime("%Y%m%d")}.png')
+    elif (len(sys.argv) == 2):
+        first = today-timedelta(days=int(sys.argv[1])-1)
+        plot_span(meteo, first, today, f'{sdir}/ValpoMetTower_last{sys.argv[1]}days.png')
+    else:
+        for name, ndays in spans.items():
+            plot_span(meteo, today-timedelta(days=ndays-1), today, f'{sdir}/ValpoMetTower_{name}.png')
@@ -0,0 +1,115 @@
+### This script polls every station of the campus mesonet (stations.py) from
+### one process. Each station has its own keep-alive poller (tower_poller.py)
+### running as a separate asyncio task on the shared event loop, so all
+### stations are fetched concurrently every second, each request has its own
+### timeout, and a slow or dead station only backs off itself. Observations go
+### to per-station daily files through one DailyWriter per station.
+###
+### Run with "python mesonet_retrieve_data.py [registry.json]"
+### (use instead of rapid_retrieve_data.py, not alongside it)
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Polling options
+interval = 1.0 # Seconds between polls
+timeout = 0.8 # Seconds allowed for one request
+max_backoff = 30.0 # Longest wait (seconds) between retries while a station is down
+
+#####  END OPTIONS  #####
+
+### Import libraries
+import asyncio
+import signal
+import sys
+import rapid_retrieve_data as feed
+import stations
+from tower_metrics import METRICS
+from tower_poller import TowerPoller, poll_forever
+from tower_status import StatusParser, TagMismatch
+from tower_writer import DailyWriter
+
+### One station of the mesonet
+class Station:
+
+    # sid, station id
+    # entry, station entry from stations.load
+    def __init__(self, sid, entry):
+
+        self.id = sid
+        self.poller = TowerPoller(entry['url'], timeout=timeout)
+        self.backoff = 0.0 # Wait (seconds) before restarting the poller after an error
+        self.parser = StatusParser(entry['tags'], f'{entry["sdir"]}/status_tags.json')
+
+        # Buffering and fsync follow the tower feed's options
+        if entry['feed']:
+            self.writer = feed.make_writer()
+        else:
+            self.writer = DailyWriter(entry['sdir'], prefix=entry['prefix'], binary=feed.write_binary, flush_interval=feed.flush_interval,
+                                      flush_rows=feed.flush_rows, fsync=feed.fsync)
+
+    # Function called by the poller for every status page
+    def handle(self, server_time, payload):
+
+        feed.process(self.writer, server_time, payload, self.parser)
+        self.backoff = 0.0
+
+    # Function to poll the station until cancelled
+    # Errors stay with the station: it backs off and restarts its poller (or stops if its tags changed)
+    # while the other stations keep polling
+    async def run(self):
+
+        while True:
+            try:
+                await poll_forever(self.poller, self.handle, interval=interval, max_backoff=max_backoff, label=self.id)
+            except TagMismatch as err:
+                print('ERROR', self.id, 'stopped:', err, flush=True)
+                return
+            except Exception as err:
+                METRICS.inc('station_errors')
+                self.backoff = min(max(interval, self.backoff*2.0), max_backoff)
+                print('WARNING', self.id, type(err).__name__, err, f'(restarting in {self.backoff:.0f} s)', flush=True)
+            finally:
+                await self.poller.close()
+            await asyncio.sleep(self.backoff)
+
+# Function to write out buffered rows of every station once they are due
+# writers, DailyWriters of the stations
+async def flush_forever(writers):
+
+    while True:
+        await asyncio.sleep(1.0)
+        for writer in writers:
+            try:
+                writer.flush(force=False)
+            except OSError as err:
+                print('WARNING could not flush', writer.path, err, flush=True)
+
+# Function to poll every station, flush the writers and export the metrics together
+# mesonet, list of Stations
+async def main(mesonet):
+
+    if feed.metrics_port is not None:
+        await METRICS.serve(port=feed.metrics_port)
+    METRICS.set('stations', len(mesonet))
+    await asyncio.gather(*[station.run() for station in mesonet], flush_forever([station.writer for station in mesonet]),
+                         METRICS.write_forever(feed.metrics_file, feed.metrics_interval))
+
+if __name__ == '__main__':
+
+    registry = stations.load(sys.argv[1] if (len(sys.argv) > 1) else stations.registry_file)
+    mesonet = [Station(sid, entry) for sid, entry in registry.items()]
+    print(f'Polling {len(mesonet)} stations: {", ".join(station.id for station in mesonet)}', flush=True)
+
+    # SIGTERM closes the daily files like Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        asyncio.run(main(mesonet))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for station in mesonet:
+            station.writer.close()
@@ -0,0 +1,213 @@
+### Reusable four panel meteogram for the Valpo Met Tower data.
+### The figure, axes and lines are built once. Each update swaps the line
+### data in place (set_data), decimates every trace to the figure's pixel
+### width (see decimate.py) and renders a single PNG that can be written to
+### several files.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import required modules
+from io import BytesIO
+import os
+import matplotlib.pyplot as pp
+import numpy as np
+import decimate
+
+### Helper functions
+
+# Function to determine the idealized solar insolation curve
+# day, day of year
+# wtimes, the plotting times
+# lat0, tower latitude
+def solar_curve(day, wtimes, lat0=41.46):
+
+    # Compute the declination angle of the Earth
+    dec_angle = 23.45 * np.sin(np.radians(360 * (284 + day) / 365))
+
+    # Calculate the solar angles
+    hour_angles = (wtimes/3600.0-12.0)*15.0
+    solar_angles = np.arcsin(
+        np.sin(np.radians(lat0))*np.sin(np.radians(dec_angle))+
+        np.cos(np.radians(lat0))*np.cos(np.radians(dec_angle))*np.cos(np.radians(hour_angles))
+    )
+    solar_curve = 1361.0*np.sin(solar_angles)
+    solar_curve[solar_angles<=0] = 0.0
+
+    return solar_curve
+
+# Function to set y limits, skipping panels with no valid data
+# ax, axes to adjust
+# lo, hi, the limits
+def set_ylim(ax, lo, hi):
+
+    if np.isfinite(lo) and np.isfinite(hi) and (hi > lo):
+        ax.set_ylim(lo, hi)
+
+### The meteogram
+class Meteogram:
+
+    # title, first line of the panel title (the date is appended)
+    # subtitle, second line of the title, None for none
+    # dpi, figsize, resolution and size of the figure
+    # fs, fw, font size and weight of the labels
+    # methods, decimation method per trace (see decimate.py), None for the defaults
+    def __init__(self, title='Current Campus Observations', subtitle='Two-minute Average', dpi=600, figsize=(12,14), fs=18, fw='bold', methods=None):
+
+        self.methods = dict(decimate.METHODS, **(methods or {}))
+        self.title = title
+        self.subtitle = subtitle
+        self.fs = fs
+        self.fw = fw
+
+        fig, axes = pp.subplots(nrows=4, figsize=figsize, dpi=dpi, constrained_layout=True)
+        self.fig = fig
+        self.axes = axes
+        self.npix = int(fig.get_figwidth()*fig.dpi)
+        self.fills = [] # fill_between artists, rebuilt on every update
+
+        # Temperature
+        self.temp, = axes[0].plot([], [], color='firebrick', label='T')
+        self.dewp, = axes[0].plot([], [], color='forestgreen', label='Td')
+        axes[0].plot([0,0],[-100,-100], color='steelblue', label='RH') # Ghost line for RH
+        axes[0].legend(shadow=True, fontsize=14)
+        axes[0].set_ylabel('Temperature (°F)', fontsize=fs, fontweight=fw)
+
+        # Relative humidity
+        self.axrh = axes[0].twinx()
+        self.rh, = self.axrh.plot([], [], color='steelblue')
+        self.axrh.set_ylim(0, 105)
+        self.axrh.set_yticks([0, 20, 40, 60, 80, 100])
+        self.axrh.set_ylabel('Relative humidity (%)', fontsize=fs, fontweight=fw)
+
+        # Wind Speed
+        self.wspd, = axes[1].plot([], [], color='black', label='Speed')
+        axes[1].plot([0,0],[-10,-10], color='goldenrod', linestyle=':', label='Direction') # Ghost line for legend
+        axes[1].set_ylabel('Wind Speed (mph)',  fontsize=fs, fontweight=fw)
+        axes[1].legend(shadow=True, fontsize=14)
+
+        # Wind Direction
+        self.axdir = axes[1].twinx()
+        self.wdir, = self.axdir.plot([], [], color='goldenrod', linestyle=':')
+        self.axdir.set_ylim(0, 360)
+        self.axdir.set_ylabel('Wind Direction (°)',  fontsize=fs, fontweight=fw)
+        self.axdir.set_yticks(np.arange(0,405,45))
+        self.axdir.set_yticklabels(['N','NE','E','SE','S','SW','W','NW','N'])
+
+        # Pressure
+        self.pres, = axes[2].plot([], [], color='black', label="Pressure", zorder=10)
+        axes[2].set_ylabel('Pressure (mb)', fontsize=fs, fontweight=fw)
+        axes[2].plot([0,0],[-10,-10], color='steelblue', label='Rainfall') # Ghost line for legend
+        axes[2].legend(shadow=True, fontsize=14)
+
+        # Rainfall
+        self.axrain = axes[2].twinx()
+        self.rain, = self.axrain.plot([], [], color='steelblue')
+        self.axrain.set_ylabel('Rainfall (inches)', fontsize=fs, fontweight=fw)
+
+        # Solar radiation
+        self.sw, = axes[3].plot([], [], color='darkgoldenrod', label='Insolation')
+        axes[3].set_ylabel('Solar Insolation (W m$^{-2}$)', fontsize=fs, fontweight=fw)
+        axes[3].set_xlabel('Time (Local)', fontsize=fs, fontweight=fw)
+
+        # Atmospheric transmission
+        self.axsun = axes[3].twinx()
+        self.tau, = self.axsun.plot([], [], color='black', linestyle='--')
+        self.axsun.set_ylim(0.0, 1.0)
+        self.axsun.set_ylabel('Transmissivity', fontsize=fs, fontweight=fw)
+        axes[3].plot([0,0], [-100,-100], color='black', linestyle='--', label="T")
+        axes[3].legend(shadow=True, fontsize=14)
+
+        # Add a grid to everything and handle tick labels
+        for ax in axes:
+            ax.grid()
+            ax.tick_params(axis='y', labelsize=14)
+        for ax in (self.axrain, self.axdir, self.axrh, self.axsun):
+            ax.tick_params(axis='y', labelsize=14)
+        self.set_time_axis(86400, np.arange(0, 93600, 7200), np.arange(0, 26, 2, dtype=int)%24)
+
+    # Function to set the time axis (one day in hours by default)
+    # xmax, length of the axis (s, from local midnight of the first day)
+    # ticks, tick positions (s)
+    # labels, tick labels
+    def set_time_axis(self, xmax, ticks, labels):
+
+        for ax in self.axes:
+            ax.set_xlim(0, xmax)
+            ax.set_xticks(ticks)
+            ax.set_xticklabels(labels, fontsize=12)
+
+    # Function to decimate one trace for plotting
+    # key, trace name (selects the method)
+    # x, y, the trace
+    def thin(self, key, x, y):
+
+        if (self.methods.get(key) == 'none'):
+            return x, y
+
+        return decimate.decimate(x, y, self.npix, self.methods.get(key, 'minmax'))
+
+    # Function to update the plotted data in place
+    # date, the day being plotted
+    # itimes, one-secondly plotting times (s since local midnight)
+    # wtimes, window averaged plotting times
+    # data, dictionary of traces: 'tempF', 'dewpF', 'rh', 'wspd' (mph), 'wdir', 'pres', 'sw' on wtimes
+    #       and 'rain' (inches), 'ideal_sun', 'tau' on itimes
+    # label, date text for the title, None to use date
+    def update(self, date, itimes, wtimes, data, label=None):
+
+        axes = self.axes
+        for line, times, key in ((self.temp, wtimes, 'tempF'), (self.dewp, wtimes, 'dewpF'), (self.rh, wtimes, 'rh'),
+                                 (self.wspd, wtimes, 'wspd'), (self.wdir, wtimes, 'wdir'), (self.pres, wtimes, 'pres'),
+                                 (self.sw, wtimes, 'sw'), (self.tau, itimes, 'tau')):
+            line.set_data(*self.thin(key, times, data[key]))
+
+        # Rainfall only where finite
+        good = np.isfinite(data['rain'])
+        rtimes, rain = self.thin('rain', itimes[good], data['rain'][good])
+        self.rain.set_data(rtimes, rain)
+
+        # Rebuild the filled areas
+        for fill in self.fills:
+            fill.remove()
+        stimes, ideal_sun = self.thin('ideal_sun', itimes, data['ideal_sun'])
+        self.fills = [
+            self.axrain.fill_between(rtimes, rain, color='steelblue'),
+            axes[3].fill_between(stimes, ideal_sun, color='gold', alpha=0.20),
+            axes[3].fill_between(stimes, 0, 1, where=ideal_sun<5, color='gray', alpha=0.20, transform=axes[3].get_xaxis_transform())
+        ]
+
+        # Limits
+        with np.errstate(invalid='ignore'):
+            set_ylim(axes[0], np.floor(np.nanmin(data['dewpF'], initial=np.inf)*0.95), np.ceil(np.nanmax(data['tempF'], initial=-np.inf)*1.05))
+            set_ylim(axes[1], 0, np.ceil(np.nanmax(data['wspd'], initial=-np.inf)*1.05))
+            set_ylim(axes[2], np.floor(np.nanmin(data['pres'], initial=np.inf))-5, np.ceil(np.nanmax(data['pres'], initial=-np.inf)+5))
+            self.axrain.set_ylim(0, max(1, np.max(rain, initial=0)+1))
+            set_ylim(axes[3], 0, np.ceil(np.nanmax(data['ideal_sun'])*1.05))
+
+        title = f'{self.title} - {date.strftime("%b %d, %Y") if label is None else label}'
+        if self.subtitle:
+            title += f'\n{self.subtitle}'
+        axes[0].set_title(title, fontsize=self.fs, fontweight=self.fw)
+
+    # Function to render the figure once
+    # Returns the PNG bytes
+    def render(self):
+
+        buf = BytesIO()
+        self.fig.savefig(buf, format='png')
+
+        return buf.getvalue()
+
+    # Function to write one rendering to several files
+    # paths, files to write
+    def save(self, paths):
+
+        png = self.render()
+        for path in paths:
+            tmp = path+'.tmp'
+            with open(tmp, 'wb') as fn:
+                fn.write(png)
+            os.replace(tmp, path)
+
+        return png
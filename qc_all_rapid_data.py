@@ -4,6 +4,8 @@
 ### A standard deviation check is used to flag suspicious data and interpolate
 ### from the surrounding observations.
 ### Does not apply filter to rain due to rain often being a step function.
+### Days are independent, so they are spread across a pool of worker processes.
+### Compressed days (tower_archive.py) are read as they are.
 ###
 ### A QC flag of 1 is good, and -1 is suspicious
 ###
@@ -13,8 +15,8 @@
 
 ##### START OPTIONS #####
 
-# Location of the rapid data files
-odir = '/archive/campus_mesonet_data/mesonet_data/met_tower/2025'
+# Location of the rapid data files (annual folders are searched)
+odir = '/archive/campus_mesonet_data/mesonet_data/met_tower'
 
 # Directory to which to save the quality controlled files
 sdir = '/archive/campus_mesonet_data/mesonet_data/met_tower/QCd_data'
@@ -28,108 +30,66 @@ nobs = 300
 # the window will be thrown out
 nsigma = 0.75
 
+# Range of days to process (YYYYMMDD, inclusive), None for no limit
+start_date = None
+end_date = None
+
+# Number of worker processes, None for one per core
+nworkers = None
+
+# Re-process days whose QC'd file is newer than the rapid file
+overwrite = False
+
 #####  END OPTIONS  #####
 
 # Import required modules
-from collections import OrderedDict
-from datetime import datetime, timedelta
-from glob import glob
-import numpy as np
-import pandas as pd
-import pytz
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 import os
+import time
+from qc_engine import qc_file
+from tower_archive import find, glob_days, plain
 
-# Locate all files
-files = sorted(glob(f'{odir}/rapid_*.csv'))
-for f in files:
+# Function to QC one day
+# f, rapid data file
+# Returns the file, the number of rows written (None on failure), the run time and any error
+def qc_day(f):
 
-    # Read the data
-    data_df = pd.read_csv(f)
-    date = datetime.strptime(f.split('/')[-1], 'rapid_ValpoMetTower_%Y%m%d.csv')
-
-    # Convert dates into times
-    try:
-        dates = [datetime.strptime(date, "%Y-%m-%d_%H:%M:%S") for date in data_df["Tower Date (local)"].values]
-    except:
-        continue
-    times = np.array([(date-dates[0]).total_seconds() for date in dates], dtype='float')
-
-    # Extract data from the data frame
-    obs = {'temp': data_df['Temp (C)'].values, 'rh': data_df['RH (%)'].values, 'pres': data_df['Pres (mb)'].values,
-        'rain': data_df['Rain (mm)'].values, 'wspd': data_df['Wspd (m/s)'].values, 'wdir': data_df['Wdir (deg)'].values,
-        'swdown': data_df['SWdown (W/m2)'].values}
-
-    # Compute the standard deviation for each point and flag suspicious data
-    # Then replace data and interpolate to uniform one second interval
-    flags = {} # QC flags
-    iobs = {} # Final interpolated data
-    for k in obs.keys():
-        # Array to hold the QC flags
-        flags[k] = np.ones(obs[k].size)
-
-        # Compute mean and standard deviation over the window
-        for i in range(obs[k].size):
-            if (i < nobs//2): # left edge
-                sigma = np.nanstd(obs[k][i-nobs//2+(nobs//2-i):i+nobs//2]+(nobs//2-i))
-                mean = np.nanmean(obs[k][i-nobs//2+(nobs//2-i):i+nobs//2+(nobs//2-i)])
-
-            elif (obs[k].size-i < nobs//2): # right edge
-                sigma = np.nanstd(obs[k][i-nobs//2-(nobs//2-i):i-nobs//2]+(nobs//2-i))
-                mean = np.nanmean(obs[k][i-nobs//2-(nobs//2-i):i-nobs//2+(nobs//2-i)])
-
-            else: # body
-                sigma = np.nanstd(obs[k][i-nobs//2:i+nobs//2])
-                mean = np.nanmean(obs[k][i-nobs//2:i+nobs//2])
-
-            # Apply the sigma filter
-            if (abs(obs[k][i]-mean)>nsigma*sigma):
-                flags[k][i] = -1
-
-            # Check for -999
-            if (obs[k][i] == -999):
-                flags[k][i] = -1
-
-            # Apply some other basic filters
-            if (k == 'temp') and (obs[k][i] > 100):
-                flags[k][i] = -1
-            elif (k == 'rh') and (obs[k][i] > 105):
-                flags[k][i] = -1
-            elif (k == 'pres') and (obs[k][i] < 940):
-                flags[k][i] = -1
-
-        # If rain, just set all flags to good because it IS often a step function
-        if (k == 'rain'):
-            flags[k] = np.ones(obs[k].size)
-
-        # Interpolate the suspicious data
-        obs[k][flags[k] == -1] = np.nan
-        obs[k][np.isnan(obs[k])] = np.interp(times[np.isnan(obs[k])], times[~np.isnan(obs[k])], obs[k][~np.isnan(obs[k])], left=np.nan, right=np.nan)
-
-        # Extend QC flags to any remaining NaNs
-        flags[k][np.isnan(obs[k])] == -1
-
-    # Final dictionary for writing out
-    out_dict = OrderedDict([
-        ('Server Date (UTC)', data_df['Server Date (UTC)'].values),
-        ('Tower Date (local)', data_df["Tower Date (local)"].values),
-        ('Temp (C)', obs['temp']), ('Temp QC', flags['temp']),
-        ('RH (%)', obs['rh']), ('RH QC', flags['rh']),
-        ('Pres (mb)', obs['pres']), ('Pres QC', flags['pres']),
-        ('Daily Total Rain (mm)', obs['rain']), ('Rain QC', flags['rain']),
-        ('Wspd (m/s)', obs['wspd']), ('Wspd QC', flags['wspd']),
-        ('Wdir (deg)', obs['wdir']), ('Wdir QC', flags['wdir']),
-        ('SWdown (W/m2)', obs['swdown']), ('SWdown QC', flags['swdown'])
-    ])
-
-   # Convert to dictionary and replace any empty strings with NaNs
-    out_df = pd.DataFrame(out_dict)
-    out_df = out_df.replace(r'^\s*$', np.nan, regex=True)
-
-
-    # Write out the QC'd file
+    t0 = time.perf_counter()
+    date = datetime.strptime(os.path.basename(plain(f)), 'rapid_ValpoMetTower_%Y%m%d.csv')
     try:
-        os.system(f'mkdir -p {sdir}/{date.year}')
-    except:
-        pass
-    
-    out_df.to_csv(f'{sdir}/{date.year}/rapid_qc_ValpoMetTower_{date.strftime("%Y%m%d")}.csv', float_format='%.2f', index=False)
+        nrows = qc_file(f, f'{sdir}/{date.year}/rapid_qc_ValpoMetTower_{date.strftime("%Y%m%d")}.csv', nobs, nsigma)
+        return f, nrows, time.perf_counter()-t0, None
+    except Exception as err:
+        return f, None, time.perf_counter()-t0, err
+
+if __name__ == '__main__':
+
+    # Locate all files in the date range
+    files = []
+    for f in glob_days(f'{odir}/*/rapid_ValpoMetTower_*.csv'):
+        day = os.path.basename(f)[20:28]
+        if ((start_date is not None) and (day < start_date)) or ((end_date is not None) and (day > end_date)):
+            continue
+
+        # Skip days that are already up to date
+        qc_path = find(f'{sdir}/{day[:4]}/rapid_qc_ValpoMetTower_{day}.csv')
+        if (not overwrite) and (qc_path is not None) and (os.path.getmtime(qc_path) >= os.path.getmtime(f)):
+            continue
+
+        files.append(f)
+
+    print(f'Processing {len(files)} days')
+
+    # Fan the days out across the worker processes
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        jobs = [pool.submit(qc_day, f) for f in files]
+        for i, job in enumerate(as_completed(jobs)):
+            f, nrows, seconds, err = job.result()
+            if err is None:
+                print(f'[{i+1}/{len(files)}] {os.path.basename(f)}: {nrows} rows in {seconds:.2f} s')
+            else:
+                print(f'[{i+1}/{len(files)}] {os.path.basename(f)}: FAILED after {seconds:.2f} s ({err})')
+
+    print(f'Finished in {time.perf_counter()-t0:.1f} s')
@@ -0,0 +1,480 @@
+### Quality control engine for the secondly observations from the Valpo Met Tower.
+### Shared by qc_rapid_data.py and qc_all_rapid_data.py.
+###
+### The rolling mean and standard deviation are computed in O(n) from
+### cumulative sums of the values, their squares and the count of valid
+### (non-NaN) samples. Every sample uses a window of nobs observations,
+### [i-nobs/2, i+nobs/2), shifted inward at the start and end of the day so
+### that edge windows still hold nobs observations.
+###
+### StreamingQC applies the same checks to one observation at a time inside
+### the feed, with O(1) running sums over the last nobs samples, and writes
+### each row nobs/2 samples after it arrives instead of on the next cron run.
+###
+### A QC flag of 1 is good, and -1 is suspicious
+###
+### Christopher Phillips
+### Valparaiso University
+
+# Import required modules
+from collections import OrderedDict, deque
+import calendar
+import fcntl
+from io import StringIO
+import json
+import os
+import numpy as np
+import pandas as pd
+from time_axis import parse_stamps
+import tower_archive
+
+# Basic range filters applied on top of the sigma filter
+# Variable: (test, limit), e.g. temps greater than 100 'C are thrown out
+LIMITS = {'temp': ('max', 100.0), 'rh': ('max', 105.0), 'pres': ('min', 940.0)}
+
+# Missing value marker used by the tower
+MISSING = -999
+
+# Variables that are never flagged because they are often a step function
+UNFILTERED = ('rain',)
+
+# Header of the QC'd files (without the tower date column)
+QC_HEADER = ('Server Date (UTC),Temp (C),Temp QC,RH (%),RH QC,Pres (mb),Pres QC,Daily Total Rain (mm),Rain QC,'
+             'Wspd (m/s),Wspd QC,Wdir (deg),Wdir QC,SWdown (W/m2),SWdown QC')
+
+# QC variables in QC'd file order, and their position in a rapid data row (tower_writer.HEADER)
+STREAM_VARS = ('temp', 'rh', 'pres', 'rain', 'wspd', 'wdir', 'swdown')
+STREAM_COLUMNS = (0, 1, 2, 4, 5, 6, 7)
+
+# Lock file in the QC directory, held by whichever process writes the QC'd files
+# (the feed's StreamingQC for as long as it runs, or one qc_rapid_data.py run)
+QC_LOCK = 'qc_writer.lock'
+
+# Function to take the lock on a QC directory
+# qc_dir, directory of the QC'd files
+# wait, True to wait for the lock, False to give up at once if another process holds it
+# Returns the open lock file (the lock is held until it is closed), None if it is held elsewhere
+def lock_qc_dir(qc_dir, wait=True):
+
+    os.makedirs(qc_dir, exist_ok=True)
+    fn = open(os.path.join(qc_dir, QC_LOCK), 'a')
+    try:
+        fcntl.flock(fn, fcntl.LOCK_EX if wait else (fcntl.LOCK_EX | fcntl.LOCK_NB))
+    except BlockingIOError:
+        fn.close()
+        return None
+
+    return fn
+
+# Function to get the observation times from a data frame
+# data_df, data frame of rapid data
+# Returns times (s) relative to the first observation
+def get_times(data_df):
+
+    # Prefer the tower clock when the file has it
+    column = 'Tower Date (local)' if ('Tower Date (local)' in data_df.columns) else 'Server Date (UTC)'
+    epoch = parse_stamps(data_df[column].values)
+    if (epoch.size == 0):
+        return np.array([])
+
+    return (epoch-epoch[0]).astype('float')
+
+# Function to extract the QC variables from a data frame
+# data_df, data frame of rapid data
+def get_obs(data_df):
+
+    # Older files name the daily rain column differently
+    rain = 'Daily Total Rain (mm)' if ('Daily Total Rain (mm)' in data_df.columns) else 'Rain (mm)'
+
+    return {'temp': data_df['Temp (C)'].values, 'rh': data_df['RH (%)'].values, 'pres': data_df['Pres (mb)'].values,
+            'rain': data_df[rain].values, 'wspd': data_df['Wspd (m/s)'].values, 'wdir': data_df['Wdir (deg)'].values,
+            'swdown': data_df['SWdown (W/m2)'].values}
+
+# Function to compute the rolling mean and standard deviation
+# x, observations (NaNs are ignored)
+# nobs, number of observations in the window
+# Returns mean and standard deviation arrays the same size as x
+def rolling_mean_std(x, nobs):
+
+    x = np.asarray(x, dtype='float')
+    n = x.size
+    if (n == 0):
+        return np.array([]), np.array([])
+
+    # Remove the overall mean so the sums of squares stay well conditioned
+    valid = np.isfinite(x)
+    offset = np.mean(x[valid]) if valid.any() else 0.0
+    xv = np.where(valid, x-offset, 0.0)
+
+    # Cumulative sums with a leading zero so window sums are a difference
+    csum = np.concatenate(([0.0], np.cumsum(xv)))
+    csq = np.concatenate(([0.0], np.cumsum(xv*xv)))
+    ccnt = np.concatenate(([0], np.cumsum(valid)))
+
+    # Window start for each sample, shifted inward at the edges
+    width = min(nobs, n)
+    start = np.clip(np.arange(n)-nobs//2, 0, n-width)
+    end = start+width
+
+    count = (ccnt[end]-ccnt[start]).astype('float')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (csum[end]-csum[start])/count
+        var = (csq[end]-csq[start])/count-mean**2
+    var = np.maximum(var, 0.0)
+
+    return mean+offset, np.sqrt(var)
+
+# Function to flag and interpolate one variable
+# name, variable name (selects the range filters)
+# x, observations
+# times, observation times (s)
+# nobs, number of observations in the sigma check window
+# nsigma, number of standard deviations for the QC threshold
+# Returns the interpolated observations and their flags
+def qc_variable(name, x, times, nobs, nsigma):
+
+    x = np.array(x, dtype='float')
+    flags = np.ones(x.size)
+
+    if name not in UNFILTERED:
+
+        # Apply the sigma filter
+        mean, sigma = rolling_mean_std(x, nobs)
+        with np.errstate(invalid='ignore'):
+            flags[np.abs(x-mean) > nsigma*sigma] = -1
+
+        # Check for -999
+        flags[x == MISSING] = -1
+
+        # Apply some other basic filters
+        if name in LIMITS:
+            test, limit = LIMITS[name]
+            with np.errstate(invalid='ignore'):
+                if (test == 'max'):
+                    flags[x > limit] = -1
+                else:
+                    flags[x < limit] = -1
+
+    # Interpolate the suspicious data
+    x[flags == -1] = np.nan
+    bad = np.isnan(x)
+    if bad.any() and (~bad).any():
+        x[bad] = np.interp(times[bad], times[~bad], x[~bad], left=np.nan, right=np.nan)
+
+    # Extend QC flags to any remaining NaNs
+    flags[np.isnan(x)] = -1
+
+    return x, flags
+
+# Function to QC every variable
+# obs, dictionary of observations
+# times, observation times (s)
+# nobs, number of observations in the sigma check window
+# nsigma, number of standard deviations for the QC threshold
+# Returns dictionaries of the QC flags and interpolated observations
+def qc_obs(obs, times, nobs, nsigma):
+
+    flags = {}
+    iobs = {}
+    times = np.asarray(times, dtype='float')
+    for k in obs.keys():
+        iobs[k], flags[k] = qc_variable(k, obs[k], times, nobs, nsigma)
+
+    return flags, iobs
+
+# Function to build the output data frame
+# data_df, the input data frame (for the date columns)
+# obs, interpolated observations
+# flags, QC flags
+def build_output(data_df, obs, flags):
+
+    # Final dictionary for writing out
+    out_dict = OrderedDict([('Server Date (UTC)', data_df['Server Date (UTC)'].values)])
+    if ('Tower Date (local)' in data_df.columns):
+        out_dict['Tower Date (local)'] = data_df['Tower Date (local)'].values
+    out_dict.update([
+        ('Temp (C)', obs['temp']), ('Temp QC', flags['temp']),
+        ('RH (%)', obs['rh']), ('RH QC', flags['rh']),
+        ('Pres (mb)', obs['pres']), ('Pres QC', flags['pres']),
+        ('Daily Total Rain (mm)', obs['rain']), ('Rain QC', flags['rain']),
+        ('Wspd (m/s)', obs['wspd']), ('Wspd QC', flags['wspd']),
+        ('Wdir (deg)', obs['wdir']), ('Wdir QC', flags['wdir']),
+        ('SWdown (W/m2)', obs['swdown']), ('SWdown QC', flags['swdown'])
+    ])
+
+    # Convert to dictionary and replace any empty strings with NaNs
+    out_df = pd.DataFrame(out_dict)
+    out_df = out_df.replace(r'^\s*$', np.nan, regex=True)
+
+    return out_df
+
+# Function to QC a whole rapid file and write the QC'd file
+# infile, rapid data file (plain or compressed, see tower_archive.py)
+# outfile, QC'd file (overwritten)
+# nobs, number of observations in the sigma check window
+# nsigma, number of standard deviations for the QC threshold
+# Returns the number of rows written
+def qc_file(infile, outfile, nobs, nsigma):
+
+    data_df = tower_archive.read_csv(infile)
+    flags, obs = qc_obs(get_obs(data_df), get_times(data_df), nobs, nsigma)
+    out_df = build_output(data_df, obs, flags)
+
+    os.makedirs(os.path.dirname(outfile) or '.', exist_ok=True)
+    out_df.to_csv(outfile, float_format='%.2f', index=False)
+
+    return len(out_df)
+
+# Function to QC only the rows added to a rapid file since the last call
+# infile, rapid data file
+# outfile, QC'd file to append to
+# ckpt, checkpoint file (JSON) holding the progress between calls
+# nobs, number of observations in the sigma check window
+# nsigma, number of standard deviations for the QC threshold
+# final, True once the day is over to flush the unsettled tail
+#
+# The checkpoint holds the byte offset of the input already read, the last nobs
+# raw rows and how many of those were already written. A row is written once
+# nobs/2 later rows exist, and none before the day has nobs rows (early windows
+# are shifted inward to the first nobs rows), so a window never changes after
+# its row is written.
+# Returns the number of rows written
+def qc_incremental(infile, outfile, ckpt, nobs, nsigma, final=False):
+
+    # Load the checkpoint, starting over if it does not match the files
+    state = None
+    if os.path.exists(ckpt) and os.path.exists(outfile):
+        with open(ckpt, 'r') as fn:
+            state = json.load(fn)
+        if (state['offset'] > os.path.getsize(infile)) or (state['out_size'] > os.path.getsize(outfile)):
+            state = None
+    if state is None:
+        state = {'offset': 0, 'header': None, 'context': [], 'emitted': 0, 'out_size': 0, 'final': False}
+    elif state['final']:
+        return 0
+
+    # Drop anything written after the checkpoint was saved (e.g. a crash in between)
+    if os.path.exists(outfile) and (os.path.getsize(outfile) != state['out_size']):
+        with open(outfile, 'r+') as fn:
+            fn.truncate(state['out_size'])
+
+    # Read only the new bytes, up to the last complete line unless the day is over
+    with open(infile, 'rb') as fn:
+        fn.seek(state['offset'])
+        chunk = fn.read()
+    if not final:
+        chunk = chunk[:chunk.rfind(b'\n')+1]
+    state['offset'] += len(chunk)
+
+    lines = [line for line in chunk.decode('utf-8').split('\n') if line.strip()]
+    if (state['header'] is None) and (len(lines) > 0):
+        state['header'] = lines.pop(0)
+    rows = state['context']+lines
+    n = len(rows)
+
+    # Rows that are now settled
+    start = state['emitted']
+    end = n if final else (max(n-nobs//2, start) if (n >= nobs) else start)
+    if (end > start):
+        data_df = pd.read_csv(StringIO('\n'.join([state['header']]+rows)))
+        flags, obs = qc_obs(get_obs(data_df), get_times(data_df), nobs, nsigma)
+        out_df = build_output(data_df, obs, flags).iloc[start:end]
+        out_df.to_csv(outfile, mode='a', header=(state['out_size'] == 0), float_format='%.2f', index=False)
+
+    # Keep the trailing window for the next call
+    first = max(0, n-nobs)
+    state['context'] = rows[first:]
+    state['emitted'] = end-first
+    state['out_size'] = os.path.getsize(outfile) if os.path.exists(outfile) else 0
+    state['final'] = final
+
+    tmp = ckpt+'.tmp'
+    with open(tmp, 'w') as fn:
+        json.dump(state, fn)
+    os.replace(tmp, ckpt)
+
+    return end-start
+
+### Streaming QC of the feed, one observation at a time
+###
+### Sample i of a day is checked against the mean and standard deviation of the
+### same window qc_variable uses, [i-nobs/2, i+nobs/2) shifted inward at the
+### edges, so its flag is known once nobs/2 later samples have arrived. Flagged
+### values are interpolated in time once the next good value settles; a run of
+### flagged values longer than max_hold rows is written as missing instead, so
+### no row waits more than nobs/2+max_hold samples.
+class StreamingQC:
+
+    # writer, tower_writer.DailyWriter for the QC'd files (QC_HEADER)
+    # nobs, number of observations in the sigma check window (even)
+    # nsigma, number of standard deviations for the QC threshold
+    # max_hold, most settled rows held back waiting for a good value (None for nobs)
+    def __init__(self, writer, nobs, nsigma, max_hold=None):
+
+        # Keeps a cron QC run from writing the same files (qc_rapid_data.py checks the lock)
+        self.lock = lock_qc_dir(writer.sdir)
+
+        self.writer = writer
+        self.nobs = nobs
+        self.nsigma = nsigma
+        self.max_hold = nobs if (max_hold is None) else max_hold
+
+        # Range checks as (lower, upper) bounds per variable, -999 and rain handled separately
+        nvar = len(STREAM_VARS)
+        self.lower = np.full(nvar, -np.inf)
+        self.upper = np.full(nvar, np.inf)
+        for k, name in enumerate(STREAM_VARS):
+            if name in LIMITS:
+                test, limit = LIMITS[name]
+                if (test == 'max'):
+                    self.upper[k] = limit
+                else:
+                    self.lower[k] = limit
+        self.filtered = np.array([name not in UNFILTERED for name in STREAM_VARS])
+
+        self.day = None
+        self.reset()
+
+    # Function to start a new day
+    def reset(self):
+
+        nvar = len(STREAM_VARS)
+        self.window = deque() # Raw rows of the window: [date, server_time, t, x]
+        self.offset = None # Removed from the sums so the squares stay well conditioned
+        self.sum = np.zeros(nvar)
+        self.sumsq = np.zeros(nvar)
+        self.count = np.zeros(nvar)
+        self.received = 0 # Rows received today
+        self.settled = 0 # Rows flagged today
+        self.held = deque() # Flagged rows not written yet: [date, server_time, t, x, flags, nopen]
+        self.open = [[] for k in range(nvar)] # Held rows waiting for a good value, per variable
+        self.last_good = [None]*nvar # (t, x) of the last good value, per variable
+
+    # Function to add one observation
+    # date, tower date of the observation (naive local, selects the day)
+    # server_time, time the observation was pulled
+    # values, observed values in tower_writer.HEADER order
+    def add(self, date, server_time, values):
+
+        day = date.strftime('%Y%m%d')
+        if (day != self.day):
+            self.finish()
+            self.day = day
+
+        # Checked as written to the rapid file (two decimals), like the cron QC
+        x = np.round(np.array([values[k] for k in STREAM_COLUMNS], dtype='float'), 2)
+        if self.offset is None:
+            self.offset = np.where(np.isfinite(x), x, 0.0)
+        valid = np.isfinite(x)
+        xv = np.where(valid, x-self.offset, 0.0)
+        self.sum += xv
+        self.sumsq += xv*xv
+        self.count += valid
+        self.window.append((date, server_time, calendar.timegm(date.timetuple()), x, xv, valid))
+        self.received += 1
+
+        # Recompute the sums now and then so rounding does not build up over the day
+        if (self.received%self.nobs == 0):
+            self.sum = np.sum([old[4] for old in self.window], axis=0)
+            self.sumsq = np.sum([old[4]*old[4] for old in self.window], axis=0)
+            self.count = np.sum([old[5] for old in self.window], axis=0).astype('float')
+
+        # The oldest row is already settled once the window is over-full
+        if (len(self.window) > self.nobs):
+            old = self.window.popleft()
+            self.sum -= old[4]
+            self.sumsq -= old[4]*old[4]
+            self.count -= old[5]
+
+        # The first window settles the first nobs/2 rows at once, then one row per observation
+        if (self.received >= self.nobs):
+            self._settle(self.received-self.nobs//2+1)
+        self._write()
+
+    # Function to flag the rows up to (not including) a row index with the current window
+    # end, row index (of the day)
+    def _settle(self, end):
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sum/self.count
+            sigma = np.sqrt(np.maximum(self.sumsq/self.count-mean*mean, 0.0))
+        mean += self.offset
+
+        first = self.received-len(self.window)
+        while (self.settled < end):
+            date, server_time, t, x = self.window[self.settled-first][:4]
+            with np.errstate(invalid='ignore'):
+                bad = (np.abs(x-mean) > self.nsigma*sigma) | (x == MISSING) | (x > self.upper) | (x < self.lower)
+            self._hold(date, server_time, t, x, bad & self.filtered)
+            self.settled += 1
+
+    # Function to queue a flagged row and interpolate earlier rows that waited for it
+    # date, server_time, t, x, the raw row
+    # flagged, which variables failed a check (missing values are interpolated but keep a flag of 1 unless they stay missing)
+    def _hold(self, date, server_time, t, x, flagged):
+
+        bad = flagged | ~np.isfinite(x)
+        row = [date, server_time, t, np.where(bad, np.nan, x), np.where(flagged, -1.0, 1.0), 0]
+        for k in range(x.size):
+            if not bad[k]:
+                # A good value closes the run of flagged values before it
+                if (len(self.open[k]) > 0):
+                    t0, x0 = self.last_good[k]
+                    for other in self.open[k]:
+                        other[3][k] = x0+(x[k]-x0)*(other[2]-t0)/(t-t0) if (t != t0) else x0
+                        other[5] -= 1
+                    self.open[k] = []
+                self.last_good[k] = (t, x[k])
+            elif self.last_good[k] is not None:
+                self.open[k].append(row)
+                row[5] += 1
+            else:
+                row[4][k] = -1.0 # Nothing to interpolate from
+        self.held.append(row)
+
+        # Give up on runs that would hold rows too long (written as missing)
+        while (len(self.held) > self.max_hold) and (self.held[0][5] > 0):
+            self._drop(self.held[0])
+
+    # Function to stop waiting for good values in the open variables of a row
+    # row, held row
+    def _drop(self, row):
+
+        for k in range(len(self.open)):
+            if any(other is row for other in self.open[k]):
+                for other in self.open[k]:
+                    other[4][k] = -1.0
+                    other[5] -= 1
+                self.open[k] = []
+                self.last_good[k] = None
+
+    # Function to write the held rows that are complete
+    def _write(self):
+
+        while (len(self.held) > 0) and (self.held[0][5] == 0):
+            date, server_time, t, x, flags, nopen = self.held.popleft()
+            self.writer.write(date, server_time, [v for pair in zip(x, flags) for v in pair])
+
+    # Function to flag and write everything held for the current day (end of the day or the feed)
+    def finish(self):
+
+        if (self.received > self.settled):
+            self._settle(self.received)
+        for row in list(self.held):
+            if (row[5] > 0):
+                self._drop(row)
+        self._write()
+        self.reset()
+
+    # Function to write buffered QC'd rows to disk
+    # force, False to flush only when the writer's interval or row count is reached
+    def flush(self, force=True):
+
+        self.writer.flush(force)
+
+    # Function to write everything held and close the QC'd file
+    def close(self):
+
+        self.finish()
+        self.writer.close()
+        self.lock.close()
@@ -6,6 +6,10 @@
 ###
 ### A QC flag of 1 is good, and -1 is suspicious
 ###
+### Not needed when rapid_retrieve_data.py runs with qc_dir set, which QCs the
+### observations as they arrive and writes the same files. The two share a
+### lock in sdir, so this script exits without writing while the feed holds it.
+###
 ### Christopher Phillips
 ### Valparaiso University
 ### Oct. 2025
@@ -27,98 +31,62 @@ nobs = 300
 # the window will be thrown out
 nsigma = 0.75
 
+# Only QC the rows added since the last run and append them to the QC'd file
+# (False re-processes and rewrites the whole day every run)
+incremental = True
+
 #####  END OPTIONS  #####
 
 # Import required modules
-from collections import OrderedDict
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 import numpy as np
 import pandas as pd
-import pytz
 import os
+import sys
+from qc_engine import build_output, get_obs, get_times, lock_qc_dir, qc_incremental, qc_obs
+from time_axis import TIMEZONE
+
+# The feed's streaming QC owns the QC'd files while it runs
+lock = lock_qc_dir(sdir, wait=False)
+if lock is None:
+    print('WARNING streaming QC in rapid_retrieve_data.py is writing', sdir, '- not running')
+    sys.exit(1)
 
 # Grab the current date (local time)
-#timezone = ZoneInfo('America/Central')
-timezone = pytz.timezone('US/Central')
-date = datetime.now(timezone)
+date = datetime.now(ZoneInfo(TIMEZONE))
+
+# Incremental mode keeps a checkpoint next to each QC'd file
+if incremental:
+    for day, final in ((date-timedelta(days=1), True), (date, False)):
+        infile = f'{odir}/{day.year}/rapid_ValpoMetTower_{day.strftime("%Y%m%d")}.csv'
+        outfile = f'{sdir}/{day.year}/rapid_qc_ValpoMetTower_{day.strftime("%Y%m%d")}.csv'
+        ckpt = f'{sdir}/{day.year}/rapid_qc_ValpoMetTower_{day.strftime("%Y%m%d")}.ckpt'
+
+        # Yesterday only needs its unsettled tail flushed, and only if it was being tracked
+        if final and not os.path.exists(ckpt):
+            continue
+        if not os.path.exists(infile):
+            continue
+
+        os.makedirs(f'{sdir}/{day.year}', exist_ok=True)
+        qc_incremental(infile, outfile, ckpt, nobs, nsigma, final=final)
+
+    sys.exit(0)
 
 # Read the data
 data_df = pd.read_csv(f'{odir}/{date.year}/rapid_ValpoMetTower_{date.strftime("%Y%m%d")}.csv')
 
-# Convert dates into times
-dates = [datetime.strptime(date, "%Y-%m-%d_%H:%M:%S") for date in data_df["Tower Date (local)"].values]
-times = np.array([(date-dates[0]).total_seconds() for date in dates], dtype='float')
-
-# Extract data from the data frame
-obs = {'temp': data_df['Temp (C)'].values, 'rh': data_df['RH (%)'].values, 'pres': data_df['Pres (mb)'].values,
-       'rain': data_df['Daily Total Rain (mm)'].values, 'wspd': data_df['Wspd (m/s)'].values, 'wdir': data_df['Wdir (deg)'].values,
-       'swdown': data_df['SWdown (W/m2)'].values}
+# Convert dates into times and extract data from the data frame
+times = get_times(data_df)
+obs = get_obs(data_df)
 
 # Compute the standard deviation for each point and flag suspicious data
 # Then replace data and interpolate to uniform one second interval
-flags = {} # QC flags
-iobs = {} # Final interpolated data
-for k in obs.keys():
-    # Array to hold the QC flags
-    flags[k] = np.ones(obs[k].size)
-
-    # Compute mean and standard deviation over the window
-    for i in range(obs[k].size):
-        if (i < nobs//2): # left edge
-            sigma = np.nanstd(obs[k][i-nobs//2+(nobs//2-i):i+nobs//2]+(nobs//2-i))
-            mean = np.nanmean(obs[k][i-nobs//2+(nobs//2-i):i+nobs//2+(nobs//2-i)])
-
-        elif (obs[k].size-i < nobs//2): # right edge
-            sigma = np.nanstd(obs[k][i-nobs//2-(nobs//2-i):i-nobs//2]+(nobs//2-i))
-            mean = np.nanmean(obs[k][i-nobs//2-(nobs//2-i):i-nobs//2+(nobs//2-i)])
-
-        else: # body
-            sigma = np.nanstd(obs[k][i-nobs//2:i+nobs//2])
-            mean = np.nanmean(obs[k][i-nobs//2:i+nobs//2])
-
-        # Apply the sigma filter
-        if (abs(obs[k][i]-mean)>nsigma*sigma):
-            flags[k][i] = -1
-
-        # Check for -999
-            if (obs[k][i] == -999):
-                flags[k][i] = -1
-
-        # Apply some other basic filters
-        if (k == 'temp') and (obs[k][i] > 100):
-            flags[k][i] = -1
-        elif (k == 'rh') and (obs[k][i] > 105):
-            flags[k][i] = -1
-        elif (k == 'pres') and (obs[k][i] < 940):
-            flags[k][i] = -1
-
-    # If rain, just set all flags to good because it IS often a step function
-    if (k == 'rain'):
-        flags[k] = np.ones(obs[k].size)
-
-    # Interpolate the suspicious data
-    obs[k][flags[k] == -1] = np.nan
-    obs[k][np.isnan(obs[k])] = np.interp(times[np.isnan(obs[k])], times[~np.isnan(obs[k])], obs[k][~np.isnan(obs[k])], left=np.nan, right=np.nan)
-
-    # Extend QC flags to any remaining NaNs
-    flags[k][np.isnan(obs[k])] == -1
-
-# Final dictionary for writing out
-out_dict = OrderedDict([
-    ('Server Date (UTC)', data_df['Server Date (UTC)'].values),
-    ('Tower Date (local)', data_df["Tower Date (local)"].values),
-    ('Temp (C)', obs['temp']), ('Temp QC', flags['temp']),
-    ('RH (%)', obs['rh']), ('RH QC', flags['rh']),
-    ('Pres (mb)', obs['pres']), ('Pres QC', flags['pres']),
-    ('Daily Total Rain (mm)', obs['rain']), ('Rain QC', flags['rain']),
-    ('Wspd (m/s)', obs['wspd']), ('Wspd QC', flags['wspd']),
-    ('Wdir (deg)', obs['wdir']), ('Wdir QC', flags['wdir']),
-    ('SWdown (W/m2)', obs['swdown']), ('SWdown QC', flags['swdown'])
-])
-
-# Convert to dictionary and replace any empty strings with NaNs
-out_df = pd.DataFrame(out_dict)
-out_df = out_df.replace(r'^\s*$', np.nan, regex=True)
+flags, obs = qc_obs(obs, times, nobs, nsigma)
+
+# Build the output data frame
+out_df = build_output(data_df, obs, flags)
 
 # Write out the QC'd file
 try:
@@ -5,11 +5,17 @@
 ### Sept. 13th, 2024
 
 ### Import libraries
-from datetime import datetime
-import os
+import asyncio
+import sys
 import time
-import urllib.request as ureq
 import xml.etree.ElementTree as ET
+from tower_poller import TowerPoller, poll_forever
+from qc_engine import QC_HEADER, StreamingQC
+from tower_metrics import METRICS
+from tower_ring import RingWriter
+from tower_rollup import Rollup
+from tower_status import EXIT_TAGS, StatusParser, TagMismatch
+from tower_writer import DailyWriter
 
 ### The tower file url
 url = 'http://10.3.78.245/status.xml'
@@ -17,53 +23,124 @@ url = 'http://10.3.78.245/status.xml'
 ### location to save the data
 sdir = '/archive/campus_mesonet_data/mesonet_data/met_tower'
 
-while True:
-
-    # Pull the data and process it
-    server_time = datetime.utcnow()
-    data = list(ureq.urlopen(url))
-    data = list([dat.decode('utf-8') for dat in data]) # Retrieve text file
-    root = ET.fromstring(''.join(data))
-
-    wdir = float(root[4].text) # deg
-    wspd = float(root[5].text)*0.447 # m/s
-    sdown = float(root[6].text) # W/m2
-    temp = (float(root[10].text)-32.0)/1.8 # 'C
-    rh = float(root[11].text) # %
-    pres = float(root[12].text)*33.86 # hPa
-    rain = float(root[16].text)*25.4 # mm/hr
-    day_rain = float(root[14].text)*25.4 # mm
-    date = datetime.strptime(root[2].text+root[1].text, "%m/%d/%y%H:%M:%S")
-
-    # Try to create an annual folder to store the data in
-    year = date.strftime("%Y")
+### Also write the binary daily store (tower_binary.py) next to the CSV files
+write_binary = True
+
+### Write buffering: rows are written every flush_interval seconds or flush_rows rows,
+### fsync is 'never', 'flush' (after every write-out) or 'close' (see tower_writer.py)
+flush_interval = 10.0
+flush_rows = 60
+fsync = 'flush'
+
+### Hours of observations to publish in the shared memory ring buffer (tower_ring.py), 0 for none
+ring_hours = 48
+
+### Directory for the 1 min/10 min/hourly/daily rollups (tower_rollup.py), None for none
+rollup_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower/rollups'
+
+### Streaming QC (qc_engine.StreamingQC): directory for the QC'd files, None for none
+### (replaces the qc_rapid_data.py cron job, which refuses to run while this holds the QC directory's lock)
+qc_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower/QCd_data'
+qc_nobs = 300 # Observations in the standard deviation window (even)
+qc_nsigma = 0.75 # Standard deviations for the QC threshold
+
+### Metrics (tower_metrics.py): file rewritten every metrics_interval seconds, and an HTTP port
+### for /metrics (None for no server)
+metrics_file = '/tmp/tower_feed.prom'
+metrics_interval = 15.0
+metrics_port = None
+
+### Tag names of the status.xml fields (see tower_status.py), None to learn them from the first page
+### and save them to status_tags_file, which later starts read them from
+status_tags = None
+status_tags_file = '/archive/campus_mesonet_data/mesonet_data/met_tower/status_tags.json'
+
+### Polling options
+interval = 1.0 # Seconds between polls
+timeout = 0.8 # Seconds allowed for one request
+max_backoff = 30.0 # Longest wait (seconds) between retries while the tower is down
+
+# Reads the fields of each status page by tag name
+parser = StatusParser(status_tags, status_tags_file)
+
+# Function to process one status page and save the observation
+# writer, DailyWriter for the daily files
+# server_time, time the page was requested (UTC)
+# payload, raw status.xml bytes
+# parser, StatusParser of the station (the tower's by default)
+# Returns True if a new row was written (False for a bad page or a repeated observation)
+def process(writer, server_time, payload, parser=parser):
+
     try:
-        os.system(f'mkdir {sdir}/{year} > /dev/null 2>&1')
-    except:
-        pass
+        with METRICS.span('parse'):
+            found = parser.extract(payload)
+
+        t0 = time.perf_counter()
+        date, values = parser.convert(found) # 'C, %, hPa, mm/hr, mm, m/s, deg, W/m2
+        METRICS.observe('convert_seconds', time.perf_counter()-t0)
+    except (ET.ParseError, IndexError, TypeError, ValueError) as err:
+        METRICS.inc('parse_errors')
+        print('WARNING bad status page', err)
+        return False
 
     # Save the data
-    # First try to write to an existing file
-    try:
-        fnout = open(f"{sdir}/{year}/rapid_ValpoMetTower_{date.strftime('%Y%m%d')}.csv", 'r+')
+    with METRICS.span('write'):
+        saved = writer.write(date, server_time, tuple(values))
+    METRICS.inc('saved' if saved else 'duplicates')
+
+    return saved
+
+# Function to make the daily writer with the options above
+def make_writer():
+
+    # The ring starts with the recent history from the binary store
+    ring = None
+    if (ring_hours > 0):
+        ring = RingWriter(ring_hours)
+        print(f'Ring buffer loaded {ring.backfill(sdir)} records', flush=True)
 
-        # Check that not saving a duplicate time
-        if (datetime.strptime(list(fnout)[-1].split(',')[0], "%Y-%m-%d_%H:%M:%S") == date):
-            pass
-        else:
-            fnout.write(f'\n{server_time.strftime("%Y-%m-%d_%H:%M:%S")},{temp:.2f},{rh:.2f},{pres:.2f},{rain:.2f},{day_rain:.2f},{wspd:.2f},{wdir:.2f},{sdown:.2f}')
+    # Buckets left open by the last run are rebuilt from the binary store
+    rollup = None
+    if rollup_dir is not None:
+        rollup = Rollup(rollup_dir)
+        rollup.restore(sdir)
 
-    except Exception as err: # Must be a new file
-        print('WARNING', err)
+    # QC'd rows are written nobs/2 observations behind the feed
+    qc = None
+    if qc_dir is not None:
+        qc = StreamingQC(DailyWriter(qc_dir, prefix='rapid_qc_ValpoMetTower', header=QC_HEADER, flush_interval=flush_interval,
+                                     flush_rows=flush_rows, fsync=fsync), qc_nobs, qc_nsigma)
 
-        fnout = open(f"{sdir}/{year}/rapid_ValpoMetTower_{date.strftime('%Y%m%d')}.csv", 'a+')
+    return DailyWriter(sdir, binary=write_binary, flush_interval=flush_interval, flush_rows=flush_rows, fsync=fsync,
+                       ring=ring, rollup=rollup, qc=qc)
 
-        # Write header then data
-        fnout.write('Server Date (UTC),Temp (C),RH (%),Pres (mb),Rain Rate (mm/hr),Daily Total Rain (mm),Wspd (m/s),Wdir (deg),SWdown (W/m2)')
-        fnout.write(f'\n{server_time.strftime("%Y-%m-%d_%H:%M:%S")},{temp:.2f},{rh:.2f},{pres:.2f},{rain:.2f},{day_rain:.2f},{wspd:.2f},{wdir:.2f},{sdown:.2f}')
+# Function to write out buffered rows once they are due, even while the tower is not answering
+# writer, DailyWriter for the daily files
+async def flush_forever(writer):
 
-    # Close the file
-    fnout.close()
+    while True:
+        await asyncio.sleep(1.0)
+        writer.flush(force=False)
 
-    # Delay 1 second
-    time.sleep(1)
+# Function to poll the tower, flush the writer and export the metrics together
+async def main(writer, poller):
+
+    if metrics_port is not None:
+        await METRICS.serve(port=metrics_port)
+    await asyncio.gather(poll_forever(poller, lambda server_time, payload: process(writer, server_time, payload),
+                                      interval=interval, max_backoff=max_backoff),
+                         flush_forever(writer), METRICS.write_forever(metrics_file, metrics_interval))
+
+if __name__ == '__main__':
+
+    # Persistent writer for the daily files
+    writer = make_writer()
+    poller = TowerPoller(url, timeout=timeout)
+
+    try:
+        asyncio.run(main(writer, poller))
+    except TagMismatch as err:
+        print('ERROR', err, flush=True)
+        sys.exit(EXIT_TAGS)
+    finally:
+        writer.close()
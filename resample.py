@@ -0,0 +1,98 @@
+### Resampling of irregular tower observations onto a regular time grid.
+### The search indices and interpolation weights depend only on the
+### observation times and the grid, so they are computed once and every
+### variable is then interpolated together as rows of one 2-D array. Grid
+### points inside a gap in the data longer than max_gap are set to NaN instead
+### of being drawn as a straight line across the outage.
+###
+### Results match np.interp(grid, times, values, left=np.nan, right=np.nan)
+### wherever the gap mask does not apply.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+import numpy as np
+
+### Helper functions
+
+# Function to compute the interpolation weights for a grid
+# times, observation times (increasing, as np.interp needs)
+# grid, times to interpolate to
+# max_gap, longest gap (same units as times) to interpolate across, None for any
+# Returns the left and right indices, the weights of the right points and the mask of grid points with no value
+def weights(times, grid, max_gap=None):
+
+    times = np.asarray(times, dtype='float')
+    grid = np.asarray(grid, dtype='float')
+    n = times.size
+    if (n == 0):
+        zero = np.zeros(grid.size, dtype='int64')
+        return zero, zero, np.zeros(grid.size), np.ones(grid.size, dtype='bool')
+
+    # Bracketing observations of each grid point (the number of observations at or before it),
+    # counted per grid step for regular grids since that is much faster than a binary search
+    step = grid[1]-grid[0] if (grid.size > 1) else 0.0
+    if (step > 0) and (np.abs(np.diff(grid)-step).max() <= 1e-9*step):
+        cells = np.clip(np.ceil((times-grid[0])/step), 0, grid.size).astype('int64')
+        right = np.cumsum(np.bincount(cells, minlength=grid.size+1)[:grid.size])
+    else:
+        right = np.searchsorted(times, grid, side='right')
+    left = right-1
+    outside = (left < 0) | (grid > times[-1])
+    np.clip(left, 0, n-1, out=left)
+    np.clip(right, 0, n-1, out=right)
+
+    # Grid points on an observation take it as is
+    t0 = np.take(times, left)
+    span = np.take(times, right)-t0
+    w = np.zeros(grid.size)
+    np.divide(grid-t0, span, out=w, where=(span > 0) & ~outside)
+    exact = (w == 0)
+    right[exact] = left[exact] # So a missing neighbour does not spoil an exact value
+
+    # Grid points inside long gaps have no value
+    missing = outside
+    if max_gap is not None:
+        missing = missing | ((w > 0) & (span > max_gap))
+
+    return left, right, w, missing
+
+# Function to interpolate several variables with precomputed weights
+# wts, weights from weights()
+# values, 2-D array with one variable per row (or one 1-D variable)
+# Returns the interpolated array, one row per variable
+def apply(wts, values):
+
+    left, right, w, missing = wts
+    values = np.asarray(values, dtype='float')
+    out = np.take(values, right, axis=-1)
+    y0 = np.take(values, left, axis=-1)
+    out -= y0
+    out *= w
+    out += y0
+    out[..., missing] = np.nan
+
+    return out
+
+# Function to resample a set of columns onto a grid
+# times, observation times (sorted here if needed)
+# columns, dictionary of name, observations (or a data frame)
+# names, columns to resample
+# grid, times to interpolate to
+# max_gap, longest gap to interpolate across, None for any
+# Returns a dictionary of name, resampled array
+def resample(times, columns, names, grid, max_gap=None):
+
+    times = np.asarray(times, dtype='float')
+    values = np.array([np.asarray(columns[name], dtype='float') for name in names])
+
+    # Out of order rows (e.g. a clock step) would break the search
+    if (times.size > 1) and (np.diff(times) < 0).any():
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        values = values[:, order]
+
+    out = apply(weights(times, grid, max_gap), values)
+
+    return dict(zip(names, out))
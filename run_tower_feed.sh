@@ -3,7 +3,7 @@
 
 
 # ==== CONFIG ====
-SCRIPT="rapid_retrieve_data.py"
+SCRIPT="tower_supervisor.py"
 PYTHON="/miniforge3/envs/main/bin/python3"
 PYTHON_PID_FILE="/tmp/python_job.pid"
 PID_FILE="./watchdog.pid"
@@ -21,9 +21,8 @@ start() {
         # Trap cleanup inside subshell
         trap "rm -f $PID_FILE; exit 0" SIGINT SIGTERM
 
-        trap "rm -f $PYTHON_PID_FILE; exit 0" SIGINT SIGTERM
-
-        echo $$ > "$PID_FILE"
+        # $$ is the parent script's PID, the subshell's own PID is $BASHPID
+        echo $BASHPID > "$PID_FILE"
         while true; do
             echo "[$(date)] Starting $SCRIPT..." | tee -a "$LOG_FILE"
             $PYTHON "$SCRIPT" & PY_PID=$!
@@ -31,6 +30,13 @@ start() {
 
             wait $PY_PID
             EXIT_CODE=$?
+
+            # Exit code 2: the status.xml tags changed (see tower_status.py), restarting will not help
+            if [ "$EXIT_CODE" -eq 2 ]; then
+                echo "[$(date)] Script stopped on a configuration error (status.xml tags changed), not restarting" | tee -a "$LOG_FILE"
+                rm -f "$PID_FILE" "$PYTHON_PID_FILE"
+                exit 2
+            fi
             echo "[$(date)] Script exited with code $EXIT_CODE. Restarting in 5 seconds..." | tee -a "$LOG_FILE"
             sleep 5
         done
@@ -39,16 +45,25 @@ start() {
 }
 
 stop() {
+    # Stop the restart loop first so it does not relaunch the feed
+    if [ -f "$PID_FILE" ]; then
+        PID=$(cat "$PID_FILE")
+        echo "Stopping watchdog (PID $PID)..."
+        kill "$PID" 2>/dev/null
+        rm -f "$PID_FILE"
+    fi
+
+    # SIGTERM lets the supervisor flush and close the daily file
     if [ -f "$PYTHON_PID_FILE" ]; then
         PY_PID=$(cat "$PYTHON_PID_FILE")
         echo "Stopping Python process (PID $PY_PID)..."
+        kill -TERM "$PY_PID" 2>/dev/null
+        for i in $(seq 10); do
+            kill -0 "$PY_PID" 2>/dev/null || break
+            sleep 1
+        done
         kill -9 "$PY_PID" 2>/dev/null
-    fi
-
-    if [ -f "$PID_FILE" ]; then
-        PID=$(cat "$PID_FILE")
-        echo "Stopping watchdog (PID $PID)..."
-        kill -9 "$PID" 2>/dev/null
+        rm -f "$PYTHON_PID_FILE"
         echo "Stopped."
     else
         echo "Not running."
@@ -59,6 +74,7 @@ status() {
 
     if [ -f "$PYTHON_PID_FILE" ] && kill -0 $(cat "$PYTHON_PID_FILE") 2>/dev/null; then
         echo "Python job running (PID $(cat $PYTHON_PID_FILE))"
+        $PYTHON "$SCRIPT" status
     else
         echo "Python job not running"
     fi
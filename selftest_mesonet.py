@@ -0,0 +1,87 @@
+### Check of mesonet_retrieve_data.py against stand-in stations (station_sim.py).
+### Every station of a temporary mesonet is polled for a while, including one
+### that answers slower than the timeout, one that is down and one that cannot
+### write its files, and the rows each one wrote are counted.
+###
+### Run with "python selftest_mesonet.py" (exits non-zero on a failure)
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Number of stand-in stations and seconds to poll them
+nstations = 8
+seconds = 10.0
+
+#####  END OPTIONS  #####
+
+### Import libraries
+import asyncio
+from glob import glob
+import shutil
+import sys
+import tempfile
+import time
+import mesonet_retrieve_data
+import rapid_retrieve_data as feed
+import station_sim
+
+# Function to poll stand-in stations for a while and check what each one wrote
+# Every second stand-in lists its tags in reverse order, one answers slower than the timeout,
+# one URL has nothing listening and one station cannot write its files (its directory is a
+# file); those three must write nothing while the others keep their one row per second
+# nstations, number of stand-in stations
+# seconds, seconds to poll them
+# Returns the number of stations that did not behave
+async def selftest(nstations=nstations, seconds=seconds):
+
+    tdir = tempfile.mkdtemp()
+    feed.metrics_file = f'{tdir}/metrics.prom'
+    sims = [station_sim.SimStation(delay=2.0*mesonet_retrieve_data.timeout if (k == 1) else 0.0, reverse=(k%2 == 1), temp=50.0+k)
+            for k in range(nstations)]
+    for sim in sims:
+        await sim.start()
+    dead = station_sim.SimStation()
+    await dead.start()
+    await dead.stop()
+
+    # Registry entries as stations.load makes them
+    urls = {f'SIM{k:02d}': sim.url for k, sim in enumerate(sims)}
+    urls['DEAD'] = dead.url
+    urls['BROKEN'] = sims[0].url
+    open(f'{tdir}/BROKEN', 'w').close()
+    mesonet = [mesonet_retrieve_data.Station(sid, {'url': url, 'sdir': f'{tdir}/{sid}', 'prefix': f'rapid_{sid}', 'tags': station_sim.FIELD_TAGS,
+                             'feed': False}) for sid, url in urls.items()]
+
+    t0 = time.process_time()
+    try:
+        await asyncio.wait_for(mesonet_retrieve_data.main(mesonet), seconds)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        for station in mesonet:
+            station.writer.close()
+        for sim in sims:
+            await sim.stop()
+    cpu = time.process_time()-t0
+
+    # Rows written by each station
+    nbad = 0
+    for station in mesonet:
+        nrows = 0
+        for path in glob(f'{tdir}/{station.id}/*/rapid_{station.id}_*.csv'):
+            with open(path, 'r') as fn:
+                nrows += sum(1 for line in fn)-1
+        silent = station.id in ('DEAD', 'BROKEN', 'SIM01')
+        ok = (nrows == 0) if silent else (nrows >= 0.7*seconds)
+        nbad += not ok
+        print(f'{station.id:6s} {nrows:4d} rows  {"ok" if ok else "FAILED"}{" (expected none)" if silent else ""}', flush=True)
+    print(f'{len(mesonet)-nbad} of {len(mesonet)} stations ok in {seconds:.0f} s, {cpu:.2f} s CPU (stand-ins included)', flush=True)
+    shutil.rmtree(tdir)
+
+    return nbad
+
+if __name__ == '__main__':
+
+    sys.exit(1 if asyncio.run(selftest()) else 0)
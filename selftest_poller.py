@@ -0,0 +1,68 @@
+### Check of the keep-alive poller (tower_poller.py) against a stand-in
+### station (station_sim.py): one connection serves many polls, and the poller
+### reconnects after the station drops the connection or restarts.
+###
+### Run with "python selftest_poller.py" (exits non-zero on a failure)
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+import asyncio
+import sys
+import station_sim
+from tower_poller import TowerPoller
+
+# Function to fetch a number of times, counting the failures
+# poller, TowerPoller
+# polls, number of fetches
+async def fetch_count(poller, polls):
+
+    failures = 0
+    for k in range(polls):
+        try:
+            await poller.fetch()
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            failures += 1
+
+    return failures
+
+# Function to check the poller against a stand-in station
+# polls, number of polls on each connection
+# Returns the number of failed checks
+async def selftest(polls=20):
+
+    sim = station_sim.SimStation()
+    await sim.start()
+    poller = TowerPoller(sim.url, timeout=1.0)
+    results = []
+
+    # One connection serves every poll
+    failures = await fetch_count(poller, polls)
+    results.append((f'{polls} polls over one connection', (failures == 0) and (sim.connections == 1) and (sim.requests == polls)))
+
+    # The station closes the connection: at most the next poll fails, then one new connection serves the rest
+    await sim.drop()
+    failures = await fetch_count(poller, polls)
+    results.append(('reconnects after the station drops the connection', (failures <= 1) and (sim.connections == 2)
+                    and (sim.requests == 2*polls-failures)))
+
+    # The station goes down and comes back on the same port
+    port = sim.port
+    await sim.stop()
+    down = await fetch_count(poller, 1)
+    await sim.start(port)
+    failures = await fetch_count(poller, polls)
+    results.append(('reconnects after the station restarts', (down == 1) and (failures == 0) and (sim.connections == 3)))
+
+    await poller.close()
+    await sim.stop()
+    for name, ok in results:
+        print(f'{name}: {"ok" if ok else "FAILED"}')
+    print(f'{sim.connections} connections, {sim.requests} pages served')
+
+    return sum(not ok for name, ok in results)
+
+if __name__ == '__main__':
+
+    sys.exit(1 if asyncio.run(selftest()) else 0)
@@ -0,0 +1,100 @@
+### Check of tower_query.py against rollups computed in one go.
+### Three tower days of synthetic observations are written to a temporary
+### binary store, and rollup stores are written that cover only part of the
+### range: none at all, from the middle of the range on, and everything but a
+### hole of one day. Every query over the whole range must match the rollups
+### of all the observations, wherever they come from.
+###
+### Run with "python selftest_query.py" (exits non-zero on a failure)
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Days of synthetic data and seconds between observations
+ndays = 3
+step = 5
+
+# Rollup levels to check
+levels = ('10min', '1h', '1day')
+
+#####  END OPTIONS  #####
+
+### Import libraries
+from datetime import datetime, timedelta, timezone
+import shutil
+import sys
+import tempfile
+import numpy as np
+import tower_query
+import tower_rollup
+from time_axis import TOWER_UTC_OFFSET
+from tower_binary import DTYPE
+from tower_writer import DailyWriter
+
+# Function to write the synthetic observations
+# sdir, data directory
+# start, first observation (epoch seconds UTC, a tower midnight)
+# Returns the observations as a tower_binary structured array
+def write_days(sdir, start):
+
+    rng = np.random.default_rng(1)
+    data = np.zeros(ndays*86400//step, dtype=DTYPE)
+    data['time'] = start+np.arange(data.size)*step
+    for name in DTYPE.names[1:]:
+        data[name] = np.round(rng.uniform(0.0, 100.0, data.size), 2)
+
+    writer = DailyWriter(sdir, binary=True, flush_interval=60.0, flush_rows=1000)
+    for row in data:
+        utc = datetime.fromtimestamp(int(row['time']), timezone.utc)
+        writer.write((utc+timedelta(seconds=TOWER_UTC_OFFSET)).replace(tzinfo=None), utc, [float(row[name]) for name in DTYPE.names[1:]])
+    writer.close()
+
+    return data
+
+# Function to check one query against the full rollups
+# name, description of the case
+# rdir, rollup directory holding the stored part
+# sdir, data directory
+# level, rollup level
+# start, end, the range
+# truth, rollups of all the observations
+# Returns True if they match
+def check(name, rdir, sdir, level, start, end, truth):
+
+    result = tower_query.query(start, end, None, level, sdir=sdir, rdir=rdir)
+    same = np.array_equal(result['time'], truth['time'])
+    if same:
+        for field in tower_rollup.DTYPE.names[1:]:
+            same = same and np.allclose(result[field], truth[field], equal_nan=True)
+    print(f'{level:5s} {name:28s} {result["time"].size:5d} buckets  {"ok" if same else "FAILED"}', flush=True)
+
+    return same
+
+if __name__ == '__main__':
+
+    tdir = tempfile.mkdtemp()
+    sdir = f'{tdir}/data'
+    start = int(tower_rollup.bucket_start(datetime(2025, 6, 1, tzinfo=timezone.utc).timestamp(), 86400))
+    end = start+ndays*86400
+    data = write_days(sdir, start)
+
+    nbad = 0
+    for level in levels:
+        truth = tower_rollup.aggregate(data, level)
+        middle = start+86400+43200 # Half way through the second day
+
+        # Which stored buckets each case keeps
+        cases = {'nothing stored': np.zeros(truth.size, dtype='bool'),
+                 'stored from mid-range': truth['time'] >= middle,
+                 'stored with a one day hole': (truth['time'] < start+86400) | (truth['time'] >= start+2*86400)}
+        for name, keep in cases.items():
+            rdir = tempfile.mkdtemp(dir=tdir)
+            if keep.any():
+                tower_rollup.append_records(rdir, level, truth[keep])
+            nbad += not check(name, rdir, sdir, level, start, end, truth)
+
+    shutil.rmtree(tdir)
+    print(f'{3*len(levels)-nbad} of {3*len(levels)} queries match')
+    sys.exit(1 if nbad else 0)
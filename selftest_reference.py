@@ -0,0 +1,161 @@
+### Check of the faster tower code against the original code, on the
+### synthetic day of benchmark.py: the vectorized QC engine against the
+### original per-sample loop, incremental QC in cron-sized pieces against one
+### full-day QC, and the decimated meteogram against one drawn with all points.
+###
+### Run with "python selftest_reference.py" (exits non-zero if the decimated meteogram
+### differs by more than max_pixel_diff or the QC does not match)
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Resolution for the meteogram comparison
+dpi = 100
+
+# Largest fraction of the meteogram's pixels that decimation may change
+max_pixel_diff = 0.025
+
+#####  END OPTIONS  #####
+
+# Import required modules
+from datetime import datetime, timedelta
+from io import BytesIO
+import os
+import shutil
+import sys
+import tempfile
+import time
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as pp
+import numpy as np
+from benchmark import nobs, nsigma, synthetic_day
+from qc_engine import get_obs, get_times, qc_file, qc_incremental, qc_obs
+
+### Helper functions
+
+# Function with the original per-sample QC loop, kept as the reference
+# obs, dictionary of observations
+def qc_loop(obs):
+
+    flags = {}
+    for k in obs.keys():
+        x = np.array(obs[k], dtype='float')
+        flags[k] = np.ones(x.size)
+        for i in range(nobs//2, x.size-nobs//2):
+            sigma = np.nanstd(x[i-nobs//2:i+nobs//2])
+            mean = np.nanmean(x[i-nobs//2:i+nobs//2])
+            if (abs(x[i]-mean) > nsigma*sigma):
+                flags[k][i] = -1
+
+    return flags
+
+# Function to render the meteogram with and without decimation and compare the images
+# Returns the render times and the fraction of pixels that differ
+def compare_decimation():
+
+    import make_rapid_plot
+    from meteogram import Meteogram
+
+    # Write a synthetic day where make_rapid_plot expects it
+    date = datetime(2025, 6, 1)
+    tdir = tempfile.mkdtemp()
+    os.makedirs(f'{tdir}/{date.year}')
+    synthetic_day(date+timedelta(hours=5)).to_csv(f'{tdir}/{date.year}/rapid_ValpoMetTower_{date.strftime("%Y%m%d")}.csv', index=False)
+    make_rapid_plot.data_dir = tdir
+    itimes, wtimes, traces = make_rapid_plot.prepare_day(date)
+
+    images = []
+    seconds = []
+    for methods in ({k: 'none' for k in traces.keys()}, None):
+        meteo = Meteogram(dpi=dpi, methods=methods)
+        meteo.update(date, itimes, wtimes, traces)
+        t0 = time.perf_counter()
+        images.append(pp.imread(BytesIO(meteo.render())))
+        seconds.append(time.perf_counter()-t0)
+        pp.close(meteo.fig)
+
+    diff = np.any(np.abs(images[0]-images[1]) > 0.1, axis=-1).mean()
+
+    return seconds, diff
+
+# Function to QC the start of a day in small cron-sized pieces and compare with one full QC
+# nrows, rows of the synthetic day to use
+# pieces, number of rows added before each incremental call (the rest are added before the final call)
+# Returns True if the appended QC'd file matches the full one
+def compare_incremental(nrows=3000, pieces=(50, 100, 100, 200, 400, 1000)):
+
+    tdir = tempfile.mkdtemp()
+    synthetic_day().iloc[:nrows].to_csv(f'{tdir}/full.csv', index=False, float_format='%.2f')
+    qc_file(f'{tdir}/full.csv', f'{tdir}/qc_full.csv', nobs, nsigma)
+
+    with open(f'{tdir}/full.csv', 'r') as fn:
+        lines = fn.read().splitlines(True)
+    with open(f'{tdir}/partial.csv', 'w') as fn:
+        fn.write(lines[0])
+    ends = np.cumsum((1,)+tuple(pieces))
+    for start, end, final in zip(ends, list(ends[1:])+[len(lines)], [False]*len(pieces)+[True]):
+        with open(f'{tdir}/partial.csv', 'a') as fn:
+            fn.writelines(lines[start:end])
+        qc_incremental(f'{tdir}/partial.csv', f'{tdir}/qc_inc.csv', f'{tdir}/qc_inc.ckpt', nobs, nsigma, final=final)
+
+    with open(f'{tdir}/qc_full.csv', 'r') as fn1, open(f'{tdir}/qc_inc.csv', 'r') as fn2:
+        same = (fn1.read() == fn2.read())
+    shutil.rmtree(tdir)
+
+    return same
+
+# Function with the comparisons against the original code
+# Returns the number of comparisons outside their limits
+def reference():
+
+    nbad = 0
+
+    # Meteogram rendering with and without decimation
+    seconds, diff = compare_decimation()
+    print(f'Meteogram render, all points:  {seconds[0]:8.3f} s')
+    print(f'Meteogram render, decimated:   {seconds[1]:8.3f} s  ({100*diff:.2f}% of pixels differ)')
+    if (diff > max_pixel_diff):
+        print(f'REFERENCE decimated meteogram differs in more than {100*max_pixel_diff:.2f}% of pixels')
+        nbad += 1
+
+    data_df = synthetic_day()
+    times = get_times(data_df)
+    print(f'Synthetic day: {len(data_df)} rows')
+
+    # Vectorized QC engine
+    t0 = time.perf_counter()
+    flags, _ = qc_obs(get_obs(data_df), times, nobs, nsigma)
+    t_engine = time.perf_counter()-t0
+    print(f'QC engine:           {t_engine:8.3f} s')
+
+    # Original loop (sigma filter only, body of the day)
+    t0 = time.perf_counter()
+    ref = qc_loop(get_obs(data_df))
+    t_loop = time.perf_counter()-t0
+    print(f'Per-sample QC loop:  {t_loop:8.3f} s  ({t_loop/t_engine:.0f}x slower)')
+
+    # Compare the sigma flags away from the edges (rain is never flagged by the engine)
+    body = slice(nobs//2, len(data_df)-nobs//2)
+    for k in ref.keys():
+        if (k == 'rain'):
+            continue
+        vals = get_obs(data_df)[k][body]
+        sigma_flags = flags[k][body].copy()
+        sigma_flags[(vals == -999) | (np.isnan(vals))] = ref[k][body][(vals == -999) | (np.isnan(vals))]
+        ndiff = np.sum(sigma_flags != ref[k][body])
+        print(f'  {k:7s} flags differing from reference: {ndiff}')
+        nbad += (ndiff > 0)
+
+    # Incremental QC from the start of a day against one full QC
+    same = compare_incremental()
+    print(f'Incremental QC matches full-day QC: {"yes" if same else "NO"}')
+    nbad += not same
+
+    return nbad
+
+if __name__ == '__main__':
+
+    sys.exit(1 if reference() else 0)
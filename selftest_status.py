@@ -0,0 +1,53 @@
+### Check of the status.xml extractor (tower_status.py) against the old way of
+### reading the page, by position in a full ElementTree parse. The sample
+### pages in status_samples/ have the tower's tag positions with varied layout
+### and values.
+###
+### Run on the samples with "python selftest_status.py", or on other saved pages with
+### "python selftest_status.py status.xml [status.xml ...]" (exits non-zero on a mismatch)
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+from datetime import datetime
+from glob import glob
+import os
+import sys
+import xml.etree.ElementTree as ET
+import numpy as np
+from tower_status import OFFSET, POSITIONS, SCALE, VALUES, StatusParser
+
+# Function to parse a status page the old way, by position in a full tree
+# payload, raw status.xml bytes
+# Returns the tower time and the converted VALUES
+def parse_tree(payload):
+
+    root = ET.fromstring(payload)
+    values = np.array([float(root[POSITIONS[field]].text) for field in VALUES])*SCALE+OFFSET
+    date = datetime.strptime(root[POSITIONS['date']].text+root[POSITIONS['time']].text, '%m/%d/%y%H:%M:%S')
+
+    return date, values
+
+# Sample pages (same tag positions as the tower's, with varied layout and values)
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'status_samples', '*.xml')
+
+if __name__ == '__main__':
+
+    paths = sys.argv[1:] if (len(sys.argv) > 1) else sorted(glob(SAMPLES))
+    if (len(paths) == 0):
+        print('No pages to check')
+        sys.exit(1)
+
+    parser = StatusParser()
+    bad = 0
+    for path in paths:
+        with open(path, 'rb') as fn:
+            payload = fn.read()
+        date, values = parser.parse(payload)
+        date0, values0 = parse_tree(payload)
+        if (date != date0) or not np.allclose(values, values0, equal_nan=True):
+            bad += 1
+            print('MISMATCH', path, date, values, date0, values0)
+    print(f'{len(paths)-bad} of {len(paths)} pages match, tags {parser.tags}')
+    sys.exit(1 if bad else 0)
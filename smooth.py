@@ -0,0 +1,84 @@
+### Rolling (boxcar) smoothing of the meteogram traces.
+### Moving means come from cumulative sums of the valid values and a
+### cumulative count, so each trace costs O(n) whatever the window size,
+### missing values are skipped instead of blanking the whole window, and the
+### output has one value per input sample (centred window, shrunk at the ends
+### of the day) so it shares the input time axis.
+### Wind direction is averaged through its u/v components, so 350 and 10
+### degrees average to 0 and not 180.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+import numpy as np
+
+# Least fraction of a window that must hold valid data for a smoothed value
+MIN_FRAC = 0.5
+
+### Helper functions
+
+# Function to sum a trace over a centred rolling window
+# x, trace (NaNs are skipped)
+# npts, number of points in the window
+# Returns the window sums, the number of valid points and the window length at each point
+def _window_sums(x, npts):
+
+    n = x.size
+    valid = np.isfinite(x)
+    csum = np.concatenate(([0.0], np.cumsum(np.where(valid, x, 0.0))))
+    ccnt = np.concatenate(([0], np.cumsum(valid)))
+
+    # Window [i-npts/2, i-npts/2+npts) clipped to the trace
+    index = np.arange(n)
+    start = np.clip(index-npts//2, 0, n)
+    end = np.clip(index-npts//2+npts, 0, n)
+
+    return csum[end]-csum[start], ccnt[end]-ccnt[start], end-start
+
+# Function for a NaN-aware moving mean
+# x, trace
+# npts, number of points in the window
+# min_frac, least fraction of the window that must be valid (NaN otherwise)
+# Returns the smoothed trace, the same size as x
+def mean(x, npts, min_frac=MIN_FRAC):
+
+    x = np.asarray(x, dtype='float')
+    if (x.size == 0):
+        return np.array([])
+
+    # Remove the overall mean so the cumulative sums stay well conditioned
+    valid = np.isfinite(x)
+    offset = np.mean(x[valid]) if valid.any() else 0.0
+    total, count, length = _window_sums(x-offset, npts)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = total/count+offset
+    out[(count == 0) | (count < min_frac*length)] = np.nan
+
+    return out
+
+# Function for a moving vector average of the wind direction
+# wdir, wind direction (deg)
+# npts, number of points in the window
+# wspd, wind speed to weight the vectors by (as tower_rollup.py does), None for unit vectors
+# min_frac, least fraction of the window that must be valid (NaN otherwise)
+# Returns the smoothed direction (deg, 0 to 360), the same size as wdir
+def direction(wdir, npts, wspd=None, min_frac=MIN_FRAC):
+
+    rad = np.radians(np.asarray(wdir, dtype='float'))
+    weight = 1.0 if (wspd is None) else np.asarray(wspd, dtype='float')
+    if (rad.size == 0):
+        return np.array([])
+
+    u, count, length = _window_sums(weight*np.sin(rad), npts)
+    v = _window_sums(weight*np.cos(rad), npts)[0]
+    total = _window_sums(np.abs(weight*np.ones(rad.size)), npts)[0]
+
+    out = np.degrees(np.arctan2(u, v))%360.0
+    out[out >= 360.0] = 0.0 # Rounding of small negative angles
+
+    # No valid data, calm, or opposing winds that cancel out
+    out[(count == 0) | (count < min_frac*length) | (np.hypot(u, v) <= 1e-9*total)] = np.nan
+
+    return out
@@ -0,0 +1,101 @@
+### Stand-in stations for checking the pollers without the tower's network.
+### Each stand-in is a small asyncio HTTP/1.1 server on 127.0.0.1 that answers
+### every GET on a keep-alive connection with a status.xml page laid out like
+### the pages in status_samples/, stamped with the current time so each poll
+### gives a new observation. A stand-in can answer late (delay), list its tags
+### in reverse order (read by name with FIELD_TAGS), and counts the
+### connections and requests it has served.
+###
+### Used by selftest_poller.py and selftest_mesonet.py
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+import asyncio
+from datetime import datetime
+
+# Tags of a stand-in page in their usual order
+TAGS = ('model', 'time', 'date', 'sn', 'winddir', 'windspeed', 'solarrad', 'a', 'b', 'c', 'outtemp', 'outhum',
+        'barometer', 'd', 'dailyrain', 'e', 'rainrate')
+
+# Tag name of each field (tower_status.py), for StatusParser
+FIELD_TAGS = {'time': 'time', 'date': 'date', 'wdir': 'winddir', 'wspd': 'windspeed', 'sdown': 'solarrad', 'temp': 'outtemp',
+              'rh': 'outhum', 'pres': 'barometer', 'day_rain': 'dailyrain', 'rain': 'rainrate'}
+
+### One stand-in station
+class SimStation:
+
+    # delay, seconds to wait before each answer
+    # reverse, True to list the tags in reverse order
+    # temp, outside temperature on the page ('F)
+    def __init__(self, delay=0.0, reverse=False, temp=55.4):
+
+        self.delay = delay
+        self.reverse = reverse
+        self.temp = temp
+        self.server = None
+        self.port = None
+        self.url = None # Status page URL once started
+        self.connections = 0 # Connections accepted
+        self.requests = 0 # Pages served
+        self.open = {} # Writer and handler task of each open connection
+
+    # Function to build the page for the current time
+    def page(self):
+
+        now = datetime.now()
+        values = ('VP2', now.strftime('%H:%M:%S'), now.strftime('%m/%d/%y'), '1', '271', '5.3', '412.0', '0', '0', '0',
+                  f'{self.temp:.1f}', '61', '29.92', '0', '0.12', '0', '0.00')
+        order = reversed(range(len(TAGS))) if self.reverse else range(len(TAGS))
+
+        return ('<response>'+''.join(f'<{TAGS[k]}>{values[k]}</{TAGS[k]}>' for k in order)+'</response>').encode('ascii')
+
+    # Function to answer the requests of one connection until the client closes it
+    async def serve(self, reader, writer):
+
+        self.connections += 1
+        self.open[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if (line == b''):
+                    break
+                while (await reader.readline()) not in (b'\r\n', b''):
+                    pass
+                if (self.delay > 0):
+                    await asyncio.sleep(self.delay)
+                body = self.page()
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/xml\r\nContent-Length: %d\r\n\r\n' % len(body)+body)
+                await writer.drain()
+                self.requests += 1
+        except (OSError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass # Cancelled by stop (ends quietly, a cancelled handler task is reported as an error)
+        finally:
+            self.open.pop(writer, None)
+            writer.close()
+
+    # Function to start listening
+    # port, port to listen on (0 for any free port)
+    async def start(self, port=0):
+
+        self.server = await asyncio.start_server(self.serve, '127.0.0.1', port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{self.port}/status.xml'
+
+    # Function to close the open connections and keep listening (like a station timing out idle clients)
+    async def drop(self):
+
+        tasks = list(self.open.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Function to stop listening and close the open connections
+    async def stop(self):
+
+        if self.server is not None:
+            self.server.close()
+            await self.drop()
+            await self.server.wait_closed()
+            self.server = None
@@ -0,0 +1,65 @@
+### Registry of the campus mesonet stations polled by mesonet_retrieve_data.py.
+### Each station has an id, the URL of its status page, the directory its
+### daily files go to (annual folders, like the met tower's), the daily file
+### prefix and the status.xml tag names of its fields (tower_status.py).
+### More stations can be listed in a JSON file (registry_file) with the same
+### layout, e.g. {"ChapelRoof": {"url": "http://10.3.78.250/status.xml"}};
+### anything left out takes the defaults below.
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Root directory of the mesonet data (a station's default directory is {data_root}/{id})
+data_root = '/archive/campus_mesonet_data/mesonet_data'
+
+# Stations
+#   url, status page of the station
+#   sdir, directory for its daily files
+#   prefix, daily file name prefix ({prefix}_YYYYMMDD.csv)
+#   tags, dictionary of field, status.xml tag name (None to learn them from their positions on the first start and
+#         save them to {sdir}/status_tags.json, see tower_status.py)
+#   feed, True for the station whose writer also fills the ring buffer, rollups and streaming QC
+#         (rapid_retrieve_data.make_writer, which uses that script's sdir)
+STATIONS = {
+    'ValpoMetTower': {'url': 'http://10.3.78.245/status.xml', 'sdir': f'{data_root}/met_tower',
+                      'prefix': 'rapid_ValpoMetTower', 'tags': None, 'feed': True},
+}
+
+# JSON file with more stations (merged over STATIONS), None for none
+registry_file = None
+
+#####  END OPTIONS  #####
+
+### Import libraries
+import json
+import re
+
+# Allowed station ids (they are used in file names)
+ID = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# Function to load the station registry
+# path, JSON file with more stations, None for STATIONS only
+# Returns a dictionary of id, complete station entry
+def load(path=registry_file):
+
+    entries = {sid: dict(entry) for sid, entry in STATIONS.items()}
+    if path is not None:
+        with open(path, 'r') as fn:
+            for sid, entry in json.load(fn).items():
+                entries[sid] = {**entries.get(sid, {}), **entry}
+
+    registry = {}
+    for sid, entry in entries.items():
+        if not ID.match(sid):
+            raise ValueError(f'Bad station id {sid!r}')
+        if ('url' not in entry):
+            raise ValueError(f'Station {sid} has no url')
+        registry[sid] = {'url': entry['url'], 'sdir': entry.get('sdir', f'{data_root}/{sid}'),
+                         'prefix': entry.get('prefix', f'rapid_{sid}'), 'tags': entry.get('tags'),
+                         'feed': bool(entry.get('feed', False))}
+    if (sum(entry['feed'] for entry in registry.values()) > 1):
+        raise ValueError('Only one station can have feed set')
+
+    return registry
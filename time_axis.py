@@ -0,0 +1,86 @@
+### Shared time axis for the met tower scripts.
+### Timestamps in the data files ("%Y-%m-%d_%H:%M:%S") are parsed in one
+### vectorized pass into int64 epoch seconds, and local time comes from
+### zoneinfo rather than fixed offsets and DST dates.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+import numpy as np
+
+# Local timezone of the tower
+TIMEZONE = 'America/Chicago'
+
+# The tower's own clock stays on daylight time all year (UTC-5)
+TOWER_UTC_OFFSET = -5*3600
+
+### Helper functions
+
+# Function to parse timestamps into epoch seconds
+# stamps, array of "%Y-%m-%d_%H:%M:%S" strings
+# Returns int64 seconds since 1970-01-01 in the same clock as the strings
+def parse_stamps(stamps):
+
+    stamps = np.asarray(stamps).astype('U19')
+    if (stamps.size == 0):
+        return np.array([], dtype='int64')
+
+    # Swap the "_" separator for the ISO "T" so NumPy can parse the strings
+    chars = stamps.view('U1').reshape(stamps.size, 19)
+    chars[:, 10] = 'T'
+
+    return stamps.astype('datetime64[s]').astype('int64')
+
+# Function to get the UTC offset for each time
+# epoch, epoch seconds UTC
+# tz, timezone name
+# Returns the offsets (s), looked up once per distinct hour
+def utc_offsets(epoch, tz=TIMEZONE):
+
+    zone = ZoneInfo(tz)
+    hours, index = np.unique(np.asarray(epoch, dtype='int64')//3600, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(h*3600, timezone.utc).astimezone(zone).utcoffset().total_seconds()
+                        for h in hours], dtype='int64')
+
+    return offsets[index.reshape(-1)]
+
+# Function to convert UTC epoch seconds to local wall-clock epoch seconds
+# epoch, epoch seconds UTC
+# tz, timezone name
+def to_local(epoch, tz=TIMEZONE):
+
+    epoch = np.asarray(epoch, dtype='int64')
+    if (epoch.size == 0):
+        return epoch
+
+    return epoch+utc_offsets(epoch, tz)
+
+# Function to get local wall-clock seconds since midnight of a given day
+# epoch, epoch seconds UTC
+# day, the local date (datetime or date) to measure from
+# tz, timezone name
+# Returns float seconds, negative before the day and past 86400 after it
+def seconds_of_day(epoch, day, tz=TIMEZONE):
+
+    midnight = (np.datetime64(f'{day.year:04d}-{day.month:02d}-{day.day:02d}', 's')).astype('int64')
+
+    return (to_local(epoch, tz)-midnight).astype('float')
+
+# Function to convert tower clock times to UTC
+# epoch, epoch seconds on the tower clock (e.g. from the "Tower Date (local)" column)
+def tower_to_utc(epoch):
+
+    return np.asarray(epoch, dtype='int64')-TOWER_UTC_OFFSET
+
+# Function to get the UTC span of one tower day (one daily file)
+# day, the date (datetime or date) of the file
+# Returns the first and the end (exclusive) epoch seconds UTC
+def tower_day_bounds(day):
+
+    midnight = int(np.datetime64(f'{day.year:04d}-{day.month:02d}-{day.day:02d}', 's').astype('int64'))
+    start = midnight-TOWER_UTC_OFFSET
+
+    return start, start+86400
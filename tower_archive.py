@@ -0,0 +1,232 @@
+### Compression of closed days in the met tower archive, and the reader used
+### by the other scripts to open a daily CSV file whether it is still plain
+### (.csv) or compressed (.csv.gz, or .csv.zst with the zstandard package).
+###
+### Each closed day's rapid, minutely and QC'd CSV files are compressed to a
+### temporary file, checked by decompressing it again and comparing SHA-256
+### digests, and only then replace the original. The digest of the original
+### is kept next to it (rapid_ValpoMetTower_YYYYMMDD.csv.sha256, in sha256sum
+### format) and the original modification time is kept, so checks against
+### other files' mtimes still work. Binary stores (.bin), summaries and QC
+### checkpoints are left as they are.
+###
+### Compress every closed day with "python tower_archive.py" (e.g. from cron
+### after midnight) and check the compressed files with "python tower_archive.py verify"
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Location of the rapid and minutely data files (annual folders)
+data_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower'
+
+# Location of the QC'd files (annual folders)
+qc_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower/QCd_data'
+
+# Compression, 'gzip' or 'zstd' (needs the zstandard package), and its level
+method = 'gzip'
+level = 6
+
+# Days left uncompressed (today and yesterday are still written and QC'd)
+keep_days = 2
+
+#####  END OPTIONS  #####
+
+### Import libraries
+from datetime import datetime, timedelta
+from glob import glob
+from zoneinfo import ZoneInfo
+import gzip
+import hashlib
+import io
+import os
+import re
+import sys
+from time_axis import TIMEZONE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File suffix of each compression, in the order a day is looked for
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Daily files that are compressed (annual folders under data_dir or qc_dir)
+PATTERNS = (('data_dir', 'rapid_ValpoMetTower_*.csv'), ('data_dir', 'ValpoMetTower_*.csv'),
+            ('qc_dir', 'rapid_qc_ValpoMetTower_*.csv'))
+
+# Date in a daily file name
+DAY = re.compile(r'_(\d{8})\.csv')
+
+### Helper functions
+
+# Function to find a daily CSV file in any of its forms
+# path, path of the plain file (ending in .csv)
+# Returns the existing path (plain first), None if there is none
+def find(path):
+
+    for candidate in [path]+[path+suffix for suffix in SUFFIXES.values()]:
+        if os.path.exists(candidate):
+            return candidate
+
+    return None
+
+# Function to strip the compression suffix from a path
+# path, path of a daily file
+def plain(path):
+
+    for suffix in SUFFIXES.values():
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+
+    return path
+
+# Function to list daily CSV files in any of their forms
+# pattern, glob pattern of the plain files (ending in .csv)
+# Returns the existing paths, one per day (plain first), sorted by the plain path
+def glob_days(pattern):
+
+    found = {}
+    for suffix in ['']+list(SUFFIXES.values()):
+        for path in glob(pattern+suffix):
+            found.setdefault(plain(path), path)
+
+    return [found[key] for key in sorted(found)]
+
+# Function to open a daily CSV file for reading, compressed or not
+# path, path of the plain file (any form is found) or of a compressed form (opened as is)
+# mode, 'rb' or 'rt'
+def open_day(path, mode='rt'):
+
+    found = path if ((path != plain(path)) and os.path.exists(path)) else find(plain(path))
+    if found is None:
+        raise FileNotFoundError(path)
+
+    if found.endswith('.gz'):
+        return gzip.open(found, mode)
+    if found.endswith('.zst'):
+        need_zstandard()
+        stream = zstandard.ZstdDecompressor().stream_reader(open(found, 'rb'), closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8') if ('t' in mode) else stream
+
+    return open(found, mode)
+
+# Function to read a daily CSV file, compressed or not, into a data frame
+# path, path of the plain file
+# kwargs, passed on to pandas.read_csv
+def read_csv(path, **kwargs):
+
+    import pandas
+    with open_day(path, 'rb') as fn:
+        return pandas.read_csv(fn, **kwargs)
+
+# Function to make sure zstandard is available
+def need_zstandard():
+
+    if zstandard is None:
+        raise ImportError('zstd compression needs the zstandard package (pip install zstandard)')
+
+# Function to compute the SHA-256 digest of a stream
+# fn, open binary file
+def digest(fn):
+
+    sha = hashlib.sha256()
+    for block in iter(lambda: fn.read(1 << 20), b''):
+        sha.update(block)
+
+    return sha.hexdigest()
+
+# Function to compress one closed daily file
+# path, plain daily file
+# method, level, compression and its level
+# Returns the compressed path
+def compress_file(path, method=method, level=level):
+
+    out = path+SUFFIXES[method]
+    tmp = os.path.join(os.path.dirname(out), '.'+os.path.basename(out)+'.tmp') # Hidden from glob_days
+    sha = hashlib.sha256()
+
+    # Compress while hashing the original
+    try:
+        with open(path, 'rb') as src:
+            if (method == 'gzip'):
+                dst = gzip.open(tmp, 'wb', compresslevel=level)
+            else:
+                need_zstandard()
+                dst = zstandard.ZstdCompressor(level=level, write_checksum=True).stream_writer(open(tmp, 'wb'), closefd=True)
+            with dst:
+                for block in iter(lambda: src.read(1 << 20), b''):
+                    sha.update(block)
+                    dst.write(block)
+        with open(tmp, 'rb') as fn:
+            os.fsync(fn.fileno())
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    # Check the compressed copy before the original goes
+    os.replace(tmp, out)
+    with open_day(out, 'rb') as fn:
+        if (digest(fn) != sha.hexdigest()):
+            os.remove(out)
+            raise IOError(f'{out} does not decompress to {path}')
+
+    stat = os.stat(path)
+    os.utime(out, (stat.st_atime, stat.st_mtime))
+    with open(path+'.sha256', 'w') as fn:
+        fn.write(f'{sha.hexdigest()}  {os.path.basename(path)}\n')
+    os.remove(path)
+
+    return out
+
+# Function to compress every closed day
+# method, level, compression and its level
+# keep, number of recent days left uncompressed
+def compress_all(method=method, level=level, keep=keep_days):
+
+    last = (datetime.now(ZoneInfo(TIMEZONE))-timedelta(days=keep)).strftime('%Y%m%d')
+    dirs = {'data_dir': data_dir, 'qc_dir': qc_dir}
+    for key, name in PATTERNS:
+        for path in sorted(glob(f'{dirs[key]}/*/{name}')):
+            day = DAY.search(os.path.basename(path))
+            if (day is None) or (day.group(1) > last):
+                continue
+            try:
+                before = os.path.getsize(path)
+                out = compress_file(path, method, level)
+                print(f'{out}: {before/max(1, os.path.getsize(out)):.1f}x', flush=True)
+            except (OSError, ImportError) as err:
+                print('WARNING could not compress', path, err, flush=True)
+
+# Function to check compressed files against their digests
+# Returns the number of files that do not match
+def verify_all():
+
+    nbad = 0
+    dirs = {'data_dir': data_dir, 'qc_dir': qc_dir}
+    for key, name in PATTERNS:
+        for path in glob_days(f'{dirs[key]}/*/{name}'):
+            if (path == plain(path)) or not os.path.exists(plain(path)+'.sha256'):
+                continue
+            with open(plain(path)+'.sha256', 'r') as fn:
+                expected = fn.read().split()[0]
+            try:
+                with open_day(path, 'rb') as fn:
+                    ok = (digest(fn) == expected)
+            except (OSError, EOFError, ImportError):
+                ok = False
+            if not ok:
+                nbad += 1
+                print('WARNING checksum mismatch', path, flush=True)
+
+    return nbad
+
+if __name__ == '__main__':
+
+    if (len(sys.argv) > 1) and (sys.argv[1] == 'verify'):
+        sys.exit(1 if verify_all() else 0)
+
+    compress_all()
@@ -0,0 +1,89 @@
+### Compact binary daily store for the rapid met tower data.
+### Each file is a 16 byte header followed by fixed 40 byte records:
+###   time (int64, epoch seconds UTC) then temp, rh, pres, rain_rate,
+###   day_rain, wspd, wdir, swdown (float32, same units as the CSV files).
+### Files sit next to the CSV files with a .bin extension and are read back
+### as a NumPy structured array through np.memmap, so loading a day needs no
+### parsing and no copy.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+import os
+import struct
+import numpy as np
+
+# Record layout
+DTYPE = np.dtype([('time', '<i8'), ('temp', '<f4'), ('rh', '<f4'), ('pres', '<f4'), ('rain_rate', '<f4'),
+                  ('day_rain', '<f4'), ('wspd', '<f4'), ('wdir', '<f4'), ('swdown', '<f4')])
+RECORD = struct.Struct('<q8f')
+
+# Header: magic, version, header size, record size, number of fields, padding
+MAGIC = b'VMTB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHH4x')
+HEADER_BYTES = HEADER.pack(MAGIC, VERSION, HEADER.size, RECORD.size, len(DTYPE.names))
+
+### Helper functions
+
+# Function to open a binary file for appending
+# path, file to open (created with a header if missing)
+# dtype, magic, record layout and magic of the file (other stores, e.g. tower_rollup.py, reuse the format)
+# Returns the open file, positioned after the last complete record
+def open_for_append(path, dtype=DTYPE, magic=MAGIC):
+
+    new_file = (not os.path.exists(path)) or (os.path.getsize(path) < HEADER.size)
+    fn = open(path, 'wb' if new_file else 'r+b')
+    if new_file:
+        fn.write(HEADER.pack(magic, VERSION, HEADER.size, dtype.itemsize, len(dtype.names)))
+    else:
+        check_header(fn.read(HEADER.size), path, dtype, magic)
+
+        # Drop a partial record left by a crash mid-write
+        size = fn.seek(0, os.SEEK_END)
+        fn.truncate(size-(size-HEADER.size) % dtype.itemsize)
+        fn.seek(0, os.SEEK_END)
+
+    return fn
+
+# Function to check a file header
+# header, the header bytes
+# path, file name for the error message
+# dtype, magic, expected record layout and magic
+def check_header(header, path, dtype=DTYPE, magic=MAGIC):
+
+    file_magic, version, header_size, record_size, nfields = HEADER.unpack(header)
+    if (file_magic != magic) or (version != VERSION) or (record_size != dtype.itemsize):
+        raise ValueError(f'{path} is not a version {VERSION} {magic.decode()} binary file')
+
+# Function to pack one record
+# epoch, observation time (epoch seconds UTC)
+# values, the eight observed values in DTYPE order
+def pack(epoch, values):
+
+    return RECORD.pack(int(epoch), *values)
+
+# Function to load a day as a read-only memory-mapped structured array
+# path, binary file to load
+# dtype, magic, record layout and magic of the file
+def load_day(path, dtype=DTYPE, magic=MAGIC):
+
+    with open(path, 'rb') as fn:
+        check_header(fn.read(HEADER.size), path, dtype, magic)
+    nrec = (os.path.getsize(path)-HEADER.size)//dtype.itemsize
+    if (nrec == 0):
+        return np.empty(0, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER.size, shape=(nrec,))
+
+# Function to select the records in a time range
+# data, structured array from load_day
+# start, first time to keep (epoch seconds UTC), None for the beginning
+# end, time to stop before (epoch seconds UTC), None for the end
+def time_slice(data, start=None, end=None):
+
+    i0 = 0 if start is None else np.searchsorted(data['time'], start, side='left')
+    i1 = data.size if end is None else np.searchsorted(data['time'], end, side='left')
+
+    return data[i0:i1]
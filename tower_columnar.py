@@ -0,0 +1,209 @@
+### Columnar archive of the rapid and QC'd met tower data.
+### Closed days are converted from the CSV files into typed columnar files
+### (Parquet by default, or Feather), partitioned by year and month:
+###   {cdir}/{kind}/year=YYYY/month=MM/YYYYMMDD.parquet
+### kind is 'rapid' (rapid_ValpoMetTower_*.csv) or 'qc' (QCd_data/rapid_qc_*.csv).
+### Times are UTC timestamps, values are float32 with the -999 missing marker
+### stored as null, and QC flags are int8. read() only opens the partitions
+### in range and only the requested columns, and Parquet row group statistics
+### let the time filter skip data within a file.
+###
+### Requires pyarrow (optional, only for this module).
+###
+### Convert every closed day not converted yet with "python tower_columnar.py"
+### or a range of days with "python tower_columnar.py YYYYMMDD YYYYMMDD"
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Location of the rapid data files (annual folders)
+data_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower'
+
+# Location of the QC'd files (annual folders)
+qc_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower/QCd_data'
+
+# Location of the columnar archive
+columnar_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower/columnar'
+
+# File format, 'parquet' or 'feather'
+file_format = 'parquet'
+
+#####  END OPTIONS  #####
+
+### Import libraries
+from datetime import datetime, timezone
+from glob import glob
+from zoneinfo import ZoneInfo
+import os
+import sys
+import numpy as np
+import pandas
+from time_axis import TIMEZONE, TOWER_UTC_OFFSET, parse_stamps
+import tower_archive
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Missing value marker used by the tower
+MISSING = -999.0
+
+# Data columns of each kind: CSV column, archive column
+VALUES = {
+    'rapid': (('Temp (C)', 'temp'), ('RH (%)', 'rh'), ('Pres (mb)', 'pres'), ('Rain Rate (mm/hr)', 'rain_rate'),
+              ('Daily Total Rain (mm)', 'day_rain'), ('Wspd (m/s)', 'wspd'), ('Wdir (deg)', 'wdir'), ('SWdown (W/m2)', 'swdown')),
+    'qc': (('Temp (C)', 'temp'), ('RH (%)', 'rh'), ('Pres (mb)', 'pres'), ('Daily Total Rain (mm)', 'day_rain'),
+           ('Wspd (m/s)', 'wspd'), ('Wdir (deg)', 'wdir'), ('SWdown (W/m2)', 'swdown'))
+}
+FLAGS = {'rapid': (), 'qc': (('Temp QC', 'temp_qc'), ('RH QC', 'rh_qc'), ('Pres QC', 'pres_qc'), ('Rain QC', 'day_rain_qc'),
+                             ('Wspd QC', 'wspd_qc'), ('Wdir QC', 'wdir_qc'), ('SWdown QC', 'swdown_qc'))}
+
+# Older files name the daily rain column differently
+ALIASES = {'Daily Total Rain (mm)': 'Rain (mm)'}
+
+# CSV file of one day
+PATTERNS = {'rapid': '{data_dir}/{year}/rapid_ValpoMetTower_{day}.csv', 'qc': '{qc_dir}/{year}/rapid_qc_ValpoMetTower_{day}.csv'}
+
+### Helper functions
+
+# Function to make sure pyarrow is available
+def need_pyarrow():
+
+    if pa is None:
+        raise ImportError('The columnar archive needs pyarrow (pip install pyarrow)')
+
+# Function to get the table schema of a kind
+# kind, 'rapid' or 'qc'
+def schema(kind):
+
+    need_pyarrow()
+    fields = [pa.field('time', pa.timestamp('s', tz='UTC'))]
+    fields += [pa.field(name, pa.float32()) for _, name in VALUES[kind]]
+    fields += [pa.field(name, pa.int8()) for _, name in FLAGS[kind]]
+
+    return pa.schema(fields)
+
+# Function to get the CSV file of a day (the plain name, see tower_archive.py for compressed days)
+# kind, 'rapid' or 'qc'
+# day, date of the daily file
+def csv_path(kind, day):
+
+    return PATTERNS[kind].format(data_dir=data_dir, qc_dir=qc_dir, year=day.year, day=day.strftime('%Y%m%d'))
+
+# Function to get the columnar file of a day
+# kind, 'rapid' or 'qc'
+# day, date of the daily file
+# cdir, columnar archive directory, None for columnar_dir
+# fmt, 'parquet' or 'feather', None for file_format
+def columnar_path(kind, day, cdir=None, fmt=None):
+
+    cdir = columnar_dir if cdir is None else cdir
+    fmt = file_format if fmt is None else fmt
+
+    return f'{cdir}/{kind}/year={day.year}/month={day.month:02d}/{day.strftime("%Y%m%d")}.{fmt}'
+
+# Function to convert one day
+# kind, 'rapid' or 'qc'
+# day, date of the daily file
+# cdir, fmt, columnar archive directory and format, None for the options
+# Returns the number of rows written
+def convert_day(kind, day, cdir=None, fmt=None):
+
+    frame = tower_archive.read_csv(csv_path(kind, day))
+
+    columns = {'time': pa.array(parse_stamps(frame['Server Date (UTC)'].values), type=pa.timestamp('s', tz='UTC'))}
+    for column, name in VALUES[kind]:
+        column = column if (column in frame.columns) else ALIASES.get(column, column)
+        if (column in frame.columns):
+            values = pandas.to_numeric(frame[column], errors='coerce').values.astype('float32')
+        else:
+            values = np.full(len(frame), np.nan, dtype='float32') # Column not in older files
+        columns[name] = pa.array(values, mask=~np.isfinite(values) | (values == MISSING), type=pa.float32())
+    for column, name in FLAGS[kind]:
+        columns[name] = pa.array(pandas.to_numeric(frame[column], errors='coerce').fillna(0).values.astype('int8'), type=pa.int8())
+    table = pa.table(columns, schema=schema(kind)).sort_by('time')
+
+    # Write to a temporary file first so readers never see half a file
+    path = columnar_path(kind, day, cdir, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = os.path.join(os.path.dirname(path), '.'+os.path.basename(path)+'.tmp') # Hidden from read()
+    if (path.endswith('.parquet')):
+        pq.write_table(table, tmp, compression='zstd', row_group_size=3600)
+    else:
+        feather.write_feather(table, tmp, compression='zstd')
+    os.replace(tmp, path)
+
+    return table.num_rows
+
+# Function to convert every closed day that is missing or out of date
+# kind, 'rapid' or 'qc'
+# first, last, range of days to consider (dates, inclusive), None for no limit
+# cdir, fmt, columnar archive directory and format, None for the options
+def convert_all(kind, first=None, last=None, cdir=None, fmt=None):
+
+    need_pyarrow()
+
+    # Today's file is still growing
+    today = datetime.now(ZoneInfo(TIMEZONE)).date()
+    pattern = csv_path(kind, datetime(1900, 1, 1)).replace('19000101', '*').replace('1900', '*')
+    for path in tower_archive.glob_days(pattern):
+        day = datetime.strptime(os.path.basename(tower_archive.plain(path))[-12:-4], '%Y%m%d').date()
+        if (day >= today) or ((first is not None) and (day < first)) or ((last is not None) and (day > last)):
+            continue
+
+        out = columnar_path(kind, day, cdir, fmt)
+        if os.path.exists(out) and (os.path.getmtime(out) >= os.path.getmtime(path)):
+            continue
+        try:
+            print(f'{out}: {convert_day(kind, day, cdir, fmt)} rows', flush=True)
+        except (KeyError, ValueError) as err:
+            print('WARNING could not convert', path, err, flush=True)
+
+# Function to read a time range from the columnar archive
+# start, end, the range (epoch seconds UTC, end exclusive)
+# columns, archive columns to read (e.g. ['temp', 'temp_qc']), None for all
+# kind, 'rapid' or 'qc'
+# cdir, fmt, columnar archive directory and format, None for the options
+# Returns a pandas DataFrame with a 'time' column
+def read(start, end, columns=None, kind='rapid', cdir=None, fmt=None):
+
+    need_pyarrow()
+    cdir = columnar_dir if cdir is None else cdir
+    fmt = file_format if fmt is None else fmt
+    root = f'{cdir}/{kind}'
+
+    # Partitions are tower clock months, so whole months outside the range are never opened
+    first = datetime.fromtimestamp(start+TOWER_UTC_OFFSET, timezone.utc)
+    last = datetime.fromtimestamp(end-1+TOWER_UTC_OFFSET, timezone.utc)
+    files = []
+    for path in sorted(glob(f'{root}/year=*/month=*/*.{fmt}')):
+        year, month = (int(part.split('=')[1]) for part in path[len(root)+1:].split('/')[:2])
+        if ((first.year, first.month) <= (year, month) <= (last.year, last.month)):
+            files.append(path)
+    if (len(files) == 0):
+        return schema(kind).empty_table().to_pandas()
+
+    # Only the requested columns are read, and row groups outside the time range are skipped
+    where = ((ds.field('time') >= pa.scalar(start, pa.timestamp('s', tz='UTC'))) &
+             (ds.field('time') < pa.scalar(end, pa.timestamp('s', tz='UTC'))))
+    dataset = ds.dataset(files, schema=schema(kind), format='ipc' if (fmt == 'feather') else fmt)
+    columns = ['time']+[name for name in (columns or schema(kind).names[1:]) if (name != 'time')]
+
+    return dataset.to_table(columns=columns, filter=where).sort_by('time').to_pandas()
+
+if __name__ == '__main__':
+
+    need_pyarrow()
+    first = last = None
+    if (len(sys.argv) == 3):
+        first = datetime.strptime(sys.argv[1], '%Y%m%d').date()
+        last = datetime.strptime(sys.argv[2], '%Y%m%d').date()
+
+    for kind in ('rapid', 'qc'):
+        convert_all(kind, first, last)
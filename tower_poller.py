@@ -0,0 +1,163 @@
+### Asynchronous poller for the met tower's status page.
+### Reuses one persistent HTTP/1.1 connection between polls and schedules
+### polls against the event loop's monotonic clock, so a slow response
+### delays only that poll and does not shift every poll after it.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+import asyncio
+from datetime import datetime
+from urllib.parse import urlsplit
+from tower_metrics import METRICS
+
+### Poller holding a keep-alive connection to one URL
+class TowerPoller:
+
+    # url, page to poll (http only)
+    # timeout, seconds allowed for one complete request
+    def __init__(self, url, timeout=0.8):
+
+        parts = urlsplit(url)
+        if (parts.scheme != 'http'):
+            raise ValueError(f'Unsupported URL scheme: {url}')
+
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?'+parts.query
+        self.timeout = timeout
+
+        self.reader = None
+        self.writer = None
+
+        # Request is the same every poll, so build it once
+        self.request = (f'GET {self.path} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+                        'Connection: keep-alive\r\nAccept: */*\r\n\r\n').encode('ascii')
+
+    # Function to open the connection if it is not already open
+    async def _connect(self):
+
+        if (self.writer is None) or self.writer.is_closing():
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    # Function to read one HTTP response from the open connection
+    # Returns the body and whether the connection may be reused
+    async def _read_response(self):
+
+        status = (await self.reader.readline()).decode('latin-1').split()
+        if (len(status) < 2):
+            raise ConnectionError('Connection closed by the tower')
+        if (status[1] != '200'):
+            raise ConnectionError(f'Tower returned HTTP {status[1]}')
+
+        # Headers
+        headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').strip()
+            if (line == ''):
+                break
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip().lower()
+
+        keep_alive = (headers.get('connection') != 'close') and (status[0] != 'HTTP/1.0' or headers.get('connection') == 'keep-alive')
+
+        # Body
+        if (headers.get('transfer-encoding') == 'chunked'):
+            body = b''
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if (size == 0):
+                    await self.reader.readline()
+                    break
+                body += await self.reader.readexactly(size)
+                await self.reader.readline()
+        elif ('content-length' in headers):
+            body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self.reader.read()
+            keep_alive = False
+
+        return body, keep_alive
+
+    # Function to fetch the page once
+    # Any failure drops the connection so the next fetch starts clean
+    async def fetch(self):
+
+        try:
+            body, keep_alive = await asyncio.wait_for(self._fetch(), self.timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+        if not keep_alive:
+            await self.close()
+
+        return body
+
+    async def _fetch(self):
+
+        await self._connect()
+        self.writer.write(self.request)
+        await self.writer.drain()
+
+        return await self._read_response()
+
+    # Function to close the connection
+    async def close(self):
+
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (OSError, asyncio.CancelledError):
+                pass
+            self.writer = None
+            self.reader = None
+
+# Function to poll at a fixed cadence
+# poller, TowerPoller to fetch with
+# handle, called as handle(server_time, payload) for every successful fetch
+# interval, seconds between polls
+# max_backoff, longest delay (seconds) between retries while the tower is down
+# label, name printed with warnings (e.g. the station), None for none
+async def poll_forever(poller, handle, interval=1.0, max_backoff=30.0, label=None):
+
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    backoff = 0.0
+
+    while True:
+
+        tick = loop.time()
+        METRICS.observe('lag_seconds', max(0.0, tick-next_tick))
+        METRICS.inc('polls')
+        server_time = datetime.utcnow()
+        try:
+            with METRICS.span('fetch'):
+                payload = await poller.fetch()
+
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as err:
+            # Back off exponentially, then resume on a fresh schedule
+            METRICS.inc('fetch_errors')
+            backoff = min(max(interval, backoff*2.0), max_backoff)
+            print('WARNING', *([label] if label else []), type(err).__name__, err, f'(retrying in {backoff:.0f} s)', flush=True)
+            await asyncio.sleep(backoff)
+            next_tick = loop.time()
+            continue
+
+        backoff = 0.0
+        handle(server_time, payload)
+
+        # Schedule against the monotonic clock, skipping any slots already missed
+        next_tick += interval
+        now = loop.time()
+        METRICS.observe('tick_seconds', now-tick)
+        if (next_tick <= now):
+            missed = (now-next_tick)//interval+1
+            METRICS.inc('missed_slots', int(missed))
+            next_tick += missed*interval
+
+        await asyncio.sleep(next_tick-now)
@@ -0,0 +1,177 @@
+### Time range queries over the rapid met tower archive.
+### query(start, end, variables, resolution) returns only the requested
+### variables between two times, either as the secondly observations (one
+### daily file per tower day in range, memory mapped from the binary store or
+### read column by column from the CSV file) or as one of the rollup levels
+### from tower_rollup.py. Rollup buckets in the range that are not stored (the
+### current hour or day, days before the rollups were started, or holes left by
+### an outage) are computed from the secondly data.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+from datetime import datetime, timedelta, timezone
+import os
+import numpy as np
+import tower_archive
+import tower_binary
+import tower_rollup
+from time_axis import TOWER_UTC_OFFSET, parse_stamps
+
+# Default data locations
+DATA_DIR = tower_rollup.data_dir
+ROLLUP_DIR = tower_rollup.rollup_dir
+
+# Data column of each binary record field
+COLUMNS = dict(zip(tower_binary.DTYPE.names[1:], ('Temp (C)', 'RH (%)', 'Pres (mb)', 'Rain Rate (mm/hr)',
+                                                    'Daily Total Rain (mm)', 'Wspd (m/s)', 'Wdir (deg)', 'SWdown (W/m2)')))
+
+### Helper functions
+
+# Function to list the tower days (daily files) covering a time range
+# start, end, the range (epoch seconds UTC)
+def tower_days(start, end):
+
+    day = datetime.fromtimestamp(start+TOWER_UTC_OFFSET, timezone.utc).date()
+    last = datetime.fromtimestamp(end-1+TOWER_UTC_OFFSET, timezone.utc).date()
+    days = []
+    while (day <= last):
+        days.append(day)
+        day += timedelta(days=1)
+
+    return days
+
+# Function to read some variables of one daily file
+# sdir, root directory for the data
+# day, date of the daily file
+# variables, tower_binary field names
+# start, end, the time range (epoch seconds UTC)
+# Returns the times and a list of arrays (None if there is no file)
+def read_day(sdir, day, variables, start, end):
+
+    path = f'{sdir}/{day.year}/rapid_ValpoMetTower_{day.strftime("%Y%m%d")}'
+
+    # The binary store is memory mapped, so only the selected columns and rows are read
+    if os.path.exists(path+'.bin'):
+        data = tower_binary.time_slice(tower_binary.load_day(path+'.bin'), start, end)
+        return np.array(data['time']), [np.array(data[var], dtype='float') for var in variables]
+
+    if tower_archive.find(path+'.csv') is None:
+        return None
+
+    frame = tower_archive.read_csv(path+'.csv', usecols=['Server Date (UTC)']+[COLUMNS[var] for var in variables])
+    times = parse_stamps(frame['Server Date (UTC)'].values)
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    i0, i1 = np.searchsorted(times, (start, end), side='left')
+
+    return times[i0:i1], [frame[COLUMNS[var]].values[order][i0:i1].astype('float') for var in variables]
+
+# Function to map requested names onto rollup fields
+# variables, names such as 'temp' (the mean), 'temp_max' or 'wdir' (the vector average)
+def rollup_fields(variables):
+
+    fields = []
+    for var in variables:
+        if var in tower_rollup.DTYPE.names:
+            fields.append(var)
+        elif (var == 'wdir'):
+            fields.append('wdir_vec')
+        elif f'{var}_mean' in tower_rollup.DTYPE.names:
+            fields.append(f'{var}_mean')
+        else:
+            raise ValueError(f'Unknown rollup variable {var}')
+
+    return fields
+
+# Function to pick a resolution for a span
+# start, end, the span (epoch seconds UTC)
+# npoints, fewest points wanted across the span
+# Returns 'raw' or a rollup level
+def auto_resolution(start, end, npoints=1000):
+
+    if ((end-start)/tower_rollup.LEVELS['1min'] < npoints):
+        return 'raw'
+
+    return tower_rollup.best_level(start, end, npoints)
+
+# Function to query the archive over a time range
+# start, end, the range (epoch seconds UTC, end exclusive)
+# variables, names to return (tower_binary fields for 'raw'; rollup fields or bare names for a rollup level), None for all
+# resolution, 'raw', a tower_rollup level ('1min', '10min', '1h', '1day') or 'auto'
+# npoints, fewest points wanted across the span when resolution is 'auto'
+# sdir, rdir, data and rollup directories
+# Returns a dictionary with 'time' (epoch seconds UTC, or bucket starts) and one array per variable
+def query(start, end, variables=None, resolution='auto', npoints=1000, sdir=DATA_DIR, rdir=ROLLUP_DIR):
+
+    start = int(start)
+    end = int(end)
+    if (resolution == 'auto'):
+        resolution = auto_resolution(start, end, npoints)
+
+    # Secondly observations, one daily file at a time
+    if (resolution == 'raw'):
+        variables = list(tower_binary.DTYPE.names[1:] if variables is None else variables)
+        times = []
+        columns = [[] for var in variables]
+        for day in tower_days(start, end):
+            found = read_day(sdir, day, variables, start, end)
+            if found is None:
+                continue
+            times.append(found[0])
+            for column, values in zip(columns, found[1]):
+                column.append(values)
+
+        result = {'time': np.concatenate(times) if times else np.empty(0, dtype='int64')}
+        for var, column in zip(variables, columns):
+            result[var] = np.concatenate(column) if column else np.empty(0)
+        return result
+
+    if resolution not in tower_rollup.LEVELS:
+        raise ValueError(f'Unknown resolution {resolution}')
+
+    # Stored rollups, then every bucket in range that is not stored (not finished yet, before the
+    # rollups were started or lost to an outage) from the secondly data, one run of buckets at a time
+    names = list(tower_rollup.DTYPE.names[1:] if variables is None else variables)
+    fields = rollup_fields(names)
+    width = tower_rollup.LEVELS[resolution]
+    stored = tower_rollup.load_level(rdir, resolution, start, end)
+    first = int(tower_rollup.bucket_start(start, width))
+    first += width if (first < start) else 0 # Stored buckets start inside the range
+    missing = np.setdiff1d(np.arange(first, end, width, dtype='int64'), stored['time'])
+    if (missing.size > 0):
+        chunks = [stored]
+        for run in np.split(missing, np.flatnonzero(np.diff(missing) > width)+1):
+            raw = query(int(run[0]), min(int(run[-1])+width, end), None, 'raw', sdir=sdir)
+            data = np.zeros(raw['time'].size, dtype=tower_binary.DTYPE)
+            for name in tower_binary.DTYPE.names:
+                data[name] = raw[name]
+            chunks.append(tower_rollup.aggregate(data, resolution))
+        stored = np.concatenate(chunks)
+        stored = stored[np.argsort(stored['time'], kind='stable')]
+
+    result = {'time': np.array(stored['time'])}
+    for name, field in zip(names, fields):
+        result[name] = np.array(stored[field], dtype='float')
+
+    return result
+
+# Function to place query results on a regular time grid
+# result, dictionary from query
+# start, end, the range (epoch seconds UTC)
+# step, grid spacing (s), e.g. the rollup width
+# Returns the grid times and a dictionary of arrays with NaN where there was no data (so gaps break plotted lines)
+def on_grid(result, start, end, step):
+
+    grid = np.arange(start, end, step, dtype='int64')
+    index = (result['time']-start)//step
+    keep = (index >= 0) & (index < grid.size)
+    out = {}
+    for key, values in result.items():
+        if (key == 'time'):
+            continue
+        out[key] = np.full(grid.size, np.nan)
+        out[key][index[keep]] = values[keep]
+
+    return grid, out
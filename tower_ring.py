@@ -0,0 +1,220 @@
+### Shared memory ring buffer of the recent rapid met tower observations.
+### The feed (rapid_retrieve_data.py) publishes every saved observation into
+### a multiprocessing.shared_memory block holding the last few hours of
+### records in the tower_binary.py layout. Other scripts on the same machine
+### attach with RingReader and copy out a consistent snapshot without
+### touching the disk or parsing any CSV.
+###
+### Layout: a 64 byte header of int64 values (magic, version, capacity,
+### sequence, count, since) followed by capacity records. The sequence is a
+### seqlock: the writer makes it odd while a record is being written and even
+### again afterwards, and a reader retries whenever it changed under it.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+from datetime import datetime, timedelta, timezone
+from multiprocessing import resource_tracker, shared_memory
+import os
+import time
+import numpy as np
+import tower_binary
+from time_axis import TOWER_UTC_OFFSET
+
+# Default name of the shared memory block
+NAME = 'ValpoMetTower_ring'
+
+# Header layout (int64 slots)
+MAGIC = 0x564d5452 # 'VMTR'
+VERSION = 1
+HEADER_SLOTS = 8
+I_MAGIC, I_VERSION, I_CAPACITY, I_SEQ, I_COUNT, I_SINCE = range(6)
+HEADER_SIZE = HEADER_SLOTS*8
+
+### Helper functions
+
+# Function to map the header and records onto a shared memory block
+# shm, the SharedMemory block
+# capacity, number of records
+def _views(shm, capacity):
+
+    header = np.ndarray((HEADER_SLOTS,), dtype='<i8', buffer=shm.buf)
+    records = np.ndarray((capacity,), dtype=tower_binary.DTYPE, buffer=shm.buf, offset=HEADER_SIZE)
+
+    return header, records
+
+# Function to load the most recent records from the binary daily store
+# sdir, root directory for the data (annual folders)
+# start, first time to keep (epoch seconds UTC)
+# prefix, file name prefix
+# Returns a structured array in time order
+def load_recent(sdir, start, prefix='rapid_ValpoMetTower'):
+
+    # Daily files follow the tower clock, so walk the tower days from start to now
+    first = datetime.fromtimestamp(start+TOWER_UTC_OFFSET, timezone.utc).date()
+    last = datetime.fromtimestamp(time.time()+TOWER_UTC_OFFSET, timezone.utc).date()
+    chunks = []
+    day = first
+    while (day <= last):
+        path = f'{sdir}/{day.year}/{prefix}_{day.strftime("%Y%m%d")}.bin'
+        if os.path.exists(path):
+            try:
+                chunks.append(np.array(tower_binary.time_slice(tower_binary.load_day(path), start)))
+            except ValueError as err:
+                print('WARNING', err)
+        day += timedelta(days=1)
+
+    if (len(chunks) == 0):
+        return np.empty(0, dtype=tower_binary.DTYPE)
+
+    return np.concatenate(chunks)
+
+### The writer (one per machine, owned by the feed)
+class RingWriter:
+
+    # hours, hours of secondly observations to keep
+    # name, shared memory name
+    def __init__(self, hours=48, name=NAME):
+
+        self.capacity = int(hours*3600)
+        self.name = name
+
+        # A block left behind by a killed feed is replaced
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE+self.capacity*tower_binary.DTYPE.itemsize)
+        self.header, self.records = _views(self.shm, self.capacity)
+        self.header[:] = 0
+        self.header[I_MAGIC] = MAGIC
+        self.header[I_VERSION] = VERSION
+        self.header[I_CAPACITY] = self.capacity
+        self.header[I_SINCE] = int(time.time())
+
+    # Function to fill the ring from the binary daily store
+    # sdir, root directory for the data
+    # Returns the number of records loaded
+    def backfill(self, sdir):
+
+        data = load_recent(sdir, int(time.time())-self.capacity)[-self.capacity:]
+
+        # Complete only from the first record the store had (from now if it had none)
+        since = int(data['time'][0]) if (data.size > 0) else int(time.time())
+
+        self.header[I_SEQ] += 1
+        self.records[:data.size] = data
+        self.header[I_COUNT] = data.size
+        self.header[I_SINCE] = since
+        self.header[I_SEQ] += 1
+
+        return data.size
+
+    # Function to publish one observation
+    # epoch, observation time (epoch seconds UTC)
+    # values, the eight observed values in tower_binary.DTYPE order
+    def append(self, epoch, values):
+
+        count = int(self.header[I_COUNT])
+        self.header[I_SEQ] += 1
+        self.records[count % self.capacity] = (epoch, *values)
+        self.header[I_COUNT] = count+1
+        self.header[I_SEQ] += 1
+
+    # Function to remove the shared memory block
+    def close(self):
+
+        if self.shm is not None:
+            del self.header, self.records
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+### The reader (any number of processes)
+class RingReader:
+
+    # name, shared memory name
+    # Raises FileNotFoundError if the feed is not publishing
+    def __init__(self, name=NAME):
+
+        self.shm = shared_memory.SharedMemory(name=name)
+
+        # Readers must not remove the block when they exit (the tracker would unlink it)
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+        header = np.ndarray((HEADER_SLOTS,), dtype='<i8', buffer=self.shm.buf)
+        if (header[I_MAGIC] != MAGIC) or (header[I_VERSION] != VERSION):
+            self.shm.close()
+            raise ValueError(f'{name} is not a version {VERSION} tower ring buffer')
+        self.capacity = int(header[I_CAPACITY])
+        self.header, self.records = _views(self.shm, self.capacity)
+
+    # Function to copy out a consistent snapshot
+    # start, first time to keep (epoch seconds UTC), None for the oldest record
+    # end, time to stop before (epoch seconds UTC), None for the newest record
+    # retries, attempts before giving up on a busy writer
+    # Returns a structured array in time order and the time from which the snapshot is complete
+    def snapshot(self, start=None, end=None, retries=100):
+
+        for attempt in range(retries):
+            seq = int(self.header[I_SEQ])
+            if (seq % 2 == 1):
+                time.sleep(0.0005)
+                continue
+
+            count = int(self.header[I_COUNT])
+            since = int(self.header[I_SINCE])
+            if (count <= self.capacity):
+                data = self.records[:count].copy()
+            else:
+                data = np.roll(self.records, -(count % self.capacity))
+            if (int(self.header[I_SEQ]) == seq):
+                break
+        else:
+            raise RuntimeError('ring buffer snapshot kept changing')
+
+        # Once the ring has wrapped, it is complete only from its oldest record
+        if (count > self.capacity):
+            since = max(since, int(data['time'][0]))
+
+        return tower_binary.time_slice(data, start, end), since
+
+    # Function to read a window only if the ring holds all of it
+    # start, first time needed (epoch seconds UTC)
+    # end, time to stop before (epoch seconds UTC), None for the newest record
+    # Returns the snapshot from start, or None if the ring cannot provide it
+    def window(self, start, end=None):
+
+        data, since = self.snapshot(start, end)
+        if (since > start):
+            return None
+
+        return data
+
+    # Function to detach from the shared memory block
+    def close(self):
+
+        if self.shm is not None:
+            del self.header, self.records
+            self.shm.close()
+            self.shm = None
+
+# Function to read a time window from the ring if the feed is publishing
+# start, first time needed (epoch seconds UTC)
+# end, time to stop before (epoch seconds UTC), None for the newest record
+# name, shared memory name
+# Returns the records, or None if the ring is missing or does not cover the window
+def read_window(start, end=None, name=NAME):
+
+    try:
+        reader = RingReader(name)
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        return reader.window(start, end)
+    finally:
+        reader.close()
@@ -0,0 +1,355 @@
+### Multi-resolution rollups of the rapid met tower data.
+### Keeps the mean, minimum, maximum and last value of every variable, plus the
+### vector averaged wind, over 1 minute, 10 minute, hourly and daily buckets.
+### The feed folds every observation in as it arrives (Rollup.add) and appends
+### each bucket to its level's store once the bucket is complete, so plots
+### and pages covering long spans can read a coarse level instead of the
+### secondly files.
+###
+### Stores use the tower_binary.py file format with their own record layout:
+###   {rdir}/{level}/ValpoMetTower_{level}_YYYY.bin
+### Buckets are aligned to the tower clock (UTC-5) so daily buckets match the
+### daily files. Buckets still open when the feed stops (also across midnight)
+### are rebuilt from the binary daily store when it starts again, going back at
+### most restore_days days.
+###
+### Rebuild the rollups of past years from the archive with
+###   python tower_rollup.py YEAR [YEAR ...]
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Root directory containing data
+data_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower'
+
+# Directory for the rollup stores
+rollup_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower/rollups'
+
+# Most days replayed from the daily store when the feed starts (older buckets are left to tower_query.py or a rebuild)
+restore_days = 3
+
+#####  END OPTIONS  #####
+
+### Import libraries
+from datetime import date, datetime, timedelta, timezone
+import os
+import sys
+import time
+import numpy as np
+import tower_binary
+from time_axis import TOWER_UTC_OFFSET
+
+# Bucket width (s) of each level, finest first
+LEVELS = {'1min': 60, '10min': 600, '1h': 3600, '1day': 86400}
+
+# Scalar variables (tower_binary fields) and the statistics kept for each
+VARS = ('temp', 'rh', 'pres', 'rain_rate', 'day_rain', 'wspd', 'swdown')
+STATS = ('mean', 'min', 'max', 'last')
+
+# Rollup record: bucket start (epoch seconds UTC), number of observations,
+# the scalar statistics, the vector averaged wind speed and direction, and the last direction
+DTYPE = np.dtype([('time', '<i8'), ('count', '<i4')]+[(f'{var}_{stat}', '<f4') for var in VARS for stat in STATS]+
+                 [('wspd_vec', '<f4'), ('wdir_vec', '<f4'), ('wdir_last', '<f4')])
+MAGIC = b'VMTR'
+
+# Missing value marker used by the tower
+MISSING = -999.0
+
+### Helper functions
+
+# Function to find the bucket each time falls in
+# epoch, epoch seconds UTC
+# width, bucket width (s)
+# Returns the bucket start times (epoch seconds UTC)
+def bucket_start(epoch, width):
+
+    epoch = np.asarray(epoch, dtype='int64')
+
+    return ((epoch+TOWER_UTC_OFFSET)//width)*width-TOWER_UTC_OFFSET
+
+# Function to reduce observations to partial bucket sums
+# data, tower_binary structured array in time order
+# width, bucket width (s)
+# Returns a dictionary of arrays with one row per bucket present in the data
+def partials(data, width):
+
+    starts = bucket_start(data['time'], width)
+    first = np.flatnonzero(np.concatenate(([True], starts[1:] != starts[:-1])))
+
+    # Scalars, with missing values masked
+    x = np.column_stack([data[var] for var in VARS]).astype('float')
+    valid = np.isfinite(x) & (x != MISSING)
+    index = np.where(valid, np.arange(x.shape[0])[:, None], -1)
+    ilast = np.maximum.reduceat(index, first, axis=0)
+
+    # Wind vectors, from the direction the wind blows toward
+    wspd = data['wspd'].astype('float')
+    wdir = data['wdir'].astype('float')
+    wvalid = np.isfinite(wspd) & np.isfinite(wdir) & (wspd != MISSING) & (wdir != MISSING)
+    u = np.where(wvalid, -wspd*np.sin(np.radians(wdir)), 0.0)
+    v = np.where(wvalid, -wspd*np.cos(np.radians(wdir)), 0.0)
+    iwlast = np.maximum.reduceat(np.where(wvalid, np.arange(wdir.size), -1), first)
+
+    return {'time': starts[first], 'n': np.add.reduceat(np.ones(x.shape[0], dtype='int64'), first),
+            'sum': np.add.reduceat(np.where(valid, x, 0.0), first, axis=0),
+            'cnt': np.add.reduceat(valid.astype('int64'), first, axis=0),
+            'min': np.minimum.reduceat(np.where(valid, x, np.inf), first, axis=0),
+            'max': np.maximum.reduceat(np.where(valid, x, -np.inf), first, axis=0),
+            'last': np.where(ilast >= 0, np.take_along_axis(x, np.maximum(ilast, 0), axis=0), np.nan),
+            'u': np.add.reduceat(u, first), 'v': np.add.reduceat(v, first),
+            'nwind': np.add.reduceat(wvalid.astype('int64'), first),
+            'wdir_last': np.where(iwlast >= 0, wdir[np.maximum(iwlast, 0)], np.nan)}
+
+# Function to take one bucket out of a set of partials
+# part, partials dictionary
+# i, bucket index
+def take(part, i):
+
+    return {key: value[i:i+1] for key, value in part.items()}
+
+# Function to fold the partials of one bucket into another (same bucket)
+# into, partials of the bucket so far (updated in place)
+# part, newer partials of the same bucket
+def merge(into, part):
+
+    for key in ('n', 'sum', 'cnt', 'u', 'v', 'nwind'):
+        into[key] = into[key]+part[key]
+    into['min'] = np.minimum(into['min'], part['min'])
+    into['max'] = np.maximum(into['max'], part['max'])
+    into['last'] = np.where(np.isfinite(part['last']), part['last'], into['last'])
+    into['wdir_last'] = np.where(np.isfinite(part['wdir_last']), part['wdir_last'], into['wdir_last'])
+
+# Function to turn partials into rollup records
+# part, partials dictionary
+def finish(part):
+
+    out = np.zeros(part['time'].size, dtype=DTYPE)
+    out['time'] = part['time']
+    out['count'] = part['n']
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        empty = part['cnt'] == 0
+        stats = {'mean': part['sum']/part['cnt'], 'min': np.where(empty, np.nan, part['min']),
+                 'max': np.where(empty, np.nan, part['max']), 'last': part['last']}
+        for j, var in enumerate(VARS):
+            for stat in STATS:
+                out[f'{var}_{stat}'] = stats[stat][:, j]
+
+        u = part['u']/part['nwind']
+        v = part['v']/part['nwind']
+    out['wspd_vec'] = np.hypot(u, v)
+    out['wdir_vec'] = np.degrees(np.arctan2(-u, -v)) % 360.0
+    out['wdir_last'] = part['wdir_last']
+
+    return out
+
+# Function to roll up observations in one go
+# data, tower_binary structured array in time order
+# level, rollup level (see LEVELS)
+def aggregate(data, level):
+
+    if (data.size == 0):
+        return np.empty(0, dtype=DTYPE)
+
+    return finish(partials(data, LEVELS[level]))
+
+# Function to get the file of a level for one year
+# rdir, rollup directory
+# level, rollup level
+# year, tower clock year of the buckets
+def level_path(rdir, level, year):
+
+    return f'{rdir}/{level}/ValpoMetTower_{level}_{year}.bin'
+
+# Function to get the tower clock year of bucket start times
+# epoch, epoch seconds UTC
+def tower_year(epoch):
+
+    return (np.asarray(epoch, dtype='int64')+TOWER_UTC_OFFSET).astype('datetime64[s]').astype('datetime64[Y]').astype('int64')+1970
+
+# Function to append rollup records to a level's store
+# rdir, rollup directory
+# level, rollup level
+# records, rollup records in time order
+def append_records(rdir, level, records):
+
+    years = tower_year(records['time'])
+    for year in np.unique(years):
+        path = level_path(rdir, level, year)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tower_binary.open_for_append(path, DTYPE, MAGIC) as fn:
+            fn.write(records[years == year].tobytes())
+
+# Function to read a level over a time range
+# rdir, rollup directory
+# level, rollup level
+# start, first time to keep (epoch seconds UTC)
+# end, time to stop before (epoch seconds UTC)
+# Returns the rollup records in time order (only the files of the years in range are opened)
+def load_level(rdir, level, start, end):
+
+    chunks = []
+    for year in range(int(tower_year(start)), int(tower_year(end-1))+1):
+        path = level_path(rdir, level, year)
+        if os.path.exists(path):
+            chunks.append(tower_binary.time_slice(tower_binary.load_day(path, DTYPE, MAGIC), start, end))
+
+    if (len(chunks) == 0):
+        return np.empty(0, dtype=DTYPE)
+
+    return np.concatenate(chunks)
+
+# Function to pick the coarsest level that still resolves a span
+# start, end, the span (epoch seconds UTC)
+# npoints, fewest buckets wanted across the span (e.g. the plot's pixel width)
+def best_level(start, end, npoints=500):
+
+    for level, width in reversed(LEVELS.items()):
+        if ((end-start)/width >= npoints):
+            return level
+
+    return next(iter(LEVELS))
+
+# Function to read one day of observations
+# sdir, root directory for the data
+# day, the date of the daily file
+# Returns a tower_binary structured array, from the binary store if present and otherwise from the CSV file
+def load_day_records(sdir, day):
+
+    path = f'{sdir}/{day.year}/rapid_ValpoMetTower_{day.strftime("%Y%m%d")}'
+    if os.path.exists(path+'.bin'):
+        return np.array(tower_binary.load_day(path+'.bin'))
+    import tower_archive
+    if tower_archive.find(path+'.csv') is None:
+        return np.empty(0, dtype=tower_binary.DTYPE)
+
+    from time_axis import parse_stamps
+    frame = tower_archive.read_csv(path+'.csv')
+    data = np.empty(len(frame), dtype=tower_binary.DTYPE)
+    data['time'] = parse_stamps(frame['Server Date (UTC)'].values)
+    for name, column in zip(tower_binary.DTYPE.names[1:], frame.columns[1:9]):
+        data[name] = frame[column].values
+
+    return data[np.argsort(data['time'], kind='stable')]
+
+### Incremental rollups for the feed
+class Rollup:
+
+    # rdir, rollup directory
+    def __init__(self, rdir):
+
+        self.rdir = rdir
+        self.open = {level: None for level in LEVELS} # Partials of the open bucket per level
+        self.done = {} # End of the last stored bucket per level (epoch seconds UTC)
+
+        # Pick up after the last stored bucket
+        now = int(time.time())
+        for level, width in LEVELS.items():
+            self.done[level] = 0
+            for year in (int(tower_year(now)), int(tower_year(now))-1):
+                path = level_path(rdir, level, year)
+                if os.path.exists(path):
+                    stored = tower_binary.load_day(path, DTYPE, MAGIC)
+                    if (stored.size > 0):
+                        self.done[level] = int(stored['time'][-1])+width
+                        break
+
+    # Function to rebuild the open buckets from the binary daily store after a restart
+    # sdir, root directory for the data
+    def restore(self, sdir):
+
+        # Replay from the oldest bucket not stored yet (e.g. yesterday's after an outage over midnight),
+        # but no further back than restore_days
+        now = int(time.time())
+        start = max(min(self.done.values()), int(bucket_start(now-restore_days*LEVELS['1day'], LEVELS['1day'])))
+        day = datetime.fromtimestamp(start+TOWER_UTC_OFFSET, timezone.utc).date()
+        last = datetime.fromtimestamp(now+TOWER_UTC_OFFSET, timezone.utc).date()
+        while (day <= last):
+            data = load_day_records(sdir, day)
+            self.add_many(tower_binary.time_slice(data, start))
+            day += timedelta(days=1)
+
+    # Function to fold one observation in
+    # epoch, observation time (epoch seconds UTC)
+    # values, the eight observed values in tower_binary.DTYPE order
+    def add(self, epoch, values):
+
+        self.add_many(np.array([(epoch, *values)], dtype=tower_binary.DTYPE))
+
+    # Function to fold a run of observations in
+    # data, tower_binary structured array in time order
+    def add_many(self, data):
+
+        for level, width in LEVELS.items():
+            current = self.open[level]
+            oldest = self.done[level] if current is None else int(current['time'][0])
+            new = data[data['time'] >= oldest]
+            if (new.size == 0):
+                continue
+
+            # The first bucket may continue the open one
+            part = partials(new, width)
+            nbuckets = part['time'].size
+            i0 = 0
+            if (current is not None) and (current['time'][0] == part['time'][0]):
+                merge(current, take(part, 0))
+                i0 = 1
+            if (nbuckets == i0):
+                continue
+
+            # A new bucket has started, so the open one and all but the newest are complete
+            done = [finish(current)] if current is not None else []
+            done.append(finish({key: value[i0:nbuckets-1] for key, value in part.items()}))
+            self._store(level, np.concatenate(done))
+            self.open[level] = take(part, nbuckets-1)
+
+    # Function to store completed buckets
+    # level, rollup level
+    # records, rollup records of the buckets
+    def _store(self, level, records):
+
+        if (records.size == 0):
+            return
+        append_records(self.rdir, level, records)
+        self.done[level] = int(records['time'][-1])+LEVELS[level]
+
+    # Function to store the open buckets (only when no more data will follow, e.g. rebuilding history)
+    def flush(self):
+
+        for level in LEVELS:
+            if self.open[level] is not None:
+                self._store(level, finish(self.open[level]))
+                self.open[level] = None
+
+# Function to rebuild the rollups of whole years from the daily files
+# years, the years (tower clock) to rebuild
+def rebuild(years):
+
+    for year in years:
+        for level in LEVELS:
+            path = level_path(rollup_dir, level, year)
+            if os.path.exists(path):
+                os.remove(path)
+
+        rollup = Rollup(rollup_dir)
+        for level in LEVELS:
+            rollup.done[level] = int(bucket_start(np.datetime64(f'{year}-01-01', 's').astype('int64')-TOWER_UTC_OFFSET, 60))
+        end = int(np.datetime64(f'{year+1}-01-01', 's').astype('int64'))-TOWER_UTC_OFFSET
+
+        t0 = time.time()
+        day = date(year, 1, 1)
+        while (day.year == year):
+            rollup.add_many(tower_binary.time_slice(load_day_records(data_dir, day), None, end))
+            day += timedelta(days=1)
+        rollup.flush()
+        print(f'Rolled up {year} in {time.time()-t0:.1f} s', flush=True)
+
+if __name__ == '__main__':
+
+    if (len(sys.argv) < 2):
+        print('Usage: python tower_rollup.py YEAR [YEAR ...]')
+        sys.exit(1)
+
+    rebuild([int(year) for year in sys.argv[1:]])
@@ -0,0 +1,162 @@
+### Field extractor for the tower's status.xml page.
+### The page is a flat list of tags under one root. The tag name of each
+### field is learned once from its position in the first page (the same
+### positions the feed used with ElementTree) and saved to a JSON file
+### (tags_file), so later starts read by the saved names instead of learning
+### again from positions that a firmware update may have moved. Every page is
+### read in a single precompiled regex pass over the raw bytes with no tree.
+### Fields are found by name, so reordered tags are still read correctly (with
+### a warning), and a page without one of the saved tags raises TagMismatch,
+### which stops the feed with exit code EXIT_TAGS rather than guess (a
+### configuration error: the feed is not restarted until the map is fixed).
+### Unit conversions are applied to all values at once.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+from datetime import datetime
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# Position of each field under the root of status.xml
+POSITIONS = {'time': 1, 'date': 2, 'wdir': 4, 'wspd': 5, 'sdown': 6, 'temp': 10, 'rh': 11, 'pres': 12,
+             'day_rain': 14, 'rain': 16}
+
+# Numeric fields in the order the writer takes them
+VALUES = ('temp', 'rh', 'pres', 'rain', 'day_rain', 'wspd', 'wdir', 'sdown')
+
+# Unit conversions of VALUES (value*scale+offset): 'F to 'C, inHg to hPa, in to mm and mph to m/s
+SCALE = np.array([1.0/1.8, 1.0, 33.86, 25.4, 25.4, 0.447, 1.0, 1.0])
+OFFSET = np.array([-32.0/1.8, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+
+# Tower date (mm/dd/yy) and time (HH:MM:SS)
+STAMP = re.compile(rb'(\d{1,2})/(\d{1,2})/(\d{2})(\d{1,2}):(\d{1,2}):(\d{1,2})')
+
+# Exit code of the feeds when the saved tags no longer match (run_tower_feed.sh does not restart after it)
+EXIT_TAGS = 2
+
+# Raised when a page no longer has the saved tag names (not a ValueError, so the feed does not skip it as a bad page)
+class TagMismatch(RuntimeError):
+    pass
+
+### Helper functions
+
+# Function to learn the tag name of each field from its position
+# payload, raw status.xml bytes
+# Returns a dictionary of field, tag name
+def learn_tags(payload):
+
+    root = ET.fromstring(payload)
+    tags = {field: root[pos].tag for field, pos in POSITIONS.items()}
+    if (len(set(tags.values())) != len(tags)):
+        raise ValueError(f'status.xml tag names are not unique: {tags}')
+
+    return tags
+
+# Function to read a saved tag map
+# path, JSON file of field, tag name
+def load_tags(path):
+
+    with open(path, 'r') as fn:
+        tags = json.load(fn)
+    if (set(tags) != set(POSITIONS)):
+        raise ValueError(f'{path} does not list the fields {sorted(POSITIONS)}')
+
+    return tags
+
+# Function to save a tag map (written to a temporary file first so a crash leaves no partial map)
+# path, JSON file
+# tags, dictionary of field, tag name
+def save_tags(path, tags):
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path+'.tmp', 'w') as fn:
+        json.dump(tags, fn, indent=1, sort_keys=True)
+    os.replace(path+'.tmp', path)
+
+### Parser of status pages
+class StatusParser:
+
+    # tags, dictionary of field, tag name (None for the saved map, or to learn them from the first page)
+    # tags_file, JSON file the learned map is saved to and read back from, None to learn on every start
+    def __init__(self, tags=None, tags_file=None):
+
+        self.tags = None
+        self.pattern = None
+        self.tags_file = tags_file
+        self.checked = True # Saved maps are checked against the first page
+        if (tags is None) and (tags_file is not None) and os.path.exists(tags_file):
+            tags = load_tags(tags_file)
+            self.checked = False
+        if tags is not None:
+            self.compile(tags)
+
+    # Function to compare a saved map with the first page
+    # payload, raw status.xml bytes
+    def check(self, payload):
+
+        root = ET.fromstring(payload)
+        present = {child.tag for child in root}
+        missing = {field: tag for field, tag in self.tags.items() if tag not in present}
+        if (len(missing) > 0):
+            raise TagMismatch(f'status.xml no longer has the tags {missing} saved in {self.tags_file}; '
+                              f'check the page and fix or remove that file (by position the tags are now {learn_tags(payload)})')
+
+        moved = {field: tag for field, tag in learn_tags(payload).items() if (tag != self.tags[field])}
+        if (len(moved) > 0):
+            print('WARNING status.xml tags have moved, reading by the names in', self.tags_file, f'(by position now {moved})', flush=True)
+        self.checked = True
+
+    # Function to build the regex for a set of tag names
+    # tags, dictionary of field, tag name
+    def compile(self, tags):
+
+        self.tags = dict(tags)
+        self.fields = {tag.encode('ascii'): field for field, tag in self.tags.items()}
+        names = b'|'.join(re.escape(tag) for tag in self.fields)
+        self.pattern = re.compile(rb'<(' + names + rb')(?:\s[^>]*)?>\s*([^<]*?)\s*</\1\s*>')
+
+    # Function to extract the fields of one page
+    # payload, raw status.xml bytes
+    # Returns a dictionary of field, text (bytes)
+    def extract(self, payload):
+
+        if self.pattern is None:
+            self.compile(learn_tags(payload))
+            if self.tags_file is not None:
+                save_tags(self.tags_file, self.tags)
+        elif not self.checked:
+            self.check(payload)
+
+        found = {self.fields[tag]: text for tag, text in self.pattern.findall(payload)}
+        if (len(found) != len(self.fields)):
+            missing = [field for field in self.fields.values() if field not in found]
+            raise ValueError(f'status.xml is missing {missing}')
+
+        return found
+
+    # Function to convert extracted fields
+    # found, dictionary from extract
+    # Returns the tower time and the converted VALUES
+    def convert(self, found):
+
+        values = np.array([float(found[field]) for field in VALUES])*SCALE+OFFSET
+        stamp = STAMP.fullmatch(found['date']+found['time'])
+        if stamp is None:
+            raise ValueError(f'Bad tower time {found["date"]} {found["time"]}')
+        month, day, year, hour, minute, second = map(int, stamp.groups())
+        date = datetime(2000+year, month, day, hour, minute, second)
+
+        return date, values
+
+    # Function to parse one page
+    # payload, raw status.xml bytes
+    # Returns the tower time and the converted VALUES
+    def parse(self, payload):
+
+        return self.convert(self.extract(payload))
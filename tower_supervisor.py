@@ -0,0 +1,208 @@
+### Supervisor for the rapid tower feed.
+### Runs the poller from rapid_retrieve_data.py as a managed asyncio task,
+### records a heartbeat on every newly saved observation (in memory and as the
+### mtime of a heartbeat file), restarts the poller with exponential backoff
+### when no heartbeat arrives for stall_timeout seconds, and reports its status
+### as JSON over a local Unix socket.
+### SIGTERM/SIGINT stop the poller and flush and close the daily file.
+### A TagMismatch (tower_status.py) stops it too, with exit code EXIT_TAGS.
+### Feed metrics (tower_metrics.py) go to feed.metrics_file and, if
+### feed.metrics_port is set, to http://127.0.0.1:{port}/metrics.
+###
+### Start with "python tower_supervisor.py"
+### Query with "python tower_supervisor.py status"
+###
+### Christopher Phillips
+### Valparaiso University
+
+##### START OPTIONS #####
+
+# Seconds without a saved observation before the poller is restarted
+stall_timeout = 5.0
+
+# Restart backoff (seconds): first delay and the cap (it resets once the tower answers again)
+min_backoff = 1.0
+max_backoff = 30.0
+
+# Heartbeat file (its mtime is updated on every saved observation)
+heartbeat_file = '/tmp/tower_feed.heartbeat'
+
+# Unix socket for status queries
+status_socket = '/tmp/tower_feed.sock'
+
+#####  END OPTIONS  #####
+
+### Import libraries
+from datetime import datetime
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import rapid_retrieve_data as feed
+from tower_metrics import METRICS
+from tower_poller import TowerPoller, poll_forever
+from tower_status import EXIT_TAGS, TagMismatch
+
+### The supervisor
+class Supervisor:
+
+    def __init__(self):
+
+        self.writer = feed.make_writer()
+        self.started = time.time()
+        self.heartbeat = None # Monotonic time of the last saved observation
+        self.last_obs = None # Server time of the last saved observation
+        self.restarts = 0
+        self.fetched = False # True if the last poller got and processed any page from the tower
+        self.state = 'starting'
+        self.stop = None
+        self.error = None # Configuration error that stopped the feed (TagMismatch)
+
+        # Make sure the heartbeat file exists so its mtime can be updated
+        open(heartbeat_file, 'a').close()
+
+    # Function called by the poller for every status page
+    def handle(self, server_time, payload):
+
+        # Only a page that was processed without an error resets the restart backoff
+        saved = feed.process(self.writer, server_time, payload)
+        self.fetched = True
+
+        # Repeated or unreadable pages are not a heartbeat (a frozen logger still answers)
+        if not saved:
+            return
+        self.heartbeat = time.monotonic()
+        self.last_obs = server_time
+        os.utime(heartbeat_file)
+
+    # Function to describe the current state
+    def status(self):
+
+        age = None if self.heartbeat is None else round(time.monotonic()-self.heartbeat, 1)
+        fetch = METRICS.histograms.get('fetch_seconds')
+        return {'state': self.state, 'pid': os.getpid(), 'uptime': round(time.time()-self.started, 1),
+                'restarts': self.restarts, 'heartbeat_age': age,
+                'last_obs': None if self.last_obs is None else self.last_obs.strftime('%Y-%m-%d_%H:%M:%S'),
+                'file': self.writer.path, 'counters': dict(METRICS.counters),
+                'fetch_p50': fetch.quantile(0.5) if fetch else None, 'fetch_p99': fetch.quantile(0.99) if fetch else None}
+
+    # Function to answer one status query
+    async def serve_status(self, reader, writer):
+
+        writer.write((json.dumps(self.status())+'\n').encode('utf-8'))
+        await writer.drain()
+        writer.close()
+
+    # Function to run the poller until it stalls, fails or a stop is requested
+    # Returns True if a stop was requested
+    async def run_once(self):
+
+        poller = TowerPoller(feed.url, timeout=feed.timeout)
+        task = asyncio.create_task(poll_forever(poller, self.handle, interval=feed.interval, max_backoff=feed.max_backoff))
+        started = time.monotonic()
+        self.heartbeat = None
+        self.fetched = False
+        self.state = 'running'
+
+        try:
+            while not self.stop.is_set():
+                try:
+                    await asyncio.wait_for(self.stop.wait(), 1.0)
+                except asyncio.TimeoutError:
+                    pass
+                self.writer.flush(force=False)
+                METRICS.set('restarts', self.restarts)
+                if self.heartbeat is not None:
+                    METRICS.set('heartbeat_age_seconds', round(time.monotonic()-self.heartbeat, 1))
+
+                if task.done():
+                    err = None if task.cancelled() else task.exception()
+
+                    # Changed tags are a configuration error, restarting the poller cannot fix them
+                    if isinstance(err, TagMismatch):
+                        print('ERROR', err, flush=True)
+                        self.error = err
+                        self.state = 'stopped, status.xml tags changed'
+                        self.stop.set()
+                        return True
+
+                    print('WARNING poller exited:', 'cancelled' if task.cancelled() else err, flush=True)
+                    return False
+
+                last = started if self.heartbeat is None else self.heartbeat
+                if (time.monotonic()-last > stall_timeout):
+                    print(f'WARNING no observation for {time.monotonic()-last:.0f} s, restarting poller', flush=True)
+                    return False
+            return True
+        finally:
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+            await poller.close()
+
+    # Function to supervise the poller until SIGTERM/SIGINT
+    async def run(self):
+
+        loop = asyncio.get_running_loop()
+        self.stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop.set)
+
+        if os.path.exists(status_socket):
+            os.remove(status_socket)
+        server = await asyncio.start_unix_server(self.serve_status, path=status_socket)
+        exporter = asyncio.create_task(METRICS.write_forever(feed.metrics_file, feed.metrics_interval))
+        http = None if feed.metrics_port is None else await METRICS.serve(port=feed.metrics_port)
+
+        backoff = 0.0
+        try:
+            while not await self.run_once():
+                self.restarts += 1
+                backoff = min_backoff if self.fetched else min(max(min_backoff, backoff*2.0), max_backoff)
+                self.state = f'restarting in {backoff:.0f} s'
+                print(f'[{datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")} UTC] {self.state}', flush=True)
+                try:
+                    await asyncio.wait_for(self.stop.wait(), backoff)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.state = 'stopping'
+            exporter.cancel()
+            for srv in (server, http):
+                if srv is not None:
+                    srv.close()
+                    await srv.wait_closed()
+            if os.path.exists(status_socket):
+                os.remove(status_socket)
+            self.writer.close()
+            METRICS.write(feed.metrics_file)
+            print('Tower feed stopped cleanly', flush=True)
+
+# Function to print the status of a running supervisor
+def print_status():
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(2.0)
+            sock.connect(status_socket)
+            print(sock.makefile('r').readline().strip())
+    except OSError:
+        print('Tower feed not running')
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+
+    if (len(sys.argv) > 1) and (sys.argv[1] == 'status'):
+        sys.exit(print_status())
+
+    supervisor = Supervisor()
+    asyncio.run(supervisor.run())
+    sys.exit(EXIT_TAGS if supervisor.error else 0)
@@ -0,0 +1,194 @@
+### Persistent writer for the rapid met tower feed.
+### Keeps the daily file open in append mode and remembers the last written
+### timestamp in memory, so each observation costs a single write no matter
+### how large the day's file has grown. Only the tail of an existing file is
+### read, and only when the file is (re)opened.
+### Rows are buffered in memory and written out every flush_interval seconds
+### or flush_rows rows (whichever comes first), optionally followed by an
+### fsync, so a crash loses at most one flush interval of data.
+### Observations can also be published straight away to a shared memory ring
+### buffer (tower_ring.py) for other scripts on the same machine and folded
+### into the multi-resolution rollups (tower_rollup.py) and the streaming QC
+### (qc_engine.StreamingQC), which writes the QC'd files as the data arrive.
+###
+### Christopher Phillips
+### Valparaiso University
+
+### Import libraries
+import calendar
+import os
+import time
+from file_tail import read_last_line
+import tower_binary
+from tower_metrics import METRICS
+
+# Header of the rapid data files
+HEADER = 'Server Date (UTC),Temp (C),RH (%),Pres (mb),Rain Rate (mm/hr),Daily Total Rain (mm),Wspd (m/s),Wdir (deg),SWdown (W/m2)'
+
+# Timestamp format used in the data files
+STAMP = '%Y-%m-%d_%H:%M:%S'
+
+# When to fsync: 'never' (leave it to the OS), 'flush' (after every flush) or 'close' (when a file is closed)
+FSYNC_POLICIES = ('never', 'flush', 'close')
+
+### Writer for one file per (tower) day
+class DailyWriter:
+
+    # sdir, root directory for the data (files go into annual folders)
+    # prefix, file name prefix
+    # header, header line written to new files
+    # binary, also write the binary daily store (see tower_binary.py)
+    # flush_interval, longest time (seconds) a row is held in memory (0 writes every row at once)
+    # flush_rows, number of buffered rows that forces a flush
+    # fsync, fsync policy (see FSYNC_POLICIES)
+    # ring, tower_ring.RingWriter to publish to, None for none (closed with the writer)
+    # rollup, tower_rollup.Rollup to update, None for none
+    # qc, qc_engine.StreamingQC to feed, None for none (flushed and closed with the writer)
+    def __init__(self, sdir, prefix='rapid_ValpoMetTower', header=HEADER, binary=False, flush_interval=0.0, flush_rows=1, fsync='never', ring=None, rollup=None, qc=None):
+
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'fsync must be one of {FSYNC_POLICIES}, not {fsync!r}')
+
+        self.sdir = sdir
+        self.prefix = prefix
+        self.header = header
+        self.binary = binary
+        self.flush_interval = flush_interval
+        self.flush_rows = max(1, flush_rows)
+        self.fsync = fsync
+        self.ring = ring
+        self.rollup = rollup
+        self.qc = qc
+
+        self.fn = None # Open file handle
+        self.fn_bin = None # Open binary file handle
+        self.day = None # Day (YYYYMMDD) of the open file
+        self.path = None # Path of the open file
+        self.last_stamp = None # Last written timestamp string
+        self.last_date = None # Last written tower date
+        self.pending = [] # Buffered CSV rows
+        self.pending_bin = [] # Buffered binary records
+        self.last_flush = time.monotonic() # Time of the last flush
+
+    # Function to (re)open the file for a given day
+    # date, tower date of the observation
+    def _open(self, date):
+
+        self._close_files()
+
+        # The day is only set once the files are open, so a failed open is tried again on the next row
+        self.day = None
+        day = date.strftime('%Y%m%d')
+        self.path = f'{self.sdir}/{date.strftime("%Y")}/{self.prefix}_{day}.csv'
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Recover the last timestamp from the tail of an existing file
+        self.last_stamp = None
+        self.last_date = None
+        new_file = (not os.path.exists(self.path)) or (os.path.getsize(self.path) == 0)
+        if not new_file:
+            last = read_last_line(self.path).split(',')[0]
+            if (last != self.header.split(',')[0]):
+                self.last_stamp = last
+
+        self.fn = open(self.path, 'a')
+        if new_file:
+            print('WARNING starting new file', self.path)
+            METRICS.inc('new_files')
+            self.fn.write(self.header)
+            self.fn.flush()
+
+        if self.binary:
+            self.fn_bin = tower_binary.open_for_append(self.path[:-4]+'.bin')
+        self.day = day
+
+    # Function to write one observation
+    # date, tower date of the observation (selects the daily file)
+    # server_time, time the observation was pulled (written to the file)
+    # values, observed values in header order
+    # Returns True if written, False if the observation was a duplicate
+    def write(self, date, server_time, values):
+
+        # Roll over to a new file at the date boundary
+        if (date.strftime('%Y%m%d') != self.day):
+            self._open(date)
+
+        # Check that not saving a duplicate time
+        stamp = server_time.strftime(STAMP)
+        if (date == self.last_date) or (stamp == self.last_stamp):
+            return False
+
+        epoch = calendar.timegm(server_time.utctimetuple())
+        self.pending.append(f'\n{stamp},'+','.join('' if (v != v) else f'{v:.2f}' for v in values)) # NaN as empty
+        if self.fn_bin is not None:
+            self.pending_bin.append(tower_binary.pack(epoch, values))
+        if self.ring is not None:
+            self.ring.append(epoch, values)
+        if self.rollup is not None:
+            self.rollup.add(epoch, values)
+        if self.qc is not None:
+            self.qc.add(date, server_time, values)
+
+        self.last_stamp = stamp
+        self.last_date = date
+        self.flush(force=False)
+
+        return True
+
+    # Function to write the buffered rows to disk
+    # force, False to flush only if flush_interval or flush_rows has been reached
+    #        (call it periodically so rows are not held while the feed is quiet)
+    def flush(self, force=True):
+
+        if self.qc is not None:
+            self.qc.flush(force)
+        if (len(self.pending) == 0) or (self.fn is None):
+            return
+        if (not force) and (len(self.pending) < self.flush_rows) and (time.monotonic()-self.last_flush < self.flush_interval):
+            return
+
+        # Whole rows go out in one write so readers never see a partial flush
+        with METRICS.span('flush'):
+            self.fn.write(''.join(self.pending))
+            self.fn.flush()
+            if self.fn_bin is not None:
+                self.fn_bin.write(b''.join(self.pending_bin))
+                self.fn_bin.flush()
+            if (self.fsync == 'flush'):
+                self._sync()
+
+        self.pending = []
+        self.pending_bin = []
+        self.last_flush = time.monotonic()
+
+    # Function to fsync the open files
+    def _sync(self):
+
+        for fn in (self.fn, self.fn_bin):
+            if fn is not None:
+                os.fsync(fn.fileno())
+
+    # Function to close the open files (buffered rows are written first)
+    def _close_files(self):
+
+        self.flush()
+        if (self.fsync != 'never'):
+            self._sync()
+
+        if self.fn is not None:
+            self.fn.close()
+            self.fn = None
+        if self.fn_bin is not None:
+            self.fn_bin.close()
+            self.fn_bin = None
+
+    # Function to close the open files, the ring buffer and the streaming QC
+    def close(self):
+
+        self._close_files()
+        if self.qc is not None:
+            self.qc.close()
+            self.qc = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
@@ -1,6 +1,8 @@
 ### This script is desgiend to run on a cron schedule.
 ### It checks the data directory to see if the data is being updated.
 ### If the data is not being updated, it restarts the data script.
+### Only the last record of the day's file is read (seeking from the end),
+### so a check costs milliseconds and does not need pandas.
 ###
 ### Christopher Phillips
 ### Valparaiso University
@@ -14,26 +16,39 @@ data_dir = '/archive/campus_mesonet_data/mesonet_data/met_tower'
 threshold = 1800.0
 
 #####  END OPTIONS  #####
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import os
-import pandas
-import pytz
+from file_tail import read_last_line
 
+# Function to get the time of the newest record
+# date, the current local date
+# Returns the last record time (UTC) or None if there is no data
+def last_record(date):
+
+    # Right after midnight today's file may not exist yet, so fall back to yesterday's
+    for day in (date, date-timedelta(days=1)):
+        path = f'{data_dir}/{day.year}/rapid_ValpoMetTower_{day.strftime("%Y%m%d")}.csv'
+        if not os.path.exists(path):
+            continue
+        try:
+            return datetime.strptime(read_last_line(path).split(',')[0], '%Y-%m-%d_%H:%M:%S')
+        except ValueError: # Header only
+            continue
+
+    return None
 
 # Grab the current date (local time)
-#timezone = ZoneInfo('America/Central')
-timezone = pytz.timezone('US/Central')
-date = datetime.now(timezone)
+date = datetime.now(ZoneInfo('America/Chicago'))
 date_utc = datetime.utcnow()
 
-# Read the data and get the final time
-data = pandas.read_csv(f'{data_dir}/{date.year}/rapid_ValpoMetTower_{date.strftime("%Y%m%d")}.csv')
-last_date = datetime.strptime(data['Server Date (UTC)'].values[-1], '%Y-%m-%d_%H:%M:%S')
+# Read the final time
+last_date = last_record(date)
 
 # Check if data if file is updating and re-start job if necessary
-if ((date_utc-last_date).total_seconds() >= threshold):
-    os.system('run_tower_feed.sh start')
-    fn = open('watchdog.log', 'a')
-    fn.write('\n Restarted job on {date_utc.strftime("%Y-%m-%d %H%M")} UTC')
-    fn.close()
\ No newline at end of file
+if (last_date is None) or ((date_utc-last_date).total_seconds() >= threshold):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    os.system(f'cd {script_dir} && ./run_tower_feed.sh start')
+    fn = open(f'{script_dir}/watchdog.log', 'a')
+    fn.write(f'\n Restarted job on {date_utc.strftime("%Y-%m-%d %H%M")} UTC')
+    fn.close()